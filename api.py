@@ -1,30 +1,39 @@
-from uuid import uuid4
-
 import flask
 from flask_restful import Resource, Api
 
-from rStream.libs import reddit
-from rStream.libs.cache import ExpiringDict
-
-
-TIMEOUT = 5 * 60
+from rStream import service
+from rStream.libs import http_client, metrics, reddit
+from rStream.service import PULL, ENCODE
 
 
 app = flask.Flask(__name__)
 api = Api(app)
-content_store = ExpiringDict()
 
 
-def take_n(iterable, number):
-    results = []
+def flag(name):
+    """Whether the query string switches on option `name`"""
+    return flask.request.args.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+def stream_n(iterable, number, fmt, served):
+    """Yields up to `number` encoded records, each as soon as it is ready
+
+    `served` is called with the records once they have all been sent.
+    """
+    records = []
     for __ in range(number):
         try:
-            item = next(iterable)
-            results.append(item)
+            with metrics.timer(PULL):
+                record = next(iterable)
         except StopIteration:
             break
+        records.append(record)
+        yield service.encode_record(record, fmt)
+    served(records)
 
-    return results
+
+def media_url(ident):
+    return flask.url_for('media', ident=ident)
 
 
 class DummyResource(Resource):
@@ -34,14 +43,8 @@ class DummyResource(Resource):
 
 class ViewSubs(Resource):
     def get(self, subs):
-        selected = subs.split('+')
-        stream = reddit.SubredditsStream(selected,
-                                         key=lambda x: x.score,
-                                         func='get_hot')
-
-        ident = flask.session['id'] = str(uuid4())
-        app.logger.debug('New UUID: {}'.format(ident))
-        content_store[ident] = reddit.submission_filter(stream)
+        selected, cursor = service.new_cursor(subs, flag)
+        flask.session['id'] = service.start_session(cursor)
 
         return {
             'SubsSelected': selected
@@ -50,18 +53,90 @@ class ViewSubs(Resource):
 
 class IterSubs(Resource):
     def get(self, count):
-        ident = flask.session['id']
-        #TODO: if stream has timed out, redirect to error page, or flash
-        filtered_stream = content_store.get(ident)
+        ident = flask.session.get('id')
+        session = service.load_session(ident)
+        if session is None:
+            return {'message': 'Unknown or expired session'}, 404
         app.logger.debug('Retrieved UUID: {}'.format(ident))
-        return flask.jsonify(take_n(filtered_stream, count))
+
+        def served(records):
+            service.served(ident, session, records, count)
+
+        stream = service.request_stream(session, media_url)
+
+        fmt = flask.request.args.get('format')
+        if fmt is None:
+            with metrics.timer(PULL):
+                records = service.take_n(stream, count)
+            served(records)
+            with metrics.timer(ENCODE, 'json'):
+                return flask.jsonify([dict(x) for x in records])
+        error = service.format_error(fmt)
+        if error is not None:
+            message, status = error
+            return {'message': message}, status
+
+        # The context is kept for media records, which are given urls
+        chunks = stream_n(stream, count, fmt, served)
+        return flask.Response(flask.stream_with_context(chunks),
+                              mimetype=service.STREAM_FORMATS[fmt])
+
+
+class SubmissionImages(Resource):
+    def get(self, ident):
+        images = reddit.deferred_images(ident)
+        if images is None:
+            return {'message': 'Unknown or expired images id'}, 404
+        return {'images': images}
+
+
+class MediaProxy(Resource):
+    def get(self, ident):
+        # Range and conditional requests are handled, and the file is handed
+        # to the server's file wrapper, so it can use sendfile
+        def send(path):
+            return flask.send_file(path, conditional=True,
+                                   max_age=service.MEDIA_MAX_AGE)
+
+        try:
+            response = service.serve_media(ident, send)
+        except http_client.HTTPError as exc:
+            return {'message': 'Upstream error {}'.format(exc.status)}, 502
+        except OSError as exc:
+            return {'message': 'Upstream error: {}'.format(exc)}, 502
+        if response is None:
+            return {'message': 'Unknown media id'}, 404
+        return response
+
+
+class ImageVariant(Resource):
+    def get(self, name):
+        pipeline = service.variant_pipeline()
+        if pipeline is None:
+            return {'message': 'Image variants are disabled'}, 404
+        return flask.send_from_directory(pipeline.directory, name,
+                                         conditional=True,
+                                         max_age=service.MEDIA_MAX_AGE)
+
+
+class Metrics(Resource):
+    def get(self):
+        if not metrics.ENABLED:
+            return {'message': 'Metrics are disabled'}, 404
+        return flask.Response(metrics.REGISTRY.render(),
+                              mimetype='text/plain; version=0.0.4')
 
 
 api.add_resource(DummyResource, '/')
+api.add_resource(Metrics, '/metrics')
 api.add_resource(ViewSubs, '/<string:subs>')
 api.add_resource(IterSubs, '/next/<int:count>')
+api.add_resource(SubmissionImages, '/images/<string:ident>')
+api.add_resource(MediaProxy, '/media/<string:ident>', endpoint='media')
+api.add_resource(ImageVariant, service.VARIANTS_URL + '<string:name>')
 
-app.secret_key = 'test'
+app.secret_key = service.SECRET_KEY
 
 if __name__ == '__main__':
+    reddit.preload()
     app.run(debug=True)
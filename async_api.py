@@ -0,0 +1,345 @@
+"""ASGI version of the endpoints of api.py
+
+Serve with any ASGI server, e.g. `uvicorn rStream.async_api:app`. The
+routes and responses are those of api.py: select subreddits with
+`/<subs>`, then page through the session with `/next/<count>`, which
+also streams with `?format=ndjson` or `?format=msgpack`. Sessions are
+identified by a random id in a cookie.
+
+Options and session cursors come from service.py, as for api.py, so a
+session can move between this app and api.py when they share a session
+store. Sessions read async streams of libs.async_reddit, which suspend on
+praw and resolutions instead of holding a thread, so the loop goes on
+serving other requests meanwhile. Followed sessions are refused, see
+`service.async_cursor_error`.
+"""
+from http import cookies
+import json
+import mimetypes
+import os
+import re
+from urllib import parse
+
+from rStream import service
+from rStream.libs import async_reddit, http_client, metrics, reddit
+from rStream.service import PULL, ENCODE
+
+
+SESSION_COOKIE = 'rstream_session'
+FILE_CHUNK = 64 * 1024  # Bytes of a served file read at once
+
+
+class Request():
+    def __init__(self, scope):
+        self.method = scope['method']
+        self.path = scope['path']
+        query = parse.parse_qs(scope.get('query_string', b'').decode())
+        self.args = {name: values[-1] for name, values in query.items()}
+
+        self.headers = {}
+        self.cookies = {}
+        for name, value in scope.get('headers', ()):
+            self.headers[name.decode('latin-1')] = value.decode('latin-1')
+            if name == b'cookie':
+                parsed = cookies.SimpleCookie(value.decode('latin-1'))
+                self.cookies.update((x, y.value) for x, y in parsed.items())
+
+    def flag(self, name):
+        """Whether the query string switches on option `name`"""
+        return self.args.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+class Response():
+    """Response with a complete body, or a `chunks` async iterator of bytes"""
+    def __init__(self, body=b'', status=200, content_type='application/json',
+                 headers=None, chunks=None):
+        self.body = body
+        self.status = status
+        self.content_type = content_type
+        self.headers = list(headers or ())
+        self.chunks = chunks
+
+    async def send(self, send):
+        headers = [(b'content-type', self.content_type.encode())]
+        headers.extend((x.encode(), y.encode()) for x, y in self.headers)
+        if self.chunks is None:
+            headers.append((b'content-length', str(len(self.body)).encode()))
+
+        await send({'type': 'http.response.start', 'status': self.status,
+                    'headers': headers})
+        if self.chunks is None:
+            await send({'type': 'http.response.body', 'body': self.body})
+            return
+
+        try:
+            async for chunk in self.chunks:
+                await send({'type': 'http.response.body', 'body': chunk,
+                            'more_body': True})
+        finally:
+            # Releases what the chunks hold if the client went away
+            close = getattr(self.chunks, 'aclose', None)
+            if close is not None:
+                await close()
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+def json_response(data, status=200, headers=None):
+    return Response(json.dumps(data).encode(), status, headers=headers)
+
+
+def media_url(ident):
+    return '/media/' + ident
+
+
+def open_file(path):
+    """Opens `path` to be served, returns it with its file, size and ETag"""
+    source = open(path, 'rb')
+    try:
+        stat = os.fstat(source.fileno())
+    except OSError:
+        source.close()
+        raise
+    etag = '"{:x}-{:x}"'.format(stat.st_mtime_ns, stat.st_size)
+    return path, source, stat.st_size, etag
+
+
+def etag_matches(header, etag):
+    """Whether an If-None-Match `header` names `etag`"""
+    if header is None:
+        return False
+    tags = {x.strip() for x in header.split(',')}
+    return '*' in tags or etag in tags or 'W/' + etag in tags
+
+
+def byte_range(header, size):
+    """Returns the start and stop of the `Range` header over `size` bytes
+
+    Returns None to send the whole file, when there is no header, one this
+    does not parse, or one of several ranges. Raises ValueError for a
+    range past the end of the file.
+    """
+    if header is None:
+        return None
+    unit, __, spec = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        return None
+    first, __, last = spec.strip().partition('-')
+    try:
+        first = int(first) if first else None
+        last = int(last) if last else None
+    except ValueError:
+        return None
+
+    if first is None:
+        if last is None:
+            return None
+        start, stop = max(size - last, 0), size
+    elif last is None:
+        start, stop = first, size
+    elif last < first:
+        return None
+    else:
+        start, stop = first, min(last + 1, size)
+    if start >= size:
+        raise ValueError('Range not satisfiable')
+    return start, stop
+
+
+async def read_chunks(source, start, stop):
+    try:
+        source.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = await async_reddit._run(None, source.read,
+                                            min(FILE_CHUNK, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        source.close()
+
+
+def file_response(request, path, source, size, etag):
+    """Streams the open file `source`, honouring Range and If-None-Match"""
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    cache = 'public, max-age={}'.format(service.MEDIA_MAX_AGE)
+    headers = [('cache-control', cache), ('etag', etag),
+               ('accept-ranges', 'bytes')]
+
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        source.close()
+        return Response(status=304, content_type=content_type,
+                        headers=headers)
+    try:
+        span = byte_range(request.headers.get('range'), size)
+    except ValueError:
+        source.close()
+        headers.append(('content-range', 'bytes */{}'.format(size)))
+        return Response(status=416, content_type=content_type,
+                        headers=headers)
+
+    status = 200
+    start, stop = 0, size
+    if span is not None:
+        status = 206
+        start, stop = span
+        headers.append(('content-range',
+                        'bytes {}-{}/{}'.format(start, stop - 1, size)))
+    headers.append(('content-length', str(stop - start)))
+    return Response(status=status, content_type=content_type,
+                    headers=headers, chunks=read_chunks(source, start, stop))
+
+
+async def root(request):
+    return json_response({})
+
+
+async def view_subs(request, subs):
+    selected, cursor = service.new_cursor(subs, request.flag)
+    error = service.async_cursor_error(cursor)
+    if error is not None:
+        message, status = error
+        return json_response({'message': message}, status)
+    ident = service.start_async_session(cursor)
+
+    cookie = '{}={}; Path=/; HttpOnly'.format(SESSION_COOKIE, ident)
+    return json_response({'SubsSelected': selected},
+                         headers=[('set-cookie', cookie)])
+
+
+async def iter_subs(request, count):
+    ident = request.cookies.get(SESSION_COOKIE)
+    session = service.load_async_session(ident)
+    if session is None:
+        return json_response({'message': 'Unknown or expired session'}, 404)
+    error = service.async_cursor_error(session.cursor)
+    if error is not None:
+        message, status = error
+        return json_response({'message': message}, status)
+    count = int(count)
+
+    def served(records):
+        service.served(ident, session, records, count)
+
+    stream = service.async_request_stream(session, media_url)
+
+    fmt = request.args.get('format')
+    if fmt is None:
+        async with session.lock:
+            with metrics.timer(PULL):
+                records = await service.async_take_n(stream, count)
+            served(records)
+        with metrics.timer(ENCODE, 'json'):
+            return json_response([dict(x) for x in records])
+    error = service.format_error(fmt)
+    if error is not None:
+        message, status = error
+        return json_response({'message': message}, status)
+
+    async def chunks():
+        records = []
+        async with session.lock:
+            for __ in range(count):
+                with metrics.timer(PULL):
+                    try:
+                        record = await stream.__anext__()
+                    except StopAsyncIteration:
+                        break
+                records.append(record)
+                yield service.encode_record(record, fmt)
+            served(records)
+
+    return Response(content_type=service.STREAM_FORMATS[fmt],
+                    chunks=chunks())
+
+
+async def submission_images(request, ident):
+    images = await async_reddit._run(reddit.resolve_pool(),
+                                     reddit.deferred_images, ident)
+    if images is None:
+        return json_response({'message': 'Unknown or expired images id'}, 404)
+    return json_response({'images': images})
+
+
+async def media_proxy(request, ident):
+    try:
+        found = await async_reddit._run(None, service.serve_media,
+                                        ident, open_file)
+    except http_client.HTTPError as exc:
+        return json_response(
+            {'message': 'Upstream error {}'.format(exc.status)}, 502)
+    except OSError as exc:
+        return json_response(
+            {'message': 'Upstream error: {}'.format(exc)}, 502)
+    if found is None:
+        return json_response({'message': 'Unknown media id'}, 404)
+    return file_response(request, *found)
+
+
+async def image_variant(request, name):
+    pipeline = service.variant_pipeline()
+    if pipeline is None:
+        return json_response({'message': 'Image variants are disabled'}, 404)
+    try:
+        found = await async_reddit._run(
+            None, open_file, os.path.join(pipeline.directory, name))
+    except OSError:
+        return json_response({'message': 'Not found'}, 404)
+    return file_response(request, *found)
+
+
+async def metrics_text(request):
+    if not metrics.ENABLED:
+        return json_response({'message': 'Metrics are disabled'}, 404)
+    return Response(metrics.REGISTRY.render().encode(),
+                    content_type='text/plain; version=0.0.4')
+
+
+# Routes are tried in order, as in api.py fixed paths win over '/<subs>'
+ROUTES = [
+    (re.compile(r'/'), root),
+    (re.compile(r'/metrics'), metrics_text),
+    (re.compile(r'/next/(\d+)'), iter_subs),
+    (re.compile(r'/images/([^/]+)'), submission_images),
+    (re.compile(r'/media/([^/]+)'), media_proxy),
+    (re.compile(re.escape(service.VARIANTS_URL) + r'([^/]+)'), image_variant),
+    (re.compile(r'/([^/]+)'), view_subs),
+]
+
+
+async def app(scope, receive, send):
+    """ASGI application serving the routes of api.py"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # As api.py does before serving, off the loop as it blocks
+                try:
+                    await async_reddit._run(None, reddit.preload)
+                except Exception as exc:
+                    await send({'type': 'lifespan.startup.failed',
+                                'message': str(exc)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    request = Request(scope)
+    for pattern, handler in ROUTES:
+        match = pattern.fullmatch(request.path)
+        if match is not None:
+            break
+    else:
+        handler = None
+
+    if handler is None:
+        response = json_response({'message': 'Not found'}, 404)
+    elif request.method != 'GET':
+        response = json_response({'message': 'Method not allowed'}, 405)
+    else:
+        response = await handler(request, *match.groups())
+    await response.send(send)
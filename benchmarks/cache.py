@@ -0,0 +1,85 @@
+"""Thread count and throughput of ExpiringDict with many live sessions
+
+Run with `python -m rStream.benchmarks.cache [--sessions N] [--baseline]`.
+Results are printed as JSON. `--baseline` also measures the old approach
+of one ExpirationTimer thread per entry, which needs as many OS threads as
+there are sessions; keep `--sessions` modest when using it.
+"""
+import argparse
+import json
+import threading
+import time
+
+from rStream.libs import cache
+
+
+def _timed(func, repeat):
+    start = time.perf_counter()
+    for index in range(repeat):
+        func(index)
+    elapsed = time.perf_counter() - start
+    return {
+        'seconds': elapsed,
+        'ops_per_second': repeat / elapsed if elapsed else float('inf')
+    }
+
+
+def bench_expiringdict(sessions):
+    store = cache.ExpiringDict()
+    threads_before = threading.active_count()
+
+    def set_item(index):
+        store[index] = index
+
+    def get_item(index):
+        store[index]
+
+    results = {
+        'sessions': sessions,
+        'set': _timed(set_item, sessions),
+        'get': _timed(get_item, sessions),
+        'threads_added': threading.active_count() - threads_before,
+    }
+
+    for index in range(sessions):
+        del store[index]
+    return results
+
+
+def bench_timer_per_entry(sessions):
+    threads_before = threading.active_count()
+    timers = []
+
+    def set_item(index):
+        timers.append(cache.ExpirationTimer(cache.TIMEOUT, lambda: None))
+
+    def get_item(index):
+        timers[index].reset()
+
+    results = {
+        'sessions': sessions,
+        'set': _timed(set_item, sessions),
+        'get': _timed(get_item, sessions),
+        'threads_added': threading.active_count() - threads_before,
+    }
+
+    for timer in timers:
+        timer.cancel()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=10000)
+    parser.add_argument('--baseline', action='store_true')
+    args = parser.parse_args(argv)
+
+    results = {'expiringdict': bench_expiringdict(args.sessions)}
+    if args.baseline:
+        results['timer_per_entry'] = bench_timer_per_entry(args.sessions)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""Offline stand-ins for Reddit, Imgur and DeviantArt used by the benchmarks
+
+Synthetic subreddits play the part of praw's, like the MockSubreddit of
+the tests, and LocalUpstream serves Imgur album and DeviantArt oEmbed
+lookups from a local HTTP server with a configurable latency.
+"""
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+
+from rStream.libs import reddit, source_managers
+
+
+URL_TEMPLATES = (
+    ('direct', 'http://i.imgur.com/{id}.jpg'),
+    ('imgur', 'http://imgur.com/{id}'),
+    ('album', 'http://imgur.com/a/{id}'),
+    ('gfycat', 'http://gfycat.com/{id}'),
+    ('deviantart', 'http://artist.deviantart.com/art/deviation-{id}'),
+    ('unsupported', 'http://example.com/comments/{id}/'),
+)
+
+
+class SyntheticSubmission():
+    def __init__(self, subreddit, index, score, created, url):
+        self.id = '{}{}'.format(subreddit.display_name, index)
+        self.fullname = 't3_' + self.id
+        self.url = url
+        self.score = score
+        self.title = 'Synthetic submission {}'.format(self.id)
+        self.over_18 = False
+        self.permalink = 'https://reddit.com/r/{}/comments/{}/'.format(
+            subreddit.display_name, self.id)
+        self.subreddit = subreddit
+        self.created = self.created_utc = created
+
+
+class SyntheticSubreddit():
+    """Subreddit of `size` submissions, in descending score order
+
+    Any `get_` query returns an iterator over them, like MockSubreddit.
+    `fetch_latency` seconds are spent for every `page_size` submissions,
+    as praw does for every listing page it requests.
+    """
+    def __init__(self, name, size, seed=0, fetch_latency=0.0, page_size=100):
+        self.display_name = self.id = name
+        self.fetch_latency = fetch_latency
+        self.page_size = page_size
+
+        rng = random.Random('{}{}'.format(seed, name))
+        scores = sorted((rng.randint(0, 50000) for __ in range(size)),
+                        reverse=True)
+        self.submissions = []
+        for index, score in enumerate(scores):
+            __, template = rng.choice(URL_TEMPLATES)
+            url = template.format(id='{}x{}'.format(name, index))
+            created = 1.4e9 + rng.random() * 1e6
+            self.submissions.append(
+                SyntheticSubmission(self, index, score, created, url))
+
+    def _listing(self, *args, **kwargs):
+        for index, submission in enumerate(self.submissions):
+            if self.fetch_latency and index % self.page_size == 0:
+                time.sleep(self.fetch_latency)
+            yield submission
+
+    def __getattr__(self, attr):
+        if attr.startswith('get_'):
+            return self._listing
+        raise AttributeError(attr)
+
+
+def synthetic_subreddits(count, size, seed=0, fetch_latency=0.0):
+    return {'sub{}'.format(x): SyntheticSubreddit('sub{}'.format(x), size,
+                                                  seed, fetch_latency)
+            for x in range(count)}
+
+
+class _UpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes, which Nagle would delay
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        if self.path.startswith('/imgur/'):
+            album_id = self.path.split('/')[2]
+            body = {'data': {'images': [
+                {'hash': '{}{}'.format(album_id, x), 'ext': '.jpg'}
+                for x in range(self.server.album_size)
+            ]}}
+        else:
+            body = {'url': 'http://127.0.0.1/deviation.jpg'}
+
+        raw = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+
+class LocalUpstream():
+    """Local HTTP server answering Imgur album and DeviantArt lookups"""
+    def __init__(self, latency=0.0, album_size=5):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _UpstreamHandler)
+        self.server.daemon_threads = True
+        self.server.latency = latency
+        self.server.album_size = album_size
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        daemon=True)
+
+    @property
+    def address(self):
+        return 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@contextmanager
+def offline(subreddits, upstream):
+    """Points reddit and the source managers at the synthetic stand-ins"""
+    patched = [
+        (reddit.REDDIT, 'get_subreddit', subreddits.__getitem__),
+        (source_managers.ImgurManager, 'album_template',
+            upstream.address + '/imgur/{}'),
+        (source_managers.DeviantArtManager, 'query_url',
+            upstream.address + '/oembed?url={}'),
+    ]
+    originals = [(target, name, target.__dict__.get(name))
+                 for target, name, __ in patched]
+
+    for target, name, value in patched:
+        setattr(target, name, value)
+    source_managers.RESOLUTION_CACHE.clear()
+    try:
+        yield
+    finally:
+        for target, name, value in originals:
+            if value is None:
+                delattr(target, name)
+            else:
+                setattr(target, name, value)
+        source_managers.RESOLUTION_CACHE.clear()
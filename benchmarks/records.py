@@ -0,0 +1,71 @@
+"""Memory held by buffered submission records: SubmissionRecord vs dicts
+
+Run with `python -m rStream.benchmarks.records [--records N]`. Results are
+printed as JSON.
+"""
+import argparse
+import json
+import random
+import tracemalloc
+
+from rStream.libs.records import SubmissionRecord
+
+
+SUBREDDITS = ('aww', 'cute', 'earthporn', 'cityporn', 'foodporn', 'pics')
+
+
+def synthetic_fields(count, seed=0):
+    """Fields as praw would hand them over, with fresh string objects"""
+    rng = random.Random(seed)
+    for index in range(count):
+        images = ['http://i.imgur.com/{}{}.jpg'.format(index, x)
+                  for x in range(rng.randint(1, 3))]
+        yield {
+            'url': 'http://imgur.com/a/{}'.format(index),
+            'score': rng.randint(0, 50000),
+            'title': 'Submission title number {}'.format(index),
+            'nsfw': False,
+            'link': 'https://reddit.com/r/foo/comments/{}/'.format(index),
+            'subreddit': ''.join(rng.choice(SUBREDDITS)),
+            'date': 1.4e9 + index,
+            'images': images,
+        }
+
+
+def as_dict(fields):
+    return dict(fields)
+
+
+def as_record(fields):
+    return SubmissionRecord(**fields)
+
+
+def measure(build, count):
+    """Memory retained by `count` records, including the strings they keep
+
+    The fields are dropped as records are built, as praw submissions are,
+    so anything a record does not share or intern stays counted.
+    """
+    tracemalloc.start()
+    records = [build(fields) for fields in synthetic_fields(count)]
+    current, __ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return {'bytes': current, 'bytes_per_record': current / count}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    results = {
+        'records': args.records,
+        'dict': measure(as_dict, args.records),
+        'SubmissionRecord': measure(as_record, args.records),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Routing urls to source managers: registry index against a linear scan
+
+Run with `python -m rStream.benchmarks.routing [--urls N]`. Results are
+printed as JSON.
+"""
+import argparse
+import json
+import random
+import time
+
+from rStream.libs import source_managers
+
+
+SAMPLE_URLS = (
+    'http://i.imgur.com/{}.jpg',
+    'http://imgur.com/{}',
+    'http://imgur.com/a/{}',
+    'http://gfycat.com/{}',
+    'http://giant.gfycat.com/{}.webm',
+    'http://foo.deviantart.com/art/bar-{}',
+    'http://example.com/{}.png',
+    'http://example.com/comments/{}/',
+    'http://youtube.com/watch?v={}',
+)
+
+
+def synthetic_urls(count, seed=0):
+    rng = random.Random(seed)
+    return [rng.choice(SAMPLE_URLS).format(index) for index in range(count)]
+
+
+def linear_scan(urls):
+    """The pre-registry loop: every manager is asked about every url"""
+    for url in urls:
+        for manager in source_managers.SOURCE_MANAGERS:
+            if manager.match(url):
+                pass
+
+
+def indexed(urls):
+    registry = source_managers.registry()
+    for url in urls:
+        registry.route(url)
+
+
+def _timed(func, urls, repeat):
+    best = float('inf')
+    for __ in range(repeat):
+        start = time.perf_counter()
+        func(urls)
+        best = min(best, time.perf_counter() - start)
+    return {
+        'seconds': best,
+        'urls_per_second': len(urls) / best if best else float('inf')
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--urls', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    source_managers.DirectLinkManager.extensions()  # Load config up front
+    urls = synthetic_urls(args.urls)
+    results = {
+        'urls': args.urls,
+        'linear_scan': _timed(linear_scan, urls, args.repeat),
+        'registry': _timed(indexed, urls, args.repeat),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
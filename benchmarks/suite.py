@@ -0,0 +1,169 @@
+"""Offline benchmark suite for the streaming pipeline
+
+Run with `python -m rStream.benchmarks.suite [options] [--output FILE]`.
+Nothing touches the network: subreddits are synthetic and image lookups
+go to a local server with a configurable latency. Results are written as
+JSON, so runs of two versions can be diffed.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+from rStream.benchmarks import cache, fixtures, records, routing
+from rStream.libs import reddit
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed):
+    ordered = sorted(latencies)
+    return {
+        'items': len(ordered),
+        'seconds': elapsed,
+        'items_per_second': len(ordered) / elapsed if elapsed else None,
+        'latency_p50': percentile(ordered, 0.50),
+        'latency_p95': percentile(ordered, 0.95),
+        'latency_p99': percentile(ordered, 0.99),
+        'latency_max': ordered[-1] if ordered else None,
+    }
+
+
+def measure_iterator(iterator, limit=None):
+    """Times each item pulled from `iterator`, up to `limit` items"""
+    latencies = []
+    start = last = time.perf_counter()
+    for __ in iterator:
+        now = time.perf_counter()
+        latencies.append(now - last)
+        last = now
+        if limit is not None and len(latencies) >= limit:
+            break
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def bench_merge(names, args):
+    start = time.perf_counter()
+    stream = reddit.SubredditsStream(names, key=lambda x: x.score,
+                                     func='get_hot')
+    setup = time.perf_counter() - start
+
+    results = measure_iterator(stream, args.items)
+    results['setup_seconds'] = setup
+    return results
+
+
+def bench_filter(names, args, **options):
+    stream = reddit.SubredditsStream(names, key=lambda x: x.score,
+                                     func='get_hot')
+    filtered = reddit.submission_filter(stream, **options)
+    return measure_iterator(filtered, args.items)
+
+
+def bench_api(names, args):
+    from rStream import api
+
+    client = api.app.test_client()
+    start = time.perf_counter()
+    client.get('/' + '+'.join(names))
+    select = time.perf_counter() - start
+
+    latencies = []
+    start = time.perf_counter()
+    served = 0
+    while served < args.items:
+        before = time.perf_counter()
+        response = client.get('/next/{}'.format(args.batch))
+        latencies.append(time.perf_counter() - before)
+
+        batch = len(response.get_json())
+        if not batch:
+            break
+        served += batch
+
+    results = summarize(latencies, time.perf_counter() - start)
+    results['records'] = served
+    results['select_seconds'] = select
+    return results
+
+
+def run(args):
+    subreddits = fixtures.synthetic_subreddits(
+        args.subreddits, args.size, seed=args.seed,
+        fetch_latency=args.fetch_latency)
+    names = sorted(subreddits)
+    results = {}
+
+    with fixtures.LocalUpstream(args.latency, args.album_size) as upstream:
+        with fixtures.offline(subreddits, upstream):
+            results['merge'] = bench_merge(names, args)
+        with fixtures.offline(subreddits, upstream):
+            results['filter_serial'] = bench_filter(names, args)
+        with fixtures.offline(subreddits, upstream):
+            results['filter_window'] = bench_filter(names, args,
+                                                    window=args.window)
+        with fixtures.offline(subreddits, upstream):
+            results['filter_deferred'] = bench_filter(names, args,
+                                                      deferred=True)
+        with fixtures.offline(subreddits, upstream):
+            results['api_next'] = bench_api(names, args)
+
+    results['expiringdict'] = cache.bench_expiringdict(args.sessions)
+    urls = routing.synthetic_urls(args.items, args.seed)
+    results['routing'] = {
+        'linear_scan': routing._timed(routing.linear_scan, urls, 3),
+        'registry': routing._timed(routing.indexed, urls, 3),
+    }
+    results['records'] = {
+        'dict': records.measure(records.as_dict, args.items),
+        'SubmissionRecord': records.measure(records.as_record, args.items),
+    }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--subreddits', type=int, default=50,
+                        help='number of synthetic subreddits')
+    parser.add_argument('--size', type=int, default=200,
+                        help='submissions per subreddit')
+    parser.add_argument('--items', type=int, default=1000,
+                        help='items pulled per scenario')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='seconds the local image host takes per lookup')
+    parser.add_argument('--fetch-latency', type=float, default=0.0,
+                        help='seconds per synthetic listing page')
+    parser.add_argument('--album-size', type=int, default=5)
+    parser.add_argument('--window', type=int, default=8,
+                        help='window for the concurrent filter scenario')
+    parser.add_argument('--batch', type=int, default=10,
+                        help='count requested per /next call')
+    parser.add_argument('--sessions', type=int, default=10000,
+                        help='entries for the ExpiringDict scenario')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write JSON here, not to stdout')
+    args = parser.parse_args(argv)
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': vars(args),
+        'results': run(args),
+    }
+
+    encoded = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as target:
+            target.write(encoded + '\n')
+    else:
+        sys.stdout.write(encoded + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""asyncio counterparts of SubredditsStream and submission_filter
+
+praw and the source managers block, so listing fetches and resolutions
+still run on the shared fetch scheduler and resolve pool of libs.reddit. What
+changes is that nothing waits on them in a thread of its own: a stream
+or filter suspends until its work is done, so a single event loop can
+drive any number of them while the pools bound the threads in use.
+"""
+import asyncio
+from collections import deque
+from functools import partial
+import heapq
+from itertools import islice
+import logging
+from urllib import parse
+import weakref
+
+from rStream.libs import metrics, reddit
+
+
+logger = logging.getLogger('__main__')
+
+# Per-host semaphores, by event loop, as they cannot be shared across loops
+_host_limits = weakref.WeakKeyDictionary()
+
+
+def _run(pool, func, *args):
+    return asyncio.get_running_loop().run_in_executor(pool, func, *args)
+
+
+def _host_limit(url):
+    limits = _host_limits.setdefault(asyncio.get_running_loop(), {})
+    host = parse.urlparse(url).netloc.lower()
+    if host not in limits:
+        limits[host] = asyncio.Semaphore(reddit.PER_HOST_LIMIT)
+    return limits[host]
+
+
+class AsyncSubredditsStream():
+    class SubredditWrapper():
+        """Wrapped listing, pulled a page at a time on the fetch scheduler"""
+        def __init__(self, name, func, read_ahead=0, after=None):
+            self.name = name
+            self.func = func
+            self.after = after
+            self.read_ahead = read_ahead
+            self.rank = reddit._unranked
+            self.subreddit = None
+            self.next_submission = None
+
+            self.__submission_gen = None
+            self.__buffer = deque()
+            self.__pending = None
+            self.__expended = False
+
+        def __open(self):
+            self.subreddit = reddit.REDDIT.get_subreddit(self.name)
+            query_func = getattr(self.subreddit, self.func)
+            if self.after is None:
+                self.__submission_gen = query_func(limit=None)
+            else:
+                self.__submission_gen = query_func(
+                    limit=None, params={'after': self.after})
+
+            msg = "Creating async wrapper for subreddit '{}'."
+            logger.info(msg.format(self.name))
+
+        def __fetch(self, count):
+            with metrics.timer(reddit.LISTING_FETCH):
+                submissions = list(islice(self.__submission_gen, count))
+            if len(submissions) < count:
+                self.__expended = True
+            return submissions
+
+        def __priority(self):
+            return len(self.__buffer), self.rank()
+
+        def __schedule(self, count):
+            scheduler = reddit.fetch_scheduler()
+            return asyncio.wrap_future(
+                scheduler.submit(self.__priority, self.__fetch, count))
+
+        async def start(self):
+            await _run(reddit.fetch_pool(), self.__open)
+            self.next_submission = await self.__pull()
+            return self
+
+        async def __pull(self):
+            if not self.__buffer:
+                if self.__pending is not None:
+                    pending, self.__pending = self.__pending, None
+                    self.__buffer.extend(await pending)
+                elif not self.__expended:
+                    self.__buffer.extend(await self.__schedule(
+                        reddit._fetch_size(self.read_ahead)))
+
+            if (self.read_ahead and self.__pending is None
+                    and not self.__expended
+                    and len(self.__buffer) < self.read_ahead):
+                self.__pending = self.__schedule(
+                    reddit._fetch_size(self.read_ahead))
+
+            if not self.__buffer:
+                return None
+            return self.__buffer.popleft()
+
+        async def advance(self):
+            """Returns the head submission and pulls the one after it"""
+            if self.next_submission is None:
+                raise StopAsyncIteration
+
+            result = self.next_submission
+            self.next_submission = await self.__pull()
+            if self.next_submission is None:
+                msg = "Wrapped subreddit '{}' is expended."
+                logger.info(msg.format(self.name))
+            return result
+
+        def __str__(self):
+            return self.name
+
+    def __init__(self, subreddits, key, func, read_ahead=None, after=None,
+                 combined=False):
+        """Merges the listings `func` of `subreddits`, largest `key` first
+
+        Arguments are those of SubredditsStream. The wrappers are only
+        created, concurrently, when the first submission is awaited.
+        """
+        if read_ahead is None:
+            read_ahead = reddit.READ_AHEAD
+        after = after or {}
+        if combined:
+            listings = reddit.combined_listings(subreddits, after)
+        else:
+            listings = [(x, after.get(x)) for x in subreddits]
+
+        self.subreddits = list(subreddits)
+        self.key = key
+        self.subs = [self.SubredditWrapper(name, func, read_ahead, resume)
+                     for name, resume in listings]
+        self._heap = None
+        self._lock = asyncio.Lock()
+
+    async def _start(self):
+        await asyncio.gather(*(x.start() for x in self.subs))
+        self._heap = []
+        self._ranks = reddit._MergeRanks(self._heap)
+        for index, wrapped in enumerate(self.subs):
+            if wrapped.next_submission is not None:
+                key = self.key(wrapped.next_submission)
+                entry = reddit._MergeEntry(key, index, wrapped)
+                self._heap.append(entry)
+                wrapped.rank = partial(self._ranks.rank, entry)
+        heapq.heapify(self._heap)
+        logger.debug("AsyncSubredditsStream initialized")
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        async with self._lock:
+            if self._heap is None:
+                await self._start()
+            if not self._heap:
+                logger.info("No further content from AsyncSubredditsStream")
+                raise StopAsyncIteration
+
+            entry = self._heap[0]
+            result = await entry.wrapped.advance()
+
+            next_submission = entry.wrapped.next_submission
+            if next_submission is None:
+                heapq.heappop(self._heap)
+            else:
+                entry.key = self.key(next_submission)
+                heapq.heapreplace(self._heap, entry)
+            self._ranks.changed()
+            reddit.MERGED.inc()
+            return result
+
+
+async def _resolve(submission, manager, deferred, variants):
+    limit = _host_limit(submission.url)
+    with metrics.timer(reddit.HOST_WAIT):
+        await limit.acquire()
+    try:
+        return await _run(reddit.resolve_pool(), reddit._info,
+                          submission, manager, deferred, variants)
+    finally:
+        limit.release()
+
+
+async def submission_filter(aiterable, window=0, ordered=True,
+                            deferred=False, dedup=False, variants=None):
+    """Async counterpart of reddit.submission_filter, over `aiterable`
+
+    Options are the same. With a `window`, resolutions run as tasks with
+    at most PER_HOST_LIMIT at a time against any one host, taken before
+    they reach the resolve pool; tasks still pending when the filter is
+    closed are cancelled. Resolutions making no request run in place.
+    """
+    seen = reddit._dedup_filter(dedup)
+    if not window:
+        async for submission in aiterable:
+            manager = reddit._match(submission, seen)
+            if manager is not None:
+                yield await _run(reddit.resolve_pool(), reddit._info,
+                                 submission, manager, deferred, variants)
+        return
+
+    pending = deque() if ordered else set()
+    add = pending.append if ordered else pending.add
+
+    async def completed():
+        if ordered:
+            return [await pending.popleft()]
+        done, __ = await asyncio.wait(pending,
+                                      return_when=asyncio.FIRST_COMPLETED)
+        pending.difference_update(done)
+        return [x.result() for x in done]
+
+    try:
+        async for submission in aiterable:
+            manager = reddit._match(submission, seen)
+            if manager is None:
+                continue
+
+            if reddit._offline(submission, manager, deferred):
+                resolved = asyncio.get_running_loop().create_future()
+                resolved.set_result(reddit._info(submission, manager,
+                                                 deferred, variants))
+                add(resolved)
+            else:
+                add(asyncio.ensure_future(_resolve(submission, manager,
+                                                   deferred, variants)))
+            while len(pending) >= window:
+                for result in await completed():
+                    yield result
+
+        while pending:
+            for result in await completed():
+                yield result
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,46 @@
+"""Fixed-memory set membership with a tunable false positive rate"""
+import hashlib
+import math
+
+
+class BloomFilter():
+    """Bloom filter sized for `capacity` items at `error_rate` false positives
+
+    Memory is fixed at construction. Adding more than `capacity` items
+    still works, but the false positive rate climbs above `error_rate`.
+    Items are strings.
+    """
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate)
+                                     / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        for index in range(self.hashes):
+            yield (first + index * second) % self.size
+
+    def __contains__(self, item):
+        return all(self._bits[x >> 3] & (1 << (x & 7))
+                   for x in self._positions(item))
+
+    def add(self, item):
+        """Adds `item`, returning False if it was probably already present"""
+        added = False
+        for position in self._positions(item):
+            byte, bit = position >> 3, 1 << (position & 7)
+            if not self._bits[byte] & bit:
+                self._bits[byte] |= bit
+                added = True
+
+        self.count += added
+        return added
+
+    def __len__(self):
+        return self.count
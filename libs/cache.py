@@ -1,8 +1,20 @@
+from collections import OrderedDict
+import heapq
+from itertools import count
+import json
 import threading
+import time
+
+from rStream.libs import metrics
 
 
 TIMEOUT = 60.0  # In seconds
 
+LOCKED = metrics.REGISTRY.histogram(
+    'rstream_expiringdict_lock_seconds',
+    'Time an ExpiringDict lookup or store waits for and holds its lock',
+    ('operation',))
+
 
 class ExpirationTimer():
     def __init__(self, timeout, func, *args, **kwargs):
@@ -41,36 +53,103 @@ class Expirable():
     def __init__(self, stream, timeout=None):
         self.stream = stream
         self.timeout = timeout
+        self.expires = None
+
+    def touch(self):
+        self.expires = time.monotonic() + self.timeout
 
 
 class ExpiringDict(dict):
-    def __init__(self, *args, **kwargs):
+    """Dict whose entries expire after `timeout` seconds without a lookup
+
+    The timeout defaults to TIMEOUT, read when each entry is stored.
+
+    Lookups only push an entry's expiry forward. A single reaper thread,
+    started when the first entry is stored and stopped once the dict is
+    empty, sleeps until the earliest scheduled expiry and removes entries
+    that are due. Entries touched in the meantime are rescheduled then.
+    The schedule holds keys rather than values, and at most one live
+    deadline per key, so replacing a value never keeps the old one alive.
+    """
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout
         self.lock = threading.Lock()
+        self._wakeup = threading.Condition(self.lock)
+        self._schedule = []
+        self._scheduled = {}  # Key to the deadline of its live schedule entry
+        self._sequence = count()
+        self._reaper = None
         super().__init__(*args, **kwargs)
 
     def __getitem__(self, key):
-        with self.lock:
+        with metrics.timer(LOCKED, 'get'), self.lock:
             value = super().__getitem__(key)
 
-        value.timeout.reset()
+        value.touch()
         return value.stream
 
     def __setitem__(self, key, value):
-        timer = ExpirationTimer(TIMEOUT, self.__delitem__, [key])
-        wrapped = Expirable(value, timer)
+        timeout = self.timeout if self.timeout is not None else TIMEOUT
+        wrapped = Expirable(value, timeout)
+        wrapped.touch()
 
-        with self.lock:
+        with metrics.timer(LOCKED, 'set'), self.lock:
             super().__setitem__(key, wrapped)
+            self._schedule_entry(key, wrapped.expires)
 
     def __delitem__(self, key):
         with self.lock:
             try:
-                value = super().__getitem__(key)
-                value.timeout.cancel()
                 super().__delitem__(key)
             except KeyError:
                 return
 
+    def _schedule_entry(self, key, expires):
+        """Queues `key` for the reaper. Must be called holding the lock
+
+        A key already due no later than `expires` is left as it is: the
+        reaper reschedules it then if its entry has not expired.
+        """
+        scheduled = self._scheduled.get(key)
+        if scheduled is not None and scheduled <= expires:
+            return
+        self._scheduled[key] = expires
+        entry = (expires, next(self._sequence), key)
+        heapq.heappush(self._schedule, entry)
+
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap,
+                                            name='ExpiringDict-reaper',
+                                            daemon=True)
+            self._reaper.start()
+        elif self._schedule[0] is entry:
+            self._wakeup.notify()
+
+    def _reap(self):
+        with self._wakeup:
+            while self._schedule:
+                expires, __, key = self._schedule[0]
+                now = time.monotonic()
+                if expires > now:
+                    self._wakeup.wait(expires - now)
+                    continue
+
+                heapq.heappop(self._schedule)
+                if self._scheduled.get(key) != expires:
+                    continue  # Superseded by an earlier deadline
+                del self._scheduled[key]
+
+                wrapped = super().get(key)
+                if wrapped is None:
+                    continue  # Deleted since it was scheduled
+                if wrapped.expires > now:
+                    self._schedule_entry(key, wrapped.expires)
+                    continue
+
+                super().__delitem__(key)
+
+            self._reaper = None
+
     def get(self, key, default=None):
         try:
             return self[key]
@@ -106,3 +185,126 @@ class ExpiringDict(dict):
 
     def values(self, *args, **kwargs):
         raise NotImplementedError()
+
+
+class SqliteStore():
+    """On-disk tier for LRUCache, so entries survive restarts
+
+    Values must be JSON serializable. Expiry times are wall clock times,
+    as they outlive the process that wrote them.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        import sqlite3  # Deferred, as most processes never need it
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)'
+            )
+
+    def get(self, key, now):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT value, expires FROM entries WHERE key = ?', (key,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        raw, expires = row
+        if expires is not None and expires <= now:
+            self.delete(key)
+            return None
+        return json.loads(raw), expires
+
+    def set(self, key, value, expires):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                (key, json.dumps(value), expires)
+            )
+
+    def delete(self, key):
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM entries WHERE key = ?',
+                                     (key,))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class LRUCache():
+    """Thread safe, size bounded cache with optional expiry and disk tier
+
+    Holds at most `maxsize` entries in memory, evicting the least recently
+    used. Entries older than `ttl` seconds are treated as missing. When a
+    `store` such as SqliteStore is given, every set is written through to
+    it and memory misses fall back to it.
+    """
+    def __init__(self, maxsize=1024, ttl=None, store=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.store = store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.store_hits = 0
+
+    def _insert(self, key, value, expires):
+        """Must be called holding the lock"""
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        found = self.store.get(key, now) if self.store is not None else None
+        with self._lock:
+            if found is None:
+                self.misses += 1
+                return default
+
+            value, expires = found
+            self._insert(key, value, expires)
+            self.hits += 1
+            self.store_hits += 1
+            return value
+
+    def set(self, key, value):
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._insert(key, value, expires)
+        if self.store is not None:
+            self.store.set(key, value, expires)
+
+    def clear(self):
+        """Empties the memory tier and resets the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.store_hits = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'store_hits': self.store_hits,
+            }
+
+    def __len__(self):
+        return len(self._entries)
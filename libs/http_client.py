@@ -0,0 +1,153 @@
+"""Shared HTTP client, keeping connections alive in per-host pools
+
+Source managers resolve urls through CLIENT rather than opening a new
+connection per lookup, so a resolution costs a single round trip once a
+connection to the host is warm.
+"""
+import gzip
+import http.client
+import json
+import threading
+from urllib import parse
+
+from rStream.libs import metrics
+
+
+TIMEOUT = 10.0  # In seconds
+POOL_SIZE = 4  # Idle connections kept per host
+MAX_REDIRECTS = 5
+USER_AGENT = 'rStreamer'
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+CONNECTIONS = metrics.REGISTRY.counter(
+    'rstream_http_connections_total',
+    'Connections used for requests, by whether they came from the pool',
+    ('reused',))
+
+
+class HTTPError(Exception):
+    def __init__(self, url, status, reason=''):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        super().__init__('{} {} for {}'.format(status, reason, url))
+
+
+class Response():
+    def __init__(self, url, status, headers, body):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body.decode())
+
+
+class HTTPClient():
+    """Thread safe HTTP client with a keep-alive connection pool per host
+
+    Up to `pool_size` idle connections are kept for each scheme, host and
+    port. A request borrows one (or opens a new one), and returns it after
+    reading the response unless the server asked to close it. Responses
+    may be gzip encoded when `compress` is set; bodies are decoded either
+    way.
+    """
+    connection_classes = {
+        'http': http.client.HTTPConnection,
+        'https': http.client.HTTPSConnection,
+    }
+
+    def __init__(self, timeout=TIMEOUT, pool_size=POOL_SIZE, compress=True):
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.compress = compress
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _acquire(self, origin):
+        with self._lock:
+            idle = self._idle.get(origin)
+            if idle:
+                return idle.pop(), True
+
+        scheme, host, port = origin
+        connection_class = self.connection_classes[scheme]
+        return connection_class(host, port, timeout=self.timeout), False
+
+    def _release(self, origin, connection):
+        with self._lock:
+            idle = self._idle.setdefault(origin, [])
+            if len(idle) < self.pool_size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def _send(self, origin, method, target, headers):
+        """Sends one request, retrying once if a pooled connection was stale"""
+        while True:
+            connection, reused = self._acquire(origin)
+            CONNECTIONS.inc('true' if reused else 'false')
+            try:
+                connection.request(method, target, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    BrokenPipeError):
+                connection.close()
+                if reused:
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(origin, connection)
+            return response, body
+
+    def request(self, url, method='GET', headers=None):
+        request_headers = {'User-Agent': USER_AGENT}
+        if self.compress:
+            request_headers['Accept-Encoding'] = 'gzip'
+        request_headers.update(headers or {})
+
+        for __ in range(MAX_REDIRECTS + 1):
+            parsed = parse.urlsplit(url)
+            origin = (parsed.scheme, parsed.hostname, parsed.port)
+            target = parsed.path or '/'
+            if parsed.query:
+                target += '?' + parsed.query
+
+            response, body = self._send(origin, method, target,
+                                        request_headers)
+            location = response.getheader('Location')
+            if response.status in REDIRECT_CODES and location:
+                url = parse.urljoin(url, location)
+                continue
+            break
+        else:
+            raise HTTPError(url, response.status, 'Too many redirects')
+
+        if response.status >= 400:
+            raise HTTPError(url, response.status, response.reason)
+
+        if response.getheader('Content-Encoding', '').lower() == 'gzip':
+            body = gzip.decompress(body)
+        return Response(url, response.status, response.headers, body)
+
+    def get_json(self, url):
+        return self.request(url).json()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+CLIENT = HTTPClient()
@@ -0,0 +1,189 @@
+"""Size-bounded disk cache of remote images, for serving them locally
+
+Clients are handed signed media ids rather than image urls. An id names
+its url, so any worker holding the secret can fetch it, but the
+signature stops the endpoint from proxying urls the API never served.
+"""
+import base64
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
+import hmac
+import logging
+import os
+import tempfile
+import threading
+from urllib import parse
+
+from rStream.libs import http_client, metrics
+
+
+logger = logging.getLogger('__main__')
+
+MAX_BYTES = 2 * 1024 ** 3  # Disk space used by cached images
+PREFETCH_WORKERS = 4  # Threads downloading images ahead of clients
+
+REQUESTS = metrics.REGISTRY.counter(
+    'rstream_media_requests_total',
+    'Media lookups, by whether the image was already on disk', ('cached',))
+
+
+class MediaCache():
+    """Images downloaded into `directory`, least recently used evicted first
+
+    At most `max_bytes` are kept, though the latest image is never evicted
+    to make room for itself. Concurrent lookups of an image share one
+    download. Files already in `directory` are picked up on start, least
+    recently accessed first.
+    """
+    def __init__(self, directory, secret, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+        self.max_bytes = max_bytes
+        self.size = 0
+
+        self._entries = OrderedDict()  # File name to size
+        self._downloads = {}  # File name to the Future of its download
+        self._lock = threading.Lock()
+        self._pool = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        found = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith('.'):
+                stat = entry.stat()
+                found.append((stat.st_atime, entry.name, stat.st_size))
+
+        with self._lock:
+            for __, name, size in sorted(found):
+                self._entries[name] = size
+                self.size += size
+            self._evict()
+
+    def _sign(self, url):
+        digest = hmac.new(self.secret, url.encode(), hashlib.sha256)
+        return digest.hexdigest()[:32]
+
+    def ident(self, url):
+        """Returns the media id standing for `url`"""
+        encoded = base64.urlsafe_b64encode(url.encode()).decode()
+        return '{}.{}'.format(self._sign(url), encoded.rstrip('='))
+
+    def url(self, ident):
+        """Returns the url `ident` stands for, None if it is not genuine"""
+        signature, __, encoded = ident.partition('.')
+        try:
+            padding = '=' * (-len(encoded) % 4)
+            url = base64.urlsafe_b64decode(encoded + padding).decode()
+        except (ValueError, UnicodeDecodeError):
+            return None
+        if not hmac.compare_digest(signature, self._sign(url)):
+            return None
+        return url
+
+    @staticmethod
+    def _name(url):
+        extension = os.path.splitext(parse.urlparse(url).path)[1].lower()
+        digest = hashlib.sha256(url.encode()).hexdigest()[:40]
+        return digest + extension[:8]
+
+    def path(self, ident):
+        """Returns the local path of the image `ident` stands for
+
+        Downloads the image if it is not on disk yet. Returns None for ids
+        that are not genuine, and raises http_client.HTTPError or OSError
+        if the image cannot be downloaded.
+        """
+        url = self.url(ident)
+        if url is None:
+            return None
+        return self._fetch(url)
+
+    def discard(self, ident):
+        """Forgets the image `ident` stands for, if it is cached
+
+        For files removed behind the cache's back: the next lookup
+        downloads the image again rather than returning a missing path.
+        """
+        url = self.url(ident)
+        if url is None:
+            return
+        with self._lock:
+            size = self._entries.pop(self._name(url), None)
+            if size is not None:
+                self.size -= size
+
+    def _fetch(self, url):
+        name = self._name(url)
+        with self._lock:
+            if name in self._entries:
+                self._entries.move_to_end(name)
+                REQUESTS.inc('true')
+                return os.path.join(self.directory, name)
+
+            download = self._downloads.get(name)
+            owner = download is None
+            if owner:
+                download = self._downloads[name] = Future()
+                REQUESTS.inc('false')
+
+        if not owner:
+            return download.result()
+
+        try:
+            path = self._download(url, name)
+        except BaseException as exc:
+            download.set_exception(exc)
+            raise
+        else:
+            download.set_result(path)
+            return path
+        finally:
+            with self._lock:
+                del self._downloads[name]
+
+    def _download(self, url, name):
+        body = http_client.CLIENT.request(url).body
+        # Written aside then renamed, so readers never see a partial file
+        handle, temporary = tempfile.mkstemp(dir=self.directory, prefix='.')
+        with os.fdopen(handle, 'wb') as target:
+            target.write(body)
+        path = os.path.join(self.directory, name)
+        os.replace(temporary, path)
+
+        with self._lock:
+            self._entries[name] = len(body)
+            self.size += len(body)
+            self._evict()
+        return path
+
+    def _evict(self):
+        """Removes images until within max_bytes. Must hold the lock"""
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def prefetch(self, urls):
+        """Downloads `urls` in the background, ahead of their lookups"""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(PREFETCH_WORKERS,
+                                                thread_name_prefix='media')
+        for url in urls:
+            self._pool.submit(self._prefetch, url)
+
+    def _prefetch(self, url):
+        try:
+            self._fetch(url)
+        except Exception as exc:
+            logger.info("Could not prefetch '{}': {}".format(url, exc))
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,153 @@
+"""Fan-out of one upstream iterator to any number of independent readers
+
+Sessions watching the same feed each get a Cursor into one SharedStream, so
+the listing fetches and image resolutions behind the feed happen once no
+matter how many sessions read it.
+"""
+from collections import deque
+import threading
+import weakref
+
+
+HEAD_SIZE = 100  # Items kept from the start of a feed, for new readers
+
+
+class Cursor():
+    """Iterator over a SharedStream, remembering its own position"""
+    def __init__(self, shared, position):
+        self.shared = shared
+        self.position = position
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.position, item = self.shared._get(self.position)
+        self.position += 1
+        self.shared._advanced(self.position - 1)
+        return item
+
+
+class SharedStream():
+    """Append-only buffer over the iterator built by `factory`
+
+    The iterator is built when the first cursor reads. Each item is pulled
+    from it once, by whichever cursor reaches it first, and dropped from
+    the buffer once every live cursor has moved past it. The first
+    HEAD_SIZE items are kept regardless, so new cursors are served the
+    feed from its start, as if it were theirs alone, and then join it at
+    the oldest item still buffered.
+
+    Upstream items are pulled outside the lock, by one cursor at a time,
+    so cursors reading buffered items never wait on upstream requests.
+    """
+    def __init__(self, factory):
+        self._factory = factory
+        self._source = None
+        self._head = []  # The first HEAD_SIZE items
+        self._buffer = deque()
+        self._base = 0  # Position of the first buffered item
+        self._expended = False
+        self._pulling = False  # Whether a cursor is pulling upstream
+        self._cursors = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._pulled = threading.Condition(self._lock)
+
+    def cursor(self):
+        with self._lock:
+            cursor = Cursor(self, 0)
+            self._cursors.add(cursor)
+        return cursor
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def _get(self, position):
+        """Returns the position actually read from `position`, and its item
+
+        Past the head, a position already dropped from the buffer moves
+        forward to the oldest item buffered.
+        """
+        while True:
+            with self._lock:
+                if position < len(self._head):
+                    return position, self._head[position]
+                position = max(position, self._base)
+
+                while True:
+                    index = position - self._base
+                    if index < len(self._buffer):
+                        return position, self._buffer[index]
+                    if self._expended:
+                        raise StopIteration
+                    if not self._pulling:
+                        break
+                    self._pulled.wait()
+                self._pulling = True
+
+            self._pull()
+
+    def _pull(self):
+        """Appends the next upstream item, called without holding the lock"""
+        try:
+            if self._source is None:
+                self._source = iter(self._factory())
+            item = next(self._source)
+        except StopIteration:
+            with self._lock:
+                self._expended = True
+                self._pulling = False
+                self._pulled.notify_all()
+            raise
+        except BaseException:
+            with self._lock:
+                self._pulling = False
+                self._pulled.notify_all()
+            raise
+
+        with self._lock:
+            if self._base + len(self._buffer) < HEAD_SIZE:
+                self._head.append(item)
+            self._buffer.append(item)
+            self._trim()
+            self._pulling = False
+            self._pulled.notify_all()
+
+    def _advanced(self, position):
+        if position == self._base:
+            with self._lock:
+                self._trim()
+
+    def _trim(self):
+        """Drops items every cursor has read. Must hold the lock"""
+        end = self._base + len(self._buffer)
+        lowest = min((x.position for x in self._cursors), default=end)
+        while self._base < lowest:
+            self._buffer.popleft()
+            self._base += 1
+
+
+class StreamHub():
+    """Hands out cursors over one SharedStream per key
+
+    A shared stream lives as long as any of its cursors, so a feed nobody
+    is reading is rebuilt from scratch by the next `open`.
+    """
+    def __init__(self):
+        self._streams = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def open(self, key, factory):
+        """Returns a new cursor over the stream for `key`
+
+        `factory` builds the upstream iterator, and is only called when no
+        live stream exists for `key`.
+        """
+        with self._lock:
+            shared = self._streams.get(key)
+            if shared is None:
+                shared = self._streams[key] = SharedStream(factory)
+            return shared.cursor()
+
+    def __len__(self):
+        return len(self._streams)
@@ -0,0 +1,96 @@
+"""Ranking of submissions from several subreddits, a window at a time
+
+Merging listings on a raw key such as 'score' lets the biggest subreddits
+win every comparison. A WindowRanker instead scores a window of upcoming
+submissions from every listing together, so scores can be put on a common
+scale first. Windows are scored with NumPy when it is installed, and in
+pure Python otherwise, with the same results.
+"""
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+WINDOW = 25  # Submissions taken from each listing per ranked window
+HOT_EPOCH = 1134028003  # Reddit's hot ranking counts age from this time
+HOT_DECAY = 45000  # Seconds of age worth a tenfold score in hot ranking
+
+
+class WindowRanker():
+    """Orders windows of submissions, best first
+
+    With `hot`, submissions rank as in Reddit's hot ranking: the log of
+    their score plus their age, so a newer submission needs a tenth of the
+    score for every `decay` seconds. Otherwise they rank on score alone.
+    With `normalize`, scores are first divided by the mean absolute score
+    of their group in the window, a group being the listing they came
+    from. `weights` maps group names, lower cased, to factors on their
+    scores, 1 for any not listed.
+    """
+    def __init__(self, window=WINDOW, hot=True, normalize=True, weights=None,
+                 decay=HOT_DECAY):
+        self.window = window
+        self.hot = hot
+        self.normalize = normalize
+        self.weights = {x.lower(): y for x, y in (weights or {}).items()}
+        self.decay = decay
+
+    def _weight(self, group):
+        return self.weights.get(group.lower(), 1.0)
+
+    def _ranks_numpy(self, submissions, groups):
+        count = len(submissions)
+        scores = numpy.fromiter((x.score for x in submissions), float, count)
+        names, inverse = numpy.unique(groups, return_inverse=True)
+
+        if self.normalize:
+            totals = numpy.bincount(inverse, weights=numpy.abs(scores))
+            scale = numpy.maximum(totals / numpy.bincount(inverse), 1.0)
+            scores /= scale[inverse]
+        if self.weights:
+            factors = numpy.array([self._weight(x) for x in names])
+            scores *= factors[inverse]
+        if not self.hot:
+            return scores
+
+        created = numpy.fromiter((x.created_utc for x in submissions), float,
+                                 count)
+        return (numpy.sign(scores) * numpy.log10(1 + numpy.abs(scores))
+                + (created - HOT_EPOCH) / self.decay)
+
+    def _ranks_python(self, submissions, groups):
+        scores = [float(x.score) for x in submissions]
+
+        if self.normalize:
+            totals, counts = {}, {}
+            for group, score in zip(groups, scores):
+                totals[group] = totals.get(group, 0.0) + abs(score)
+                counts[group] = counts.get(group, 0) + 1
+            scores = [x / max(totals[y] / counts[y], 1.0)
+                      for x, y in zip(scores, groups)]
+        if self.weights:
+            scores = [x * self._weight(y) for x, y in zip(scores, groups)]
+        if not self.hot:
+            return scores
+
+        return [math.copysign(math.log10(1 + abs(x)), x)
+                + (y.created_utc - HOT_EPOCH) / self.decay
+                for x, y in zip(scores, submissions)]
+
+    def rank(self, submissions, groups):
+        """Returns `submissions` best first, each from the group in `groups`
+
+        Ties keep the order of `submissions`.
+        """
+        if not submissions:
+            return []
+        if numpy is not None:
+            ranks = self._ranks_numpy(submissions, groups)
+            order = numpy.argsort(-ranks, kind='stable')
+        else:
+            ranks = self._ranks_python(submissions, groups)
+            order = sorted(range(len(ranks)), key=lambda x: -ranks[x])
+        return [submissions[x] for x in order]
@@ -0,0 +1,177 @@
+"""Per-session read-ahead, resolving a session's next records between requests
+
+Clients page through a session with requests for the same count, at a
+fairly steady pace. After each request a session's ReadAhead pulls the
+next records from its stream in the background, so the following request
+finds them resolved. How far ahead depends on how often the session
+asks, and all sessions share a bound on threads and buffered records.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import math
+import threading
+import time
+import weakref
+
+from rStream.libs import metrics
+
+
+logger = logging.getLogger('__main__')
+
+WORKERS = 4  # Threads shared by all sessions for reading ahead
+MAX_BUFFERED = 5000  # Records all sessions may have read ahead together
+MAX_BATCHES = 4  # Requests' worth of records a session reads ahead, at most
+IDLE_INTERVAL = 5 * 60  # Sessions asking less often are not read ahead
+SMOOTHING = 0.5  # Weight of the latest sample in moving averages
+
+READS = metrics.REGISTRY.counter(
+    'rstream_readahead_records_total',
+    'Records served to sessions, by whether they had been read ahead',
+    ('buffered',))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def readahead_pool():
+    '''Returns the executor shared by all sessions for reading ahead'''
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=WORKERS,
+                                       thread_name_prefix='readahead')
+        return _pool
+
+
+def _average(previous, sample):
+    if previous is None:
+        return sample
+    return SMOOTHING * sample + (1 - SMOOTHING) * previous
+
+
+class Budget():
+    """Bounds the records read ahead by all sessions together"""
+    def __init__(self, limit=MAX_BUFFERED):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Claims room for one record, returning False if there is none"""
+        with self._lock:
+            if self.used >= self.limit:
+                return False
+            self.used += 1
+            return True
+
+    def release(self, count=1):
+        with self._lock:
+            self.used -= count
+
+
+BUDGET = Budget()
+metrics.REGISTRY.gauge(
+    'rstream_readahead_buffered',
+    'Records read ahead and not yet served, across all sessions',
+    lambda: BUDGET.used)
+
+
+def _discard(budget, buffer):
+    budget.release(len(buffer))
+
+
+class ReadAhead():
+    """Iterator over `stream`, reading ahead after each request
+
+    `requested(count)` is called once a request for `count` records has
+    been served. It estimates how long pulling that many takes and how
+    often the session asks, and reads enough requests' worth ahead that
+    the next ones need not wait, up to MAX_BATCHES. Records read ahead
+    count against `budget` until served or dropped with the session.
+    `on_pull`, if given, is called with each record as it is pulled from
+    `stream`, so ahead of its request when read ahead.
+    """
+    def __init__(self, stream, budget=None, pool=None, on_pull=None):
+        self._stream = iter(stream)
+        self._budget = budget if budget is not None else BUDGET
+        self._pool = pool
+        self._on_pull = on_pull
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._filling = None
+        self._error = None  # Raised reading ahead, for the next request
+        self._requested = None  # When the last request was served
+        self.interval = None  # Average seconds between requests
+        self.pull_time = None  # Average seconds pulling a record
+        # The buffer, not the ReadAhead, so it can be collected
+        weakref.finalize(self, _discard, self._budget, self._buffer)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._lock:
+            if self._buffer:
+                self._budget.release()
+                READS.inc('true')
+                return self._buffer.popleft()
+            if self._error is not None:
+                error, self._error = self._error, None
+                raise error
+
+            record = self._pull()
+            READS.inc('false')
+            return record
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def _pull(self):
+        """Pulls a record from the stream. Must be called holding the lock"""
+        start = time.monotonic()
+        record = next(self._stream)
+        self.pull_time = _average(self.pull_time, time.monotonic() - start)
+        if self._on_pull is not None:
+            self._on_pull(record)
+        return record
+
+    def depth(self, count):
+        """Records to have read ahead for requests of `count` records"""
+        if self.interval is None or self.pull_time is None:
+            return count
+        if self.interval > IDLE_INTERVAL:
+            return 0
+        batches = math.ceil(self.pull_time * count / max(self.interval, 0.001))
+        return count * min(max(batches, 1), MAX_BATCHES)
+
+    def requested(self, count):
+        """Records that `count` records were served, then reads ahead"""
+        now = time.monotonic()
+        if self._requested is not None:
+            self.interval = _average(self.interval, now - self._requested)
+        self._requested = now
+
+        missing = self.depth(count) - len(self._buffer)
+        if missing <= 0:
+            return
+        if self._filling is not None and not self._filling.done():
+            return
+        pool = self._pool if self._pool is not None else readahead_pool()
+        self._filling = pool.submit(self._fill, missing)
+
+    def _fill(self, count):
+        for __ in range(count):
+            if not self._budget.acquire():
+                return
+            with self._lock:
+                try:
+                    self._buffer.append(self._pull())
+                except StopIteration:
+                    self._budget.release()
+                    return
+                except Exception as exc:
+                    self._budget.release()
+                    self._error = exc
+                    logger.warning("Read-ahead failed: {}".format(exc))
+                    return
@@ -0,0 +1,55 @@
+"""Compact record of a filtered submission, as served to clients"""
+from collections.abc import Mapping
+import sys
+
+
+class SubmissionRecord(Mapping):
+    """Read-only mapping of the fields served for a submission
+
+    Holds its fields in slots rather than a per-record dict, with the
+    subreddit name interned and the images as a tuple, so that buffering
+    many records stays cheap. As a Mapping it is read like the dicts it
+    replaces, and `dict(record)` gives the JSON shape served to clients,
+    with 'images_id' only present for deferred records and 'variants' for
+    those with downscaled variants of their images. The submission's
+    `fullname` and `created_utc` are kept as attributes, but are not
+    fields.
+    """
+    fields = ('url', 'score', 'title', 'nsfw', 'link', 'subreddit', 'date',
+              'images', 'images_id', 'variants')
+    optional = ('images_id', 'variants')  # Omitted while None
+    __slots__ = fields + ('fullname', 'created_utc')
+
+    def __init__(self, url, score, title, nsfw, link, subreddit, date,
+                 images=(), images_id=None, variants=None, fullname=None,
+                 created_utc=None):
+        self.url = url
+        self.score = score
+        self.title = title
+        self.nsfw = nsfw
+        self.link = link
+        self.subreddit = sys.intern(subreddit) if subreddit else subreddit
+        self.date = date
+        self.images = tuple(images)
+        self.images_id = images_id
+        self.variants = tuple(variants) if variants is not None else None
+        self.fullname = fullname
+        self.created_utc = created_utc
+
+    def __getitem__(self, field):
+        if field not in self.fields or (field in self.optional
+                                        and getattr(self, field) is None):
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def __iter__(self):
+        for field in self.fields:
+            if field not in self.optional or getattr(self, field) is not None:
+                yield field
+
+    def __len__(self):
+        return len(self.fields) - sum(getattr(self, x) is None
+                                      for x in self.optional)
+
+    def __repr__(self):
+        return 'SubmissionRecord({!r})'.format(dict(self))
@@ -1,86 +1,934 @@
+from collections import deque
+from concurrent.futures import (FIRST_COMPLETED, Future, ThreadPoolExecutor,
+                                wait)
+from functools import partial
+import heapq
+from itertools import count, islice
 import logging
+from operator import attrgetter
+import threading
+import time
+from urllib import parse
 
-import praw
-
-from rStream.libs import source_managers
+from rStream.libs import metrics, source_managers
+from rStream.libs.bloom import BloomFilter
+from rStream.libs.cache import ExpiringDict
+from rStream.libs.records import SubmissionRecord
 
 
 logger = logging.getLogger('__main__')
 
 user_agent = 'test'  # TODO: Centralize this, and import it properly
-REDDIT = praw.Reddit(user_agent=user_agent)
 
 
-def info_from_submission(submission, source_manager):
-    return {
-        'url': submission.url,
-        'score': submission.score,
-        'title': submission.title,
-        'nsfw': submission.over_18,
-        'link': submission.permalink,
-        'subreddit': submission.subreddit.display_name,
-        'date': submission.created,
-        'images': list(source_manager.get_images(submission.url))
-    }
+class LazyReddit():
+    """Stands in for a praw.Reddit client, only built when first used
+
+    Importing praw and building the client take a noticeable part of a
+    cold start, which tools that never query Reddit need not pay for.
+    Attributes set on the stand-in itself, as tests do, shadow the
+    client's.
+    """
+    def __init__(self, user_agent):
+        self.user_agent = user_agent
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                import praw
+                self._client = praw.Reddit(user_agent=self.user_agent)
+            return self._client
+
+    def __getattr__(self, attr):
+        return getattr(self.client(), attr)
+
+
+REDDIT = LazyReddit(user_agent)
+
+FETCH_WORKERS = 8  # Threads shared by all streams for listing fetches
+# Threads of the fetch scheduler. praw serializes requests under Reddit's
+# rate limit, so more would only wait on it rather than fetch sooner.
+SCHEDULER_WORKERS = 2
+READ_AHEAD = 0  # Submissions buffered per subreddit, 0 disables read-ahead
+# Submissions per listing page. praw asks for as many as Reddit allows and
+# keeps the page in memory, so only crossing a page makes a request.
+LISTING_PAGE = 100
+RESOLVE_WORKERS = 16  # Threads shared by all filters for image resolution
+PER_HOST_LIMIT = 4  # Concurrent resolutions allowed against a single host
+DEFERRED_TIMEOUT = 10 * 60  # Seconds a deferred image handle stays valid
+# Limits of a combined 'a+b+c' listing, keeping its url well within Reddit's
+COMBINED_NAME_LIMIT = 500  # Characters of the joined subreddit names
+COMBINED_SUBREDDIT_LIMIT = 100  # Subreddits per combined listing
+DEDUP_CAPACITY = 20000  # Distinct urls a filter remembers at DEDUP_ERROR_RATE
+DEDUP_ERROR_RATE = 0.001
+FOLLOW_FUNC = 'get_new'  # Listing polled by followers for new submissions
+FOLLOW_LIMIT = 100  # Submissions fetched per poll, at most
+FOLLOW_BATCH = 5  # New submissions a poll aims to find
+FOLLOW_MIN_INTERVAL = 30  # Seconds between polls of a subreddit, at least
+FOLLOW_MAX_INTERVAL = 15 * 60  # Seconds between polls of a subreddit, at most
+FOLLOW_WAIT = 20  # Seconds a caught up followed stream waits, then gives IDLE
+
+# Yielded by a followed stream that waited FOLLOW_WAIT without finding new
+# submissions. It is passed through filters, and marks where a request
+# should stop rather than the end of the stream.
+IDLE = object()
+
+# Unresolved images of submissions filtered in deferred mode, by id
+DEFERRED_IMAGES = ExpiringDict(timeout=DEFERRED_TIMEOUT)
+
+LISTING_FETCH = metrics.REGISTRY.histogram(
+    'rstream_listing_fetch_seconds',
+    'Time pulling submissions from a subreddit listing')
+MERGED = metrics.REGISTRY.counter(
+    'rstream_merged_submissions_total',
+    'Submissions yielded by the merge of subreddit listings')
+ROUTE = metrics.REGISTRY.histogram(
+    'rstream_route_seconds',
+    'Time finding the manager supporting a submission url')
+UNSUPPORTED = metrics.REGISTRY.counter(
+    'rstream_unsupported_submissions_total',
+    'Submissions no manager supports')
+DUPLICATES = metrics.REGISTRY.counter(
+    'rstream_duplicate_submissions_total',
+    'Submissions dropped as duplicates of an earlier url')
+RESOLVE = metrics.REGISTRY.histogram(
+    'rstream_resolve_seconds',
+    'Time building the record of a submission, including its images',
+    ('manager', 'deferred'))
+HOST_WAIT = metrics.REGISTRY.histogram(
+    'rstream_host_limit_wait_seconds',
+    'Time a resolution waits for its host to allow another connection')
+metrics.REGISTRY.gauge(
+    'rstream_fetch_queue_size',
+    'Listing fetches waiting for the fetch scheduler',
+    lambda: len(_scheduler) if _scheduler is not None else 0)
+
+_pools = {}
+_scheduler = None
+_shared_lock = threading.Lock()
+
+
+def _shared_pool(name, max_workers):
+    with _shared_lock:
+        if name not in _pools:
+            _pools[name] = ThreadPoolExecutor(max_workers=max_workers,
+                                              thread_name_prefix=name)
+        return _pools[name]
+
+
+def preload():
+    """Builds what is otherwise built on first use, ahead of any request
+
+    Long running servers call this once at start up, so that the first
+    requests do not pay for the Reddit client, the manager configuration
+    and registry, or the shared pools.
+    """
+    REDDIT.client()
+    source_managers.registry()
+    fetch_pool()
+    resolve_pool()
+    fetch_scheduler()
+
+
+def fetch_pool():
+    '''Returns the executor shared by all streams for listing fetches'''
+    return _shared_pool('fetch', FETCH_WORKERS)
+
+
+def fetch_scheduler():
+    '''Returns the scheduler shared by all streams for listing page fetches'''
+    global _scheduler
+    with _shared_lock:
+        if _scheduler is None:
+            _scheduler = FetchScheduler(SCHEDULER_WORKERS)
+        return _scheduler
 
 
-def submission_filter(iterable):
+def resolve_pool():
+    '''Returns the executor shared by all filters for image resolution'''
+    return _shared_pool('resolve', RESOLVE_WORKERS)
+
+
+class HostDispatcher():
+    """Submits resolutions to the resolve pool, PER_HOST_LIMIT per host
+
+    Resolutions past their host's limit wait in a queue of its own here,
+    rather than in pool threads, so a slow host holds at most its limit of
+    threads and never starves resolutions against other hosts.
+    """
+    def __init__(self):
+        self._active = {}  # Host to its resolutions in the pool
+        self._waiting = {}  # Host to a deque of its queued resolutions
+        self._lock = threading.Lock()
+
+    def submit(self, url, func, *args):
+        """Queues `func(*args)`, a request to `url`, returning a Future"""
+        host = parse.urlparse(url).netloc.lower()
+        task = (Future(), func, args, time.monotonic())
+        with self._lock:
+            active = self._active.get(host, 0)
+            if active >= PER_HOST_LIMIT:
+                self._waiting.setdefault(host, deque()).append(task)
+                return task[0]
+            self._active[host] = active + 1
+        self._start(host, task)
+        return task[0]
+
+    def _start(self, host, task):
+        future, func, args, queued = task
+        HOST_WAIT.observe(time.monotonic() - queued)
+        resolve_pool().submit(self._run, host, future, func, args)
+
+    def _run(self, host, future, func, args):
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = func(*args)
+                except BaseException as exc:
+                    future.set_exception(exc)
+                else:
+                    future.set_result(result)
+        finally:
+            self._release(host)
+
+    def _release(self, host):
+        with self._lock:
+            waiting = self._waiting.get(host)
+            if not waiting:
+                self._active[host] -= 1
+                if not self._active[host]:
+                    del self._active[host]
+                return
+            task = waiting.popleft()
+            if not waiting:
+                del self._waiting[host]
+        self._start(host, task)
+
+
+_host_dispatcher = HostDispatcher()
+
+
+class FetchScheduler():
+    """Runs queued listing fetches, the one the merge needs soonest first
+
+    Every fetch is queued with a `priority` callable, evaluated each time a
+    worker frees up, so a fetch's rank follows the merge it feeds while it
+    waits. The lowest priority runs first, ties in submission order.
+    """
+    def __init__(self, workers=SCHEDULER_WORKERS):
+        self.workers = workers
+        self._queue = []
+        self._sequence = count()
+        self._ready = threading.Condition()
+        self._threads = []
+
+    def submit(self, priority, func, *args):
+        """Queues `func(*args)`, returning a Future of its result"""
+        future = Future()
+        with self._ready:
+            self._queue.append((next(self._sequence), priority, future,
+                                func, args))
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work,
+                                          name='fetch-scheduler',
+                                          daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            self._ready.notify()
+        return future
+
+    def _pop(self):
+        """Dequeues the most urgent fetch. Must be called holding the lock"""
+        urgency = [(x[1](), x[0]) for x in self._queue]
+        index = min(range(len(urgency)), key=urgency.__getitem__)
+        return self._queue.pop(index)
+
+    def _work(self):
+        while True:
+            with self._ready:
+                while not self._queue:
+                    self._ready.wait()
+                __, __, future, func, args = self._pop()
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = func(*args)
+            except BaseException as exc:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+
+    def __len__(self):
+        return len(self._queue)
+
+
+class _MergeRanks():
+    """Ranks of the entries of a merge heap, for the fetch scheduler
+
+    An entry's rank is the fraction of the other heads in the heap that
+    merge before it. The scheduler reads the rank of every queued fetch
+    each time it dispatches one, so ranks are computed for the whole heap
+    at once and kept until the stream reports a `changed` heap.
+    """
+    def __init__(self, heap):
+        self._heap = heap
+        self._ranks = None
+
+    def changed(self):
+        self._ranks = None
+
+    def rank(self, entry):
+        ranks = self._ranks
+        if ranks is None:
+            ordered = sorted(list(self._heap))
+            last = max(len(ordered) - 1, 1)
+            ranks = {id(x): index / last for index, x in enumerate(ordered)}
+            self._ranks = ranks
+        return ranks.get(id(entry), 0.0)
+
+
+def _fetch_size(read_ahead):
+    """Submissions to fetch at once, whole listing pages covering `read_ahead`
+
+    Fetches start on a page boundary and take whole pages, so each one
+    makes a request for its first submission and for nothing after it.
+    """
+    return LISTING_PAGE * max(-(-read_ahead // LISTING_PAGE), 1)
+
+
+def _unranked():
+    return 0.0
+
+
+def combined_listings(subreddits, after=None):
+    """Groups `subreddits` into combined 'a+b+c' listings
+
+    Returns (name, after) pairs, each chunk within COMBINED_NAME_LIMIT and
+    COMBINED_SUBREDDIT_LIMIT. A combined listing is a single sequence, so
+    one resumes after the fullname of whichever member `after`, ordered
+    least recently served first, holds last.
+    """
+    after = after or {}
+    chunks = []
+    for name in subreddits:
+        if (not chunks or len(chunks[-1]) >= COMBINED_SUBREDDIT_LIMIT
+                or len('+'.join(chunks[-1] + [name])) > COMBINED_NAME_LIMIT):
+            chunks.append([])
+        chunks[-1].append(name)
+
+    served = {name: index for index, name in enumerate(after)}
+    listings = []
+    for chunk in chunks:
+        latest = max((x for x in chunk if x in served),
+                     key=served.__getitem__, default=None)
+        listings.append(('+'.join(chunk), after.get(latest)))
+    return listings
+
+
+class DeferredImages():
+    """Images of a submission, resolved when first asked for"""
+    def __init__(self, url, source_manager):
+        self.url = url
+        self.source_manager = source_manager
+        self._images = None
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        with self._lock:
+            if self._images is None:
+                images = self.source_manager.get_images(self.url)
+                self._images = list(images)
+        return self._images
+
+
+def deferred_images(ident):
+    """Resolves the images of a submission filtered in deferred mode
+
+    Returns None if `ident` is unknown or its handle has expired.
+    """
+    pending = DEFERRED_IMAGES.get(ident)
+    if pending is None:
+        return None
+    return pending.resolve()
+
+
+def restore_deferred(records):
+    """Registers the images of deferred `records` built elsewhere
+
+    Records loaded from disk, say, name images ids this process has never
+    handed out, which `deferred_images` would otherwise not know.
+    """
+    for record in records:
+        images_id = record.get('images_id')
+        if images_id is None or DEFERRED_IMAGES.get(images_id) is not None:
+            continue
+        manager = source_managers.registry().route(record['url'])
+        if manager is not None:
+            DEFERRED_IMAGES[images_id] = DeferredImages(record['url'],
+                                                        manager)
+
+
+def info_from_submission(submission, source_manager, deferred=False,
+                         variants=None):
+    """Extracts the fields served for a submission, resolving its images
+
+    When `deferred`, no images are resolved. Instead 'images' holds the
+    first image if the manager can derive it offline, and 'images_id'
+    identifies the submission to `deferred_images` for the full list.
+
+    Given a variants.VariantPipeline as `variants`, resolved images get
+    their downscaled variants under 'variants', in the order of 'images'.
+    They are rendered in the background: a record whose variants are not
+    known yet has none, and gets them once they are rendered.
+    """
+    image_variants = rendering = None
+    if not deferred:
+        images = tuple(source_manager.get_images(submission.url))
+        images_id = None
+        if variants is not None:
+            rendering = variants.submit(images)
+            if rendering.done():
+                image_variants, rendering = rendering.result(), None
+    else:
+        preview = source_manager.preview(submission.url)
+        images = (preview,) if preview is not None else ()
+        images_id = submission.id
+        DEFERRED_IMAGES[submission.id] = DeferredImages(submission.url,
+                                                        source_manager)
+
+    record = SubmissionRecord(
+        url=submission.url,
+        score=submission.score,
+        title=submission.title,
+        nsfw=submission.over_18,
+        link=submission.permalink,
+        subreddit=submission.subreddit.display_name,
+        date=submission.created,
+        images=images,
+        images_id=images_id,
+        variants=image_variants,
+        fullname=getattr(submission, 'fullname', None),
+        created_utc=getattr(submission, 'created_utc', None)
+    )
+    if rendering is not None:
+        rendering.add_done_callback(partial(_add_variants, record))
+    return record
+
+
+def _add_variants(record, rendering):
+    if rendering.exception() is None:
+        record.variants = tuple(rendering.result())
+
+
+def _dedup_filter(dedup):
+    return BloomFilter(DEDUP_CAPACITY, DEDUP_ERROR_RATE) if dedup else None
+
+
+def _match(submission, seen):
+    """Returns the manager supporting `submission`, None to drop it"""
+    if seen is not None:
+        canonical = source_managers.canonical_url(submission.url)
+        if not seen.add(canonical):
+            DUPLICATES.inc()
+            msg = "Skipping duplicate of '{}'"
+            logger.info(msg.format(submission.url))
+            return None
+
+    with metrics.timer(ROUTE):
+        manager = source_managers.registry().route(submission.url)
+    if manager is None:
+        UNSUPPORTED.inc()
+        return None
+
+    msg = "Found manager to support url, '{}'"
+    logger.info(msg.format(submission.url))
+    return manager
+
+
+def _matched(iterable, dedup=False):
+    seen = _dedup_filter(dedup)
     for submission in iterable:
-        for manager in source_managers.SOURCE_MANAGERS:
-            if manager.match(submission.url):
-                msg = "Found manager to support url, '{}'"
-                logger.info(msg.format(submission.url))
-                yield info_from_submission(submission, manager)
+        if submission is IDLE:
+            yield submission, None
+            continue
+        manager = _match(submission, seen)
+        if manager is not None:
+            yield submission, manager
+
+
+def _info(submission, manager, deferred, variants=None):
+    # Managers are registered as classes, instances go by their type
+    name = getattr(manager, '__name__', type(manager).__name__)
+    labels = name, 'true' if deferred else 'false'
+    with metrics.timer(RESOLVE, *labels):
+        return info_from_submission(submission, manager, deferred=deferred,
+                                    variants=variants)
+
+
+def _offline(submission, manager, deferred):
+    """Whether resolving `submission` makes no request, needing no slot
+
+    Variants are rendered in the background, so they make no difference.
+    """
+    if deferred:
+        return True
+    resolves_offline = getattr(manager, 'resolves_offline', None)
+    return (resolves_offline is not None
+            and resolves_offline(submission.url))
+
+
+def _resolved(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def _completed(pending, ordered):
+    if ordered:
+        yield pending.popleft().result()
+        return
+
+    done, __ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        pending.discard(future)
+        yield future.result()
+
+
+def submission_filter(iterable, window=0, ordered=True, deferred=False,
+                      dedup=False, variants=None):
+    """Yields info for each submission in `iterable` a manager supports
+
+    By default each submission is resolved in turn. With a `window`, up to
+    that many upcoming submissions are resolved concurrently on the resolve
+    pool, with at most PER_HOST_LIMIT at a time against any one host (see
+    HostDispatcher). Those resolving without a request, such as direct
+    links, are resolved in place.
+    Results are yielded in the order of `iterable`, or as they complete
+    when `ordered` is False. See `info_from_submission` for `deferred`.
+
+    With `dedup`, submissions whose url is the same as an earlier one's,
+    once canonicalized, are dropped before any manager resolves them. Seen
+    urls are kept in a fixed size Bloom filter, so a rare false positive
+    drops a submission that was not a duplicate.
+
+    See `info_from_submission` for `variants`. IDLE is passed through,
+    once all the submissions before it are resolved.
+    """
+    matched = _matched(iterable, dedup)
+    if not window:
+        for submission, manager in matched:
+            if submission is IDLE:
+                yield IDLE
+                continue
+            yield _info(submission, manager, deferred, variants)
+        return
+
+    pending = deque() if ordered else set()
+    add = pending.append if ordered else pending.add
+
+    for submission, manager in matched:
+        if submission is IDLE:
+            # Nothing more is coming for now, so what is pending is flushed
+            while pending:
+                yield from _completed(pending, ordered)
+            yield IDLE
+            continue
+        if _offline(submission, manager, deferred):
+            add(_resolved(_info(submission, manager, deferred, variants)))
+        else:
+            add(_host_dispatcher.submit(submission.url, _info, submission,
+                                        manager, deferred, variants))
+        while len(pending) >= window:
+            yield from _completed(pending, ordered)
+
+    while pending:
+        yield from _completed(pending, ordered)
+
+
+class PollInterval():
+    """Seconds between polls of a followed listing, adapting to its pace
+
+    Keeps a moving average of the listing's posting rate, and spaces polls
+    so each finds about FOLLOW_BATCH new submissions, within
+    FOLLOW_MIN_INTERVAL and FOLLOW_MAX_INTERVAL. A poll finding nothing
+    halves the estimated rate, so quiet listings back off.
+    """
+    def __init__(self):
+        self.rate = FOLLOW_BATCH / max(FOLLOW_MIN_INTERVAL, 1)
+        self.seconds = FOLLOW_MIN_INTERVAL
+
+    def update(self, found, elapsed):
+        """Records that a poll found `found` submissions in `elapsed`"""
+        self.rate = (self.rate + found / max(elapsed, 1.0)) / 2
+        if self.rate > 0:
+            seconds = FOLLOW_BATCH / self.rate
+        else:
+            seconds = FOLLOW_MAX_INTERVAL
+        self.seconds = min(max(seconds, FOLLOW_MIN_INTERVAL),
+                           FOLLOW_MAX_INTERVAL)
+
+
+def _high_water(head, func):
+    """Mark a follower starts from, given its wrapper's head submission
+
+    The head of a FOLLOW_FUNC listing is the newest submission there is.
+    Other listings are not ordered by age, so only what is posted from now
+    on is new.
+    """
+    if func == FOLLOW_FUNC and head is not None:
+        return head.created_utc, getattr(head, 'fullname', None)
+    return time.time(), None
+
+
+class _MergeEntry():
+    """Heap entry for a wrapped subreddit, keyed on its next submission
+
+    The key is computed once per head submission. Entries order so that the
+    largest key pops first, with ties going to the subreddit listed first,
+    matching what `max` over the wrappers would pick.
+    """
+    __slots__ = ('key', 'index', 'wrapped')
+
+    def __init__(self, key, index, wrapped):
+        self.key = key
+        self.index = index
+        self.wrapped = wrapped
+
+    def __lt__(self, other):
+        if self.key == other.key:
+            return self.index < other.index
+        return self.key > other.key
 
 
 class SubredditsStream():
     class SubredditWrapper():
-        def __init__(self, name, func):
+        def __init__(self, name, func, read_ahead=0, after=None):
             subreddit = REDDIT.get_subreddit(name)
 
             self.subreddit = subreddit
             query_func = getattr(subreddit, func)
-            self.__submission_gen = query_func(limit=None)
-            self.next_submission = next(self.__submission_gen)
+            if after is None:
+                self.__submission_gen = query_func(limit=None)
+            else:
+                self.__submission_gen = query_func(limit=None,
+                                                   params={'after': after})
+            self.read_ahead = read_ahead
+            # Set by the stream, see _MergeRanks
+            self.rank = _unranked
+
+            self.__buffer = deque()
+            self.__pending = None
+            self.__expended = False
+            self.next_submission = self.__pull()
 
             msg = "Creating wrapper for subreddit '{}'."
             logger.info(msg.format(self.subreddit.display_name))
 
+        def __fetch(self, count):
+            """Pulls up to `count` submissions from the listing
+
+            Runs on the fetch scheduler, but never concurrently with another
+            fetch for the same wrapper. `count` is a multiple of the page
+            size, see _fetch_size.
+            """
+            with metrics.timer(LISTING_FETCH):
+                submissions = list(islice(self.__submission_gen, count))
+            if len(submissions) < count:
+                self.__expended = True
+            return submissions
+
+        def __priority(self):
+            """How soon the merge needs this wrapper's next page, lowest first
+
+            A wrapper with fewer buffered submissions runs dry sooner, and
+            between those with as many the one whose head ranks higher in
+            the merge does.
+            """
+            return len(self.__buffer), self.rank()
+
+        def __schedule(self, count):
+            return fetch_scheduler().submit(self.__priority, self.__fetch,
+                                            count)
+
+        def __pull(self):
+            """Returns the next submission, None once the listing is expended
+
+            Submissions come from the buffer, holding what is left of the
+            pages fetched so far. Only an empty buffer waits on a fetch.
+            """
+            if not self.__buffer:
+                if self.__pending is not None:
+                    pending, self.__pending = self.__pending, None
+                    self.__buffer.extend(pending.result())
+                elif not self.__expended:
+                    fetched = self.__schedule(_fetch_size(self.read_ahead))
+                    self.__buffer.extend(fetched.result())
+
+            if (self.read_ahead and self.__pending is None
+                    and not self.__expended
+                    and len(self.__buffer) < self.read_ahead):
+                self.__pending = self.__schedule(_fetch_size(self.read_ahead))
+
+            if not self.__buffer:
+                return None
+            return self.__buffer.popleft()
+
         def __next__(self):
             if self.next_submission is None:
                 raise StopIteration
 
             result = self.next_submission
-            try:
-                self.next_submission = next(self.__submission_gen)
-            except StopIteration:
+            self.next_submission = self.__pull()
+            if self.next_submission is None:
                 msg = "Wrapped subreddit '{}' is expended."
                 logger.info(msg.format(self.subreddit.display_name))
-                self.next_submission = None
 
             return result
 
         def __str__(self):
             return self.subreddit.id
 
-    def _getter(self, wrapped_subreddit):
-        next_submission = wrapped_subreddit.next_submission
-        if next_submission is None:
-            return -1
+    class Follower():
+        """Polls a subreddit for submissions newer than any it has seen
+
+        `newest` is the high-water mark, the (created_utc, fullname) of the
+        newest submission seen. Polls ask FOLLOW_FUNC for what came before
+        that fullname, which Reddit lists newest first, and drop anything
+        not newer than the mark, so nothing already seen is fetched again.
+        Found submissions are buffered for the merge like a wrapper's.
+        `pending` is the poll in flight, if any.
+        """
+        def __init__(self, subreddit, newest):
+            self.subreddit = subreddit
+            self.newest = newest
+            self.interval = PollInterval()
+            self.polled = time.monotonic()
+            self.due = self.polled + self.interval.seconds
+            self.rank = _unranked
+            self.next_submission = None
+            self.pending = None
+
+            self.__buffer = deque()
+
+        def priority(self):
+            """A follower is only polled with nothing buffered"""
+            return 0, self.rank()
+
+        def poll(self):
+            """Returns the submissions posted since the high-water mark
+
+            Runs on the fetch scheduler. Errors are logged and count as a
+            poll finding nothing, so a followed stream outlives them.
+            """
+            created, fullname = self.newest
+            params = {'before': fullname} if fullname is not None else {}
+            listing = getattr(self.subreddit, FOLLOW_FUNC)
+            try:
+                with metrics.timer(LISTING_FETCH):
+                    fetched = [x for x in listing(limit=FOLLOW_LIMIT,
+                                                  params=params)
+                               if x.created_utc > created]
+            except Exception as exc:
+                msg = "Could not poll subreddit '{}': {}"
+                logger.warning(msg.format(self.subreddit, exc))
+                fetched = []
+
+            now = time.monotonic()
+            self.interval.update(len(fetched), now - self.polled)
+            self.polled = now
+            self.due = now + self.interval.seconds
+            if fetched:
+                latest = max(fetched, key=attrgetter('created_utc'))
+                self.newest = (latest.created_utc,
+                               getattr(latest, 'fullname', None))
+            return fetched
+
+        def extend(self, submissions):
+            self.__buffer.extend(submissions)
+            if self.next_submission is None and self.__buffer:
+                self.next_submission = self.__buffer.popleft()
+
+        def __next__(self):
+            if self.next_submission is None:
+                raise StopIteration
+
+            result = self.next_submission
+            self.next_submission = (self.__buffer.popleft()
+                                    if self.__buffer else None)
+            return result
+
+    def __init__(self, subreddits, key, func, read_ahead=None, after=None,
+                 combined=False, follow=False, ranker=None, newest=None):
+        """Merges the listings `func` of `subreddits`, largest `key` first
+
+        Wrappers are created concurrently on the fetch pool. With a
+        `read_ahead` depth (defaulting to READ_AHEAD), each wrapper keeps
+        that many submissions buffered by fetching in the background.
+        Listing pages are fetched through the shared fetch scheduler,
+        ranked against the pages every other stream is waiting on.
+        `after` maps subreddit names to the fullname of a submission their
+        listing should resume after.
 
-        return self.key(next_submission)
+        When `combined`, subreddits are fetched through a few combined
+        listings (see `combined_listings`) rather than one each, taking a
+        fraction of the requests. Submissions within a combined listing
+        keep Reddit's order for it, and only the listings are merged.
 
-    def __init__(self, subreddits, key, func):
-        self.subs = [self.SubredditWrapper(x, func) for x in subreddits]
+        When `follow`, the stream does not end with its listings: each is
+        also followed (see Follower), polled on its own schedule, and new
+        submissions are merged in as they are found. Once nothing else is
+        left, `next` waits for them, for FOLLOW_WAIT seconds at most, then
+        returns IDLE. Following suits listings ordered by age, such as
+        FOLLOW_FUNC keyed on 'created_utc'. Followers start from the head of
+        their listing, unless `newest` maps the subreddit to the
+        (created_utc, fullname) of a newer submission, as a stream resumed
+        `after` a session's position has a head older than it was served.
+
+        Given a `ranker`, such as a ranking.WindowRanker, submissions are
+        not merged on `key` one at a time. Instead the next `ranker.window`
+        submissions of every listing are taken at once, and yielded in the
+        order `ranker.rank` puts them in, grouped by listing name.
+        """
+        if read_ahead is None:
+            read_ahead = READ_AHEAD
+        after = after or {}
+        if combined:
+            listings = combined_listings(subreddits, after)
+        else:
+            listings = [(x, after.get(x)) for x in subreddits]
+
+        def wrap(listing):
+            name, resume_after = listing
+            return self.SubredditWrapper(name, func, read_ahead, resume_after)
+
+        self.subs = list(fetch_pool().map(wrap, listings))
         self.key = key
+        self.ranker = ranker
+        self._names = [name for name, __ in listings]
+        self._ranked = deque()
+
+        self._heap = []
+        self._ranks = _MergeRanks(self._heap)
+        for index, wrapped in enumerate(self.subs):
+            self._push(index, wrapped)
+
+        self.followers = []
+        if follow:
+            for name, wrapped in zip(self._names, self.subs):
+                mark = _high_water(wrapped.next_submission, func)
+                if newest:
+                    # Combined listings follow from their newest member
+                    mark = max([tuple(newest[x]) for x in name.split('+')
+                                if x in newest], default=mark)
+                self.followers.append(self.Follower(wrapped.subreddit, mark))
         logger.debug("SubredditsStream initialized")
 
+    def _push(self, index, wrapped_subreddit):
+        next_submission = wrapped_subreddit.next_submission
+        if next_submission is None:
+            return
+
+        entry = _MergeEntry(self.key(next_submission), index,
+                            wrapped_subreddit)
+        heapq.heappush(self._heap, entry)
+        self._ranks.changed()
+        wrapped_subreddit.rank = partial(self._ranks.rank, entry)
+
+    def _follow(self, block):
+        """Polls the idle followers that are due, merging what they found
+
+        Polls run on the fetch scheduler and stay pending on their
+        follower until done, so only those already done are merged, and
+        the stream goes on with what else it holds meanwhile. With `block`,
+        sleeps until some follower has found something, or FOLLOW_WAIT
+        seconds have passed.
+        """
+        deadline = time.monotonic() + FOLLOW_WAIT
+        while True:
+            idle = [(index, x) for index, x in enumerate(self.followers)
+                    if x.next_submission is None]
+            now = time.monotonic()
+            for __, follower in idle:
+                if follower.pending is None and follower.due <= now:
+                    follower.pending = fetch_scheduler().submit(
+                        follower.priority, follower.poll)
+
+            found = False
+            for index, follower in idle:
+                poll = follower.pending
+                if poll is None or not poll.done():
+                    continue
+                follower.pending = None
+                follower.extend(sorted(poll.result(), key=self.key,
+                                       reverse=True))
+                if follower.next_submission is not None:
+                    # Indexed after the wrappers, which win ties
+                    self._push(len(self.subs) + index, follower)
+                    found = True
+
+            now = time.monotonic()
+            if found or not block or not idle or now >= deadline:
+                return
+            polls = [x.pending for __, x in idle if x.pending is not None]
+            earliest = min([x.due for __, x in idle if x.pending is None]
+                           + [deadline])
+            if polls:
+                wait(polls, timeout=max(earliest - now, 0),
+                     return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(max(earliest - now, 0))
+
+    def _rank_window(self):
+        """Takes a window from every listing, queueing it in ranked order"""
+        window, groups = [], []
+        for entry in self._heap:
+            # Followers are indexed after the wrappers they follow
+            group = self._names[entry.index % len(self.subs)]
+            for __ in range(self.ranker.window):
+                if entry.wrapped.next_submission is None:
+                    break
+                window.append(next(entry.wrapped))
+                groups.append(group)
+
+        # The heap is kept, updated in place, as ranks refer to it
+        self._heap[:] = [x for x in self._heap
+                         if x.wrapped.next_submission is not None]
+        for entry in self._heap:
+            entry.key = self.key(entry.wrapped.next_submission)
+        heapq.heapify(self._heap)
+        self._ranks.changed()
+        self._ranked.extend(self.ranker.rank(window, groups))
+
     def __next__(self):
-        subreddit = max(self.subs, key=self._getter)
-        result = next(subreddit)
-        if result is None:
+        if self.followers:
+            self._follow(block=not self._heap and not self._ranked)
+            if not self._heap and not self._ranked:
+                return IDLE
+        if self.ranker is not None:
+            if not self._ranked:
+                self._rank_window()
+            if self._ranked:
+                MERGED.inc()
+                return self._ranked.popleft()
+        if not self._heap:
             logger.info("No further content from SubredditsStream")
             raise StopIteration
+
+        entry = self._heap[0]
+        result = next(entry.wrapped)
+
+        next_submission = entry.wrapped.next_submission
+        if next_submission is None:
+            heapq.heappop(self._heap)
+        else:
+            # Reuse the entry, sifting it down once with the new head's key
+            entry.key = self.key(next_submission)
+            heapq.heapreplace(self._heap, entry)
+        self._ranks.changed()
+        MERGED.inc()
         return result
 
     def __iter__(self):
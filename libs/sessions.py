@@ -0,0 +1,190 @@
+"""Serializable session state, so any worker can resume a session's stream
+
+A session's live stream only exists in the worker that built it. What is
+kept in a session store instead is a StreamCursor: enough to rebuild the
+stream from Reddit's listings where the session left off.
+"""
+from collections import deque
+import json
+import os
+import tempfile
+import threading
+import time
+
+from rStream.libs.cache import ExpiringDict
+
+
+TIMEOUT = 30 * 60  # Seconds a stored session outlives its last use
+EMITTED_LIMIT = 1000  # Fullnames of served submissions kept per session
+
+
+class StreamCursor():
+    """Where a session is in the merge of its subreddits' listings
+
+    `after` maps each subreddit to the fullname of the last submission from
+    it the session was served, most recently served subreddit last. A
+    listing resumed after that fullname starts at the subreddit's head, so
+    the heads themselves need not be stored. `emitted` holds the fullnames
+    most recently served, to skip them if listings shift on resume.
+    `combined` streams fetch combined listings, see
+    reddit.combined_listings, `media` sessions are served images through
+    the media cache, and `follow` streams keep polling for new submissions.
+    For those, `newest` maps each subreddit to the (created_utc, fullname)
+    of the newest submission from it the session was served, which a
+    resumed stream polls for what came since.
+    """
+    def __init__(self, subreddits, func, key, deferred=False, after=None,
+                 emitted=None, combined=False, media=False, follow=False,
+                 newest=None):
+        self.subreddits = tuple(subreddits)
+        self.func = func
+        self.key = key
+        self.deferred = deferred
+        self.combined = combined
+        self.media = media
+        self.follow = follow
+        self.after = dict(after or {})
+        self.emitted = deque(emitted or (), maxlen=EMITTED_LIMIT)
+        self.newest = {x: tuple(y) for x, y in dict(newest or {}).items()}
+
+    def advance(self, records):
+        """Records that `records` have been served to the session"""
+        for record in records:
+            fullname = getattr(record, 'fullname', None)
+            if fullname is None:
+                continue
+
+            subreddit = record['subreddit'].lower()
+            self.after.pop(subreddit, None)
+            self.after[subreddit] = fullname
+            self.emitted.append(fullname)
+
+            created = getattr(record, 'created_utc', None)
+            newest = self.newest.get(subreddit)
+            if (self.follow and created is not None
+                    and (newest is None or created > newest[0])):
+                self.newest[subreddit] = (created, fullname)
+
+    def to_json(self):
+        return json.dumps({
+            'subreddits': self.subreddits,
+            'func': self.func,
+            'key': self.key,
+            'deferred': self.deferred,
+            'combined': self.combined,
+            'media': self.media,
+            'follow': self.follow,
+            'after': list(self.after.items()),
+            'emitted': list(self.emitted),
+            'newest': list(self.newest.items()),
+        })
+
+    @classmethod
+    def from_json(cls, raw):
+        state = json.loads(raw)
+        return cls(state['subreddits'], state['func'], state['key'],
+                   deferred=state['deferred'],
+                   after=state['after'],
+                   emitted=state['emitted'],
+                   combined=state.get('combined', False),
+                   media=state.get('media', False),
+                   follow=state.get('follow', False),
+                   newest=state.get('newest'))
+
+
+class Session():
+    """A session's cursor, with the live stream of records it describes"""
+    def __init__(self, cursor, stream):
+        self.cursor = cursor
+        self.stream = stream
+
+
+class MemorySessionStore():
+    """Keeps cursors in process memory, only for a single worker"""
+    def __init__(self, timeout=TIMEOUT):
+        self._cursors = ExpiringDict(timeout=timeout)
+
+    def get(self, ident):
+        raw = self._cursors.get(ident)
+        return StreamCursor.from_json(raw) if raw is not None else None
+
+    def put(self, ident, cursor):
+        self._cursors[ident] = cursor.to_json()
+
+    def delete(self, ident):
+        del self._cursors[ident]
+
+
+class SqliteSessionStore():
+    """Keeps cursors in a sqlite database shared by the workers of a host"""
+    def __init__(self, path, timeout=TIMEOUT):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        import sqlite3  # Deferred, as most processes never need it
+        self._connection = sqlite3.connect(path, check_same_thread=False,
+                                           timeout=10.0)
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                'ident TEXT PRIMARY KEY, cursor TEXT NOT NULL, '
+                'updated REAL NOT NULL)'
+            )
+
+    def get(self, ident):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT cursor FROM sessions WHERE ident = ? AND updated > ?',
+                (ident, time.time() - self.timeout)
+            ).fetchone()
+        return StreamCursor.from_json(row[0]) if row is not None else None
+
+    def put(self, ident, cursor):
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)',
+                (ident, cursor.to_json(), now)
+            )
+            self._connection.execute('DELETE FROM sessions WHERE updated <= ?',
+                                     (now - self.timeout,))
+
+    def delete(self, ident):
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM sessions WHERE ident = ?',
+                                     (ident,))
+
+
+class FileSessionStore():
+    """Keeps one JSON file per session in `directory`, e.g. on shared disk"""
+    def __init__(self, directory, timeout=TIMEOUT):
+        self.directory = directory
+        self.timeout = timeout
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, ident):
+        # Session ids are uuids, but never let one escape the directory
+        name = ''.join(x for x in ident if x.isalnum() or x == '-')
+        return os.path.join(self.directory, name + '.json')
+
+    def get(self, ident):
+        path = self._path(ident)
+        try:
+            if os.path.getmtime(path) <= time.time() - self.timeout:
+                return None
+            with open(path) as source:
+                return StreamCursor.from_json(source.read())
+        except FileNotFoundError:
+            return None
+
+    def put(self, ident, cursor):
+        # Written aside then renamed, so readers never see a partial file
+        handle, temporary = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(handle, 'w') as target:
+            target.write(cursor.to_json())
+        os.replace(temporary, self._path(ident))
+
+    def delete(self, ident):
+        try:
+            os.remove(self._path(ident))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,158 @@
+"""On-disk snapshots of feeds, so they serve at once after a restart
+
+A snapshot holds the first records of a feed, as resolved. A feed opened
+over one serves its records straight away, while the fresh stream is
+built and its first records resolved in the background. It then swaps to
+the fresh stream, skipping what the snapshot already served: it is stale
+while revalidating. The fresh records become the next snapshot.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from itertools import chain, islice
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from rStream.libs import metrics
+from rStream.libs.records import SubmissionRecord
+
+
+logger = logging.getLogger('__main__')
+
+SIZE = 50  # Records a snapshot holds, from the head of its feed
+MAX_AGE = 6 * 60 * 60  # Seconds a snapshot is served for after it is saved
+REFRESH_WORKERS = 4  # Threads building fresh streams behind snapshots
+# Stored once per snapshot, then each record is a row of values
+COLUMNS = SubmissionRecord.fields + ('fullname',)
+
+LOADS = metrics.REGISTRY.counter(
+    'rstream_snapshot_loads_total',
+    'Feeds opened with snapshots enabled, by whether one was found',
+    ('found',))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def refresh_pool():
+    '''Returns the executor building fresh streams behind snapshots'''
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=REFRESH_WORKERS,
+                                       thread_name_prefix='snapshot')
+        return _pool
+
+
+class SnapshotStore():
+    """Keeps one snapshot per feed key in `directory`
+
+    Keys are anything JSON can encode, such as the key of a shared feed.
+    Snapshots older than `max_age` are ignored.
+    """
+    def __init__(self, directory, max_age=MAX_AGE, size=SIZE):
+        self.directory = directory
+        self.max_age = max_age
+        self.size = size
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        encoded = json.dumps(key, separators=(',', ':')).encode()
+        name = hashlib.sha256(encoded).hexdigest()[:40]
+        return os.path.join(self.directory, name + '.json')
+
+    def load(self, key):
+        """Returns the records snapshotted for `key`, None if there are none"""
+        try:
+            with open(self._path(key)) as source:
+                state = json.load(source)
+        except (FileNotFoundError, ValueError):
+            LOADS.inc('false')
+            return None
+        if state['saved'] <= time.time() - self.max_age:
+            LOADS.inc('false')
+            return None
+
+        LOADS.inc('true')
+        columns = state['columns']
+        records = []
+        for row in state['records']:
+            fields = {x: y for x, y in zip(columns, row)
+                      if x in COLUMNS and y is not None}
+            records.append(SubmissionRecord(**fields))
+        return records
+
+    def save(self, key, records):
+        rows = [[x.get(y) for y in SubmissionRecord.fields]
+                + [getattr(x, 'fullname', None)] for x in records]
+        state = {'columns': COLUMNS, 'saved': time.time(), 'records': rows}
+
+        # Written aside then renamed, so readers never see a partial file
+        handle, temporary = tempfile.mkstemp(dir=self.directory, prefix='.')
+        with os.fdopen(handle, 'w') as target:
+            json.dump(state, target, separators=(',', ':'))
+        os.replace(temporary, self._path(key))
+
+    def recording(self, key, iterable):
+        """Yields from `iterable`, snapshotting its first records for `key`
+
+        The snapshot is saved once `size` records have been pulled, or
+        all of them if there are fewer.
+        """
+        head = []
+        for record in iterable:
+            if head is not None:
+                head.append(record)
+                if len(head) >= self.size:
+                    self.save(key, head)
+                    head = None
+            yield record
+        if head is not None:
+            self.save(key, head)
+
+
+class RevalidatingStream():
+    """Serves `stale` records until the stream built by `factory` is ready
+
+    The fresh stream is built on `pool`, defaulting to the refresh pool,
+    and is ready once its first `size` records have been pulled. Records
+    whose link was served from `stale` are skipped from then on. Errors
+    building it are raised by `next` once it is done, as they would be
+    without a snapshot.
+    """
+    def __init__(self, stale, factory, size=SIZE, pool=None):
+        self._stale = deque(stale)
+        self._served = set()
+        self._fresh = None
+        pool = pool if pool is not None else refresh_pool()
+        self._refresh = pool.submit(self._revalidate, factory, size)
+
+    @staticmethod
+    def _revalidate(factory, size):
+        fresh = iter(factory())
+        head = list(islice(fresh, size))
+        return head, fresh
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._fresh is None:
+            if self._stale and not self._refresh.done():
+                record = self._stale.popleft()
+                self._served.add(record['link'])
+                return record
+
+            head, fresh = self._refresh.result()
+            self._fresh = chain(head, fresh)
+            self._stale.clear()
+            logger.debug("Swapped snapshot for fresh stream")
+
+        for record in self._fresh:
+            if record['link'] not in self._served:
+                return record
+        raise StopIteration
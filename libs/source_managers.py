@@ -1,13 +1,31 @@
 import configparser
-import json
 import os
-from urllib import parse, request
+from urllib import parse
 
 from rStream import CONFIG_FILE
+from rStream.libs import http_client, metrics
+from rStream.libs.cache import LRUCache
 
 
-def ext_from_url(url):
-    path = parse.urlparse(url).path
+RESOLUTION_CACHE_SIZE = 4096
+RESOLUTION_TTL = 6 * 60 * 60  # In seconds
+
+# Shared by all managers that need the network to resolve a url. Attach a
+# cache.SqliteStore as its `store` to keep resolutions across restarts.
+RESOLUTION_CACHE = LRUCache(maxsize=RESOLUTION_CACHE_SIZE, ttl=RESOLUTION_TTL)
+
+LOOKUP = metrics.REGISTRY.histogram(
+    'rstream_manager_lookup_seconds',
+    'Time a manager spends on a network lookup to resolve a url',
+    ('manager',))
+for _stat in ('size', 'hits', 'misses', 'store_hits'):
+    metrics.REGISTRY.gauge(
+        'rstream_resolution_cache_' + _stat,
+        'Resolution cache {}, as reported by its stats()'.format(_stat),
+        lambda stat=_stat: RESOLUTION_CACHE.stats()[stat])
+
+
+def ext_from_path(path):
     if path.startswith('/'):
         path = path[1:]
     if not path:
@@ -16,6 +34,40 @@ def ext_from_url(url):
     return extension
 
 
+def ext_from_url(url):
+    return ext_from_path(parse.urlparse(url).path)
+
+
+def canonical_url(url):
+    """Reduces `url` to a form shared by the urls of the same content
+
+    Scheme, query string, fragment, 'www.' and trailing slashes are
+    dropped and '.gifv' becomes '.gif'. Imgur and Gfycat serve the same
+    image from several hosts and extensions, so for those only the media
+    id is kept.
+    """
+    parsed = parse.urlparse(url)
+    host = (parsed.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    path = parsed.path.rstrip('/')
+
+    base, extension = os.path.splitext(path)
+    if extension.lower() == '.gifv':
+        path = base + '.gif'
+
+    is_imgur = host == 'imgur.com' or host.endswith('.imgur.com')
+    is_gfycat = host == 'gfycat.com' or host.endswith('.gfycat.com')
+    if is_imgur:
+        host = 'imgur.com'
+        if not path.startswith('/a/'):
+            path = base
+    elif is_gfycat:
+        host, path = 'gfycat.com', base
+
+    return host + path
+
+
 class DirectLinkManager():
     _config = None
     accepted_extensions = []
@@ -33,6 +85,16 @@ class DirectLinkManager():
         extensions = cls._config.get('directlink', 'AcceptedExtensions')
         cls.accepted_extensions = extensions.split(',')
 
+    @classmethod
+    def extensions(cls):
+        if cls._config is None:
+            cls.configure()
+        return cls.accepted_extensions
+
+    @classmethod
+    def match_parsed(cls, parsed, extension):
+        return extension in cls.accepted_extensions
+
     @classmethod
     def match(cls, url):
         return ext_from_url(url) in cls.accepted_extensions
@@ -42,15 +104,29 @@ class DirectLinkManager():
         if cls.match(url):
             yield url
 
+    @classmethod
+    def resolves_offline(cls, url):
+        return True
+
+    @classmethod
+    def preview(cls, url):
+        return url if cls.match(url) else None
+
 
 class GfycatManager():
+    domains = ('gfycat.com',)
+
     @classmethod
-    def match(cls, url):
-        parsed = parse.urlparse(url)
-        if 'giant' in parsed.netloc and ext_from_url(url) == '':
+    def match_parsed(cls, parsed, extension):
+        if 'giant' in parsed.netloc and extension == '':
             return False
         return 'gfycat.com' in parsed.netloc and parsed.path != '/'
 
+    @classmethod
+    def match(cls, url):
+        parsed = parse.urlparse(url)
+        return cls.match_parsed(parsed, ext_from_path(parsed.path))
+
     @classmethod
     def get_images(cls, url):
         file_name = parse.urlparse(url).path
@@ -60,8 +136,17 @@ class GfycatManager():
         if name:
             yield 'http://giant.gfycat.com/{}.gif'.format(name)
 
+    @classmethod
+    def preview(cls, url):
+        return next(cls.get_images(url), None)
+
+    @classmethod
+    def resolves_offline(cls, url):
+        return True
+
 
 class ImgurManager():
+    domains = ('imgur.com',)
     image_template = 'http://i.imgur.com/{}'
     album_template = 'http://imgur.com/ajaxalbums/getimages/{}/hit.json'
 
@@ -75,28 +160,39 @@ class ImgurManager():
         image_id = path.split('/')[-1]
         yield cls.image_template.format(image_id)
 
-    @classmethod
-    def _get_album(cls, parsed):
+    @staticmethod
+    def _album_id(parsed):
         if parsed.path.endswith('/'):
             path = parsed.path[:-1]
         else:
             path = parsed.path
 
         *__, album_id = path.split('/')
-        json_address = cls.album_template.format(album_id)
-        with request.urlopen(json_address) as response:
-            raw = response.read()
-            results = json.loads(raw.decode())
+        return album_id
 
-        for result in results['data']['images']:
-            image_id = result['hash'] + result['ext']
-            yield cls.image_template.format(image_id)
+    @classmethod
+    def _get_album(cls, parsed):
+        album_id = cls._album_id(parsed)
+        cache_key = 'imgur:album:{}'.format(album_id)
+        images = RESOLUTION_CACHE.get(cache_key)
+        if images is None:
+            json_address = cls.album_template.format(album_id)
+            with metrics.timer(LOOKUP, 'imgur'):
+                results = http_client.CLIENT.get_json(json_address)
+            images = [cls.image_template.format(x['hash'] + x['ext'])
+                      for x in results['data']['images']]
+            RESOLUTION_CACHE.set(cache_key, images)
+
+        yield from images
 
     @classmethod
-    def match(cls, url):
-        parsed = parse.urlparse(url)
+    def match_parsed(cls, parsed, extension):
         return 'imgur.com' in parsed.netloc and parsed.path != '/'
 
+    @classmethod
+    def match(cls, url):
+        return cls.match_parsed(parse.urlparse(url), None)
+
     @classmethod
     def get_images(cls, url):
         if not cls.match(url):
@@ -108,31 +204,129 @@ class ImgurManager():
         else:
             yield from cls._get_single_image(parsed)
 
+    @classmethod
+    def preview(cls, url):
+        parsed = parse.urlparse(url)
+        if not cls.match_parsed(parsed, None):
+            return None
+        if not parsed.path.startswith('/a/'):
+            return next(cls._get_single_image(parsed))
+
+        cache_key = 'imgur:album:{}'.format(cls._album_id(parsed))
+        images = RESOLUTION_CACHE.get(cache_key)
+        return images[0] if images else None
+
+    @classmethod
+    def resolves_offline(cls, url):
+        # Albums are looked up, single images are named by their url
+        return not parse.urlparse(url).path.startswith('/a/')
+
 
 class DeviantArtManager():
+    domains = ('deviantart.com',)
     query_url = 'http://backend.deviantart.com/oembed?url={}'
 
     @classmethod
-    def match(cls, url):
+    def match_parsed(cls, parsed, extension):
         fragment = '/art/'
-        parsed = parse.urlparse(url)
 
         if fragment not in parsed.path or len(parsed.path) <= len(fragment):
             return False
 
         return parsed.netloc.endswith('deviantart.com')
 
+    @classmethod
+    def match(cls, url):
+        return cls.match_parsed(parse.urlparse(url), None)
+
+    @staticmethod
+    def _cache_key(url):
+        # The artist's subdomain is optional, the path names the deviation
+        return 'deviantart:{}'.format(parse.urlparse(url).path.rstrip('/'))
+
     @classmethod
     def get_images(cls, url):
         if not cls.match(url):
             return
 
-        encoded = parse.quote(url, safe="~()*!.'")
-        with request.urlopen(cls.query_url.format(encoded)) as response:
-            raw = response.read()
-            results = json.loads(raw.decode())
-        yield results['url']
+        cache_key = cls._cache_key(url)
+        image = RESOLUTION_CACHE.get(cache_key)
+        if image is None:
+            encoded = parse.quote(url, safe="~()*!.'")
+            with metrics.timer(LOOKUP, 'deviantart'):
+                results = http_client.CLIENT.get_json(
+                    cls.query_url.format(encoded))
+            image = results['url']
+            RESOLUTION_CACHE.set(cache_key, image)
+
+        yield image
+
+    @classmethod
+    def preview(cls, url):
+        if not cls.match(url):
+            return None
+        return RESOLUTION_CACHE.get(cls._cache_key(url))
+
+
+class ManagerRegistry():
+    """Routes each url to exactly one of `managers`
+
+    Managers are given in priority order, so when several accept a url the
+    first listed wins. The url is parsed once, and only managers indexed
+    under one of its domain suffixes (from their `domains`) or under its
+    extension (from their `extensions()`) are asked, through
+    `match_parsed`. Managers without `match_parsed` are always asked,
+    through `match`.
+    """
+    def __init__(self, managers):
+        self.source = managers
+        self.managers = tuple(managers)
+        self._by_domain = {}
+        self._by_extension = {}
+        self._unindexed = []
+
+        for priority, manager in enumerate(self.managers):
+            if not hasattr(manager, 'match_parsed'):
+                self._unindexed.append(priority)
+                continue
+
+            for domain in getattr(manager, 'domains', ()):
+                self._by_domain.setdefault(domain, []).append(priority)
+            extensions = getattr(manager, 'extensions', tuple)()
+            for extension in extensions:
+                self._by_extension.setdefault(extension, []).append(priority)
+
+    def route(self, url):
+        """Returns the manager supporting `url`, or None"""
+        parsed = parse.urlparse(url)
+        extension = ext_from_path(parsed.path)
+
+        candidates = set(self._unindexed)
+        candidates.update(self._by_extension.get(extension, ()))
+        host = parsed.hostname or ''
+        while host:
+            candidates.update(self._by_domain.get(host, ()))
+            __, __, host = host.partition('.')
+
+        for priority in sorted(candidates):
+            manager = self.managers[priority]
+            if hasattr(manager, 'match_parsed'):
+                if manager.match_parsed(parsed, extension):
+                    return manager
+            elif manager.match(url):
+                return manager
+        return None
 
 
 SOURCE_MANAGERS = (DirectLinkManager, GfycatManager, ImgurManager,
                    DeviantArtManager)
+
+_registry = None
+
+
+def registry():
+    """Returns a ManagerRegistry for the current SOURCE_MANAGERS"""
+    global _registry
+    if _registry is None or _registry.source is not SOURCE_MANAGERS:
+        _registry = ManagerRegistry(SOURCE_MANAGERS)
+    return _registry
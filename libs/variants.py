@@ -0,0 +1,261 @@
+"""Downscaled variants of resolved images, rendered on a process pool
+
+Needs Pillow; without it `available()` is False and nothing is rendered.
+Pillow and the process pool are only imported once something is.
+Rendering is CPU bound, so it runs in worker processes, while originals
+are downloaded on threads of the calling process. Variants are kept on
+disk next to a JSON file describing them, so each image is rendered
+once, even across restarts. Only images Pillow cannot decode are
+recorded as having none: failed downloads, timeouts and crashed workers
+are tried again next time.
+"""
+from concurrent.futures import (BrokenExecutor, Future, ThreadPoolExecutor,
+                                TimeoutError as FutureTimeout)
+from functools import partial
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from rStream.libs import http_client, metrics
+from rStream.libs.cache import LRUCache
+
+
+logger = logging.getLogger('__main__')
+
+WIDTHS = (320, 640, 1280)  # Widths rendered, for images wider than them
+QUALITY = 80  # JPEG quality of still variants
+WORKERS = None  # Rendering processes, None for one per CPU
+RENDER_TIMEOUT = 60  # Seconds to wait for an image's variants
+DOWNLOAD_WORKERS = 4  # Threads downloading originals for background renders
+KNOWN_SIZE = 4096  # Images whose variants are also kept in memory
+
+RENDER = metrics.REGISTRY.histogram(
+    'rstream_variant_render_seconds',
+    'Time rendering the variants of an image')
+
+
+def available():
+    return importlib.util.find_spec('PIL') is not None
+
+
+def _remove(path, future=None):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _save_animated(image, size, target):
+    from PIL import Image, ImageSequence
+
+    frames = [x.convert('RGBA').resize(size, Image.LANCZOS)
+              for x in ImageSequence.Iterator(image)]
+    frames[0].save(target, 'GIF', save_all=True, append_images=frames[1:],
+                   loop=image.info.get('loop', 0),
+                   duration=image.info.get('duration', 100), disposal=2)
+
+
+def render(source, directory, key, widths, quality=QUALITY):
+    """Writes the variants of image file `source` into `directory`
+
+    Runs in a worker process. Returns a list of [file name, width,
+    height], narrowest first, for each width narrower than the image.
+    Animated images keep their frames as GIFs, others become JPEGs.
+    """
+    from PIL import Image
+
+    variants = []
+    with Image.open(source) as image:
+        width, height = image.size
+        animated = getattr(image, 'is_animated', False)
+        for target_width in sorted(widths):
+            if target_width >= width:
+                break
+            size = (target_width, max(1, round(height * target_width / width)))
+            name = '{}-{}.{}'.format(key, target_width,
+                                     'gif' if animated else 'jpg')
+
+            handle, temporary = tempfile.mkstemp(dir=directory, prefix='.')
+            with os.fdopen(handle, 'wb') as target:
+                if animated:
+                    _save_animated(image, size, target)
+                else:
+                    resized = image.convert('RGB').resize(size, Image.LANCZOS)
+                    resized.save(target, 'JPEG', quality=quality,
+                                 optimize=True, progressive=True)
+            os.replace(temporary, os.path.join(directory, name))
+            variants.append([name, size[0], size[1]])
+    return variants
+
+
+class VariantPipeline():
+    """Renders and caches variants of images in `directory`
+
+    `variants(urls)` returns, for each image url, a tuple of dicts with the
+    'url', 'width' and 'height' of each variant. Their urls are file names
+    appended to `url_prefix`. Images that cannot be decoded, like videos,
+    have no variants. `submit(urls)` renders them in the background.
+    """
+    def __init__(self, directory, url_prefix, widths=WIDTHS,
+                 workers=WORKERS):
+        self.directory = directory
+        self.url_prefix = url_prefix
+        self.widths = tuple(widths)
+        self.workers = workers
+
+        self._known = LRUCache(maxsize=KNOWN_SIZE)
+        self._rendering = {}  # Key to the Future of its variants
+        self._lock = threading.Lock()
+        self._pool = None
+        self._threads = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _key(self, url):
+        return hashlib.sha256(url.encode()).hexdigest()[:40]
+
+    def _process_pool(self):
+        with self._lock:
+            if self._pool is None:
+                from concurrent.futures import ProcessPoolExecutor
+                import multiprocessing
+
+                # Spawned rather than forked, as the server runs threads
+                context = multiprocessing.get_context('spawn')
+                self._pool = ProcessPoolExecutor(self.workers,
+                                                 mp_context=context)
+            return self._pool
+
+    def _discard_pool(self, pool):
+        """Drops a broken `pool`, so the next render starts a new one"""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    def _load(self, key):
+        try:
+            with open(os.path.join(self.directory, key + '.json')) as source:
+                return json.load(source)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _render(self, url, key):
+        """Renders the variants of `url`, recording them under `key`
+
+        Raises what stopped them from being rendered, other than the image
+        not decoding, so that nothing is recorded for it.
+        """
+        from PIL import Image, UnidentifiedImageError
+
+        body = http_client.CLIENT.request(url).body
+        handle, original = tempfile.mkstemp(dir=self.directory, prefix='.')
+        with os.fdopen(handle, 'wb') as target:
+            target.write(body)
+
+        pool = self._process_pool()
+        try:
+            future = pool.submit(render, original, self.directory, key,
+                                 self.widths)
+        except BrokenExecutor:
+            _remove(original)
+            self._discard_pool(pool)
+            raise
+        # Removed once the worker is done with it, which is later than
+        # this on a timeout
+        future.add_done_callback(partial(_remove, original))
+        try:
+            with metrics.timer(RENDER):
+                variants = future.result(RENDER_TIMEOUT)
+        except (UnidentifiedImageError, Image.DecompressionBombError) as exc:
+            msg = "No variants for '{}': {}"
+            logger.info(msg.format(url, exc))
+            variants = []
+        except BrokenExecutor:
+            self._discard_pool(pool)
+            raise
+
+        handle, temporary = tempfile.mkstemp(dir=self.directory, prefix='.')
+        with os.fdopen(handle, 'w') as target:
+            json.dump(variants, target)
+        os.replace(temporary, os.path.join(self.directory, key + '.json'))
+        return variants
+
+    def _variants(self, url):
+        key = self._key(url)
+        variants = self._known.get(key)
+        if variants is not None:
+            return variants
+
+        with self._lock:
+            rendering = self._rendering.get(key)
+            owner = rendering is None
+            if owner:
+                rendering = self._rendering[key] = Future()
+
+        if not owner:
+            return rendering.result()
+
+        try:
+            variants = self._load(key)
+            if variants is None:
+                variants = self._render(url, key)
+            self._known.set(key, variants)
+            rendering.set_result(variants)
+            return variants
+        except BaseException as exc:
+            rendering.set_exception(exc)
+            raise
+        finally:
+            with self._lock:
+                del self._rendering[key]
+
+    def variants(self, urls):
+        """Returns the variants of each of `urls`, rendering them if need be
+
+        An image that cannot be downloaded or rendered now has no variants,
+        but they will be tried for again next time.
+        """
+        results = []
+        for url in urls:
+            try:
+                variants = self._variants(url)
+            except (http_client.HTTPError, OSError, FutureTimeout,
+                    BrokenExecutor) as exc:
+                msg = "Could not render variants of '{}': {}"
+                logger.warning(msg.format(url, exc))
+                variants = []
+            results.append(tuple(
+                {'url': self.url_prefix + name, 'width': width,
+                 'height': height}
+                for name, width, height in variants))
+        return results
+
+    def submit(self, urls):
+        """Returns a Future of `variants(urls)`, rendering in the background
+
+        The Future is already done when all their variants are known.
+        """
+        if all(self._known.get(self._key(x)) is not None for x in urls):
+            future = Future()
+            future.set_result(self.variants(urls))
+            return future
+
+        with self._lock:
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(
+                    DOWNLOAD_WORKERS, thread_name_prefix='variants')
+            threads = self._threads
+        return threads.submit(self.variants, urls)
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+            threads, self._threads = self._threads, None
+        if threads is not None:
+            threads.shutdown()
+        if pool is not None:
+            pool.shutdown()
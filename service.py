@@ -0,0 +1,448 @@
+"""Sessions and feeds behind the endpoints of api.py and async_api.py
+
+Both apps take the same options when selecting subreddits, build the same
+feeds and sessions, and serialize records the same way, so a session
+behaves alike whichever app serves it. Only the request handling differs.
+"""
+import asyncio
+import json
+import logging
+from operator import attrgetter
+import os
+import tempfile
+import threading
+from uuid import uuid4
+
+from rStream.libs import (async_reddit, media, metrics, multicast, readahead,
+                          reddit, sessions, snapshot, variants)
+from rStream.libs.cache import ExpiringDict, LRUCache
+from rStream.libs.records import SubmissionRecord
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+logger = logging.getLogger('__main__')
+
+RESOLVE_WINDOW = 8  # Submissions resolved concurrently per feed
+ENCODED_CACHE_SIZE = 4096  # Serialized records kept for shared feeds
+METRICS_ENABLED = True  # Record per-stage timings, served at /metrics
+READ_AHEAD_ENABLED = True  # Resolve each session's next records in advance
+SECRET_KEY = 'test'  # Signs session cookies and media ids
+MEDIA_DIRECTORY = os.path.join(tempfile.gettempdir(), 'rStream-media')
+MEDIA_MAX_AGE = 24 * 60 * 60  # Seconds clients may cache served media
+MEDIA_ATTEMPTS = 3  # Lookups of an image evicted while it is being served
+VARIANTS_ENABLED = False  # Add downscaled image variants, needs Pillow
+VARIANTS_DIRECTORY = os.path.join(tempfile.gettempdir(), 'rStream-variants')
+VARIANTS_URL = '/variants/'
+# Serve new feeds from a snapshot of their last run while they refresh
+SNAPSHOTS_ENABLED = False
+SNAPSHOT_DIRECTORY = os.path.join(tempfile.gettempdir(), 'rStream-snapshots')
+
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'msgpack': 'application/msgpack',
+}
+
+
+content_store = ExpiringDict()
+# Live sessions of async_api.py, whose streams are async iterators
+async_content_store = ExpiringDict()
+feeds = multicast.StreamHub()
+encoded_records = LRUCache(maxsize=ENCODED_CACHE_SIZE)
+# Cursors of all sessions. To run several workers, use a store they share,
+# such as sessions.SqliteSessionStore or sessions.FileSessionStore.
+session_store = sessions.MemorySessionStore()
+_media_cache = None
+_variant_pipeline = None
+_snapshot_store = None
+_media_lock = threading.Lock()
+
+metrics.enable(METRICS_ENABLED)
+PULL = metrics.REGISTRY.histogram(
+    'rstream_next_pull_seconds',
+    'Time pulling the records of a /next request from its session stream')
+ENCODE = metrics.REGISTRY.histogram(
+    'rstream_encode_seconds',
+    'Time serializing the records of a /next request', ('format',))
+
+
+def take_n(iterable, number):
+    results = []
+    for __ in range(number):
+        try:
+            item = next(iterable)
+            results.append(item)
+        except StopIteration:
+            break
+
+    return results
+
+
+async def async_take_n(aiterable, number):
+    results = []
+    for __ in range(number):
+        try:
+            item = await aiterable.__anext__()
+            results.append(item)
+        except StopAsyncIteration:
+            break
+
+    return results
+
+
+def encode_record(record, fmt):
+    """Serializes `record` for a streaming format, once per submission
+
+    Records of a shared feed are encoded once for every session reading
+    it. Deferred and media records hold different images than resolved
+    ones, so the images are part of the key, and records are encoded again
+    once their variants are added.
+    """
+    key = (fmt, record['link'], 'images_id' in record,
+           tuple(record['images']), 'variants' in record)
+    encoded = encoded_records.get(key)
+    if encoded is None:
+        with metrics.timer(ENCODE, fmt):
+            if fmt == 'msgpack':
+                encoded = msgpack.packb(dict(record))
+            else:
+                line = json.dumps(dict(record), separators=(',', ':')) + '\n'
+                encoded = line.encode()
+        encoded_records.set(key, encoded)
+    return encoded
+
+
+def format_error(fmt):
+    """Returns the message and status refusing streaming format `fmt`
+
+    Returns None if records can be streamed in it.
+    """
+    if fmt not in STREAM_FORMATS:
+        return 'Unknown format {}'.format(fmt), 400
+    if fmt == 'msgpack' and msgpack is None:
+        return 'msgpack is not available', 406
+    return None
+
+
+def media_cache():
+    """Returns the cache behind /media, created on first use"""
+    global _media_cache
+    with _media_lock:
+        if _media_cache is None:
+            _media_cache = media.MediaCache(MEDIA_DIRECTORY, SECRET_KEY)
+        return _media_cache
+
+
+def variant_pipeline():
+    """Returns the pipeline rendering image variants, None if disabled"""
+    global _variant_pipeline
+    if not VARIANTS_ENABLED or not variants.available():
+        return None
+    with _media_lock:
+        if _variant_pipeline is None:
+            _variant_pipeline = variants.VariantPipeline(VARIANTS_DIRECTORY,
+                                                         VARIANTS_URL)
+        return _variant_pipeline
+
+
+def snapshot_store():
+    """Returns the store of feed snapshots, None if disabled"""
+    global _snapshot_store
+    if not SNAPSHOTS_ENABLED:
+        return None
+    with _media_lock:
+        if _snapshot_store is None:
+            _snapshot_store = snapshot.SnapshotStore(SNAPSHOT_DIRECTORY)
+        return _snapshot_store
+
+
+def serve_media(ident, send):
+    """Returns `send(path)` for the local copy of the image `ident` names
+
+    Another download can evict the image between its lookup and `send`
+    opening it, raising FileNotFoundError. It is then looked up, and so
+    downloaded, again. Returns None for ids that are not genuine, and
+    raises http_client.HTTPError or OSError if the image cannot be had.
+    """
+    cache = media_cache()
+    for attempt in range(MEDIA_ATTEMPTS):
+        path = cache.path(ident)
+        if path is None:
+            return None
+        try:
+            return send(path)
+        except FileNotFoundError:
+            if attempt + 1 == MEDIA_ATTEMPTS:
+                raise
+            logger.debug('Media evicted while served: {}'.format(ident))
+            cache.discard(ident)
+
+
+def prefetch_media(record):
+    """Downloads the images of `record` to the media cache, in background"""
+    media_cache().prefetch(record['images'])
+
+
+def media_record(record, url, prefetch=True):
+    """Returns `record` with its images served from /media
+
+    `url` maps a media id to the url the app serves it at. Unless already
+    done with `prefetch_media`, the images are prefetched, as the client
+    is about to ask for them.
+    """
+    cache = media_cache()
+    if prefetch:
+        cache.prefetch(record['images'])
+    fields = dict(record)
+    fields['images'] = [url(cache.ident(x)) for x in record['images']]
+    return SubmissionRecord(fullname=getattr(record, 'fullname', None),
+                            created_utc=getattr(record, 'created_utc', None),
+                            **fields)
+
+
+def _until_idle(stream):
+    for record in stream:
+        if record is reddit.IDLE:
+            return
+        yield record
+
+
+async def _async_media_records(aiterable, url):
+    async for record in aiterable:
+        yield media_record(record, url)
+
+
+def request_stream(session, url):
+    """Returns the stream a request reads the records of `session` from
+
+    Followed sessions stop at reddit.IDLE, so a request that waited long
+    enough for new submissions ends with those found so far, while the
+    session goes on. Media sessions get their images served from /media,
+    see `media_record` for `url`.
+    """
+    stream = session.stream
+    # Read-ahead sessions prefetch their images as records are pulled
+    prefetch = not isinstance(stream, readahead.ReadAhead)
+    if session.cursor.follow:
+        stream = _until_idle(stream)
+    if session.cursor.media:
+        stream = (media_record(x, url, prefetch) for x in stream)
+    return stream
+
+
+def async_request_stream(session, url):
+    """Async counterpart of `request_stream`, for an AsyncSession"""
+    if session.cursor.media:
+        return _async_media_records(session.stream, url)
+    return session.stream
+
+
+def new_cursor(subs, flag):
+    """Returns the subreddits named in `subs` and the cursor to read them
+
+    `flag(name)` tells whether the request switched on option `name`.
+    """
+    selected = subs.split('+')
+    normalized = sorted({x.lower() for x in selected})
+    # Followed sessions tail the newest submissions, and wait for more
+    # once they have caught up, so are best read with a streaming format
+    follow = flag('follow')
+    if follow:
+        func, key = reddit.FOLLOW_FUNC, 'created_utc'
+    else:
+        func, key = 'get_hot', 'score'
+    cursor = sessions.StreamCursor(normalized, func, key,
+                                   deferred=flag('deferred'),
+                                   combined=flag('combined'),
+                                   media=flag('media'),
+                                   follow=follow)
+    return selected, cursor
+
+
+def open_feed(cursor):
+    """Returns a cursor over the shared feed for a new session
+
+    Sessions selecting the same subreddits, in any order or case, with the
+    same options read the same upstream stream. With snapshots enabled, a
+    feed starts from its snapshot while the upstream stream is built.
+    """
+    def build():
+        stream = reddit.SubredditsStream(cursor.subreddits,
+                                         key=attrgetter(cursor.key),
+                                         func=cursor.func,
+                                         combined=cursor.combined,
+                                         follow=cursor.follow)
+        return reddit.submission_filter(stream,
+                                        window=RESOLVE_WINDOW,
+                                        deferred=cursor.deferred,
+                                        dedup=True,
+                                        variants=variant_pipeline())
+
+    key = (cursor.subreddits, cursor.func, cursor.key, cursor.deferred,
+           cursor.combined, cursor.follow)
+
+    def factory():
+        store = snapshot_store()
+        # Followed feeds are not snapshotted, as they are read for what is
+        # new, and hold reddit.IDLE markers
+        if store is None or cursor.follow:
+            return build()
+
+        stale = store.load(key)
+        if stale is None:
+            return store.recording(key, build())
+        reddit.restore_deferred(stale)
+        return snapshot.RevalidatingStream(
+            stale, lambda: store.recording(key, build()))
+
+    return feeds.open(key, factory)
+
+
+def resume_feed(cursor):
+    """Rebuilds the stream of a session this worker has not been serving"""
+    stream = reddit.SubredditsStream(cursor.subreddits,
+                                     key=attrgetter(cursor.key),
+                                     func=cursor.func,
+                                     after=cursor.after,
+                                     combined=cursor.combined,
+                                     follow=cursor.follow,
+                                     newest=cursor.newest)
+    emitted = set(cursor.emitted)
+    unseen = (x for x in stream
+              if getattr(x, 'fullname', None) not in emitted)
+    return reddit.submission_filter(unseen,
+                                    window=RESOLVE_WINDOW,
+                                    deferred=cursor.deferred,
+                                    dedup=True,
+                                    variants=variant_pipeline())
+
+
+def open_session(cursor, stream):
+    """Returns a session reading `stream`, ahead of its requests if enabled
+
+    Followed sessions are not read ahead, as that would hold a read-ahead
+    thread waiting for new submissions. Media sessions read ahead have
+    their images prefetched as records are read, so /media already holds
+    them when the client asks.
+    """
+    if READ_AHEAD_ENABLED and not cursor.follow:
+        on_pull = prefetch_media if cursor.media else None
+        stream = readahead.ReadAhead(stream, on_pull=on_pull)
+    return sessions.Session(cursor, stream)
+
+
+def start_session(cursor):
+    """Opens a session reading `cursor` over its shared feed, returns its id"""
+    ident = str(uuid4())
+    logger.debug('New UUID: {}'.format(ident))
+    session_store.put(ident, cursor)
+    content_store[ident] = open_session(cursor, open_feed(cursor))
+    return ident
+
+
+def load_session(ident):
+    """Returns the live session for `ident`, resuming it if need be
+
+    Returns None for unknown or expired sessions.
+    """
+    if ident is None:
+        return None
+
+    session = content_store.get(ident)
+    if session is None:
+        cursor = session_store.get(ident)
+        if cursor is None:
+            return None
+
+        logger.debug('Resuming UUID: {}'.format(ident))
+        session = open_session(cursor, resume_feed(cursor))
+        content_store[ident] = session
+    return session
+
+
+def served(ident, session, records, count):
+    """Records that `records` answered a request for `count` of them"""
+    session.cursor.advance(records)
+    session_store.put(ident, session.cursor)
+    if isinstance(session.stream, readahead.ReadAhead):
+        session.stream.requested(count)
+
+
+class AsyncSession(sessions.Session):
+    """Session of async_api.py, reading an async stream
+
+    Its lock lets a single request read the stream at once.
+    """
+    def __init__(self, cursor, stream):
+        super().__init__(cursor, stream)
+        self.lock = asyncio.Lock()
+
+
+def async_cursor_error(cursor):
+    """Returns the message and status refusing `cursor` in async_api.py
+
+    Returns None if an AsyncSession can read it. Followed sessions wait on
+    pollers of libs.reddit that have no async counterpart yet.
+    """
+    if cursor.follow:
+        return 'follow is not available in the async app', 400
+    return None
+
+
+def open_async_stream(cursor):
+    """Returns the async stream of records `cursor` describes
+
+    Async streams are the session's own: they are not shared with other
+    sessions, started from snapshots, or read ahead, as the event loop
+    already reads them while it serves other requests.
+    """
+    stream = async_reddit.AsyncSubredditsStream(cursor.subreddits,
+                                                key=attrgetter(cursor.key),
+                                                func=cursor.func,
+                                                after=cursor.after,
+                                                combined=cursor.combined)
+    emitted = set(cursor.emitted)
+
+    async def unseen():
+        async for submission in stream:
+            if getattr(submission, 'fullname', None) not in emitted:
+                yield submission
+
+    return async_reddit.submission_filter(unseen(),
+                                          window=RESOLVE_WINDOW,
+                                          deferred=cursor.deferred,
+                                          dedup=True,
+                                          variants=variant_pipeline())
+
+
+def start_async_session(cursor):
+    """Opens an AsyncSession reading `cursor`, returns its id"""
+    ident = str(uuid4())
+    logger.debug('New async UUID: {}'.format(ident))
+    session_store.put(ident, cursor)
+    async_content_store[ident] = AsyncSession(cursor,
+                                              open_async_stream(cursor))
+    return ident
+
+
+def load_async_session(ident):
+    """Returns the live AsyncSession for `ident`, resuming it if need be
+
+    Returns None for unknown or expired sessions.
+    """
+    if ident is None:
+        return None
+
+    session = async_content_store.get(ident)
+    if session is None:
+        cursor = session_store.get(ident)
+        if cursor is None:
+            return None
+
+        logger.debug('Resuming async UUID: {}'.format(ident))
+        session = AsyncSession(cursor, open_async_stream(cursor))
+        async_content_store[ident] = session
+    return session
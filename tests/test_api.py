@@ -1,8 +1,19 @@
+from collections import namedtuple
 import json
+import os
+import socket
+import subprocess
+import sys
 
 import pytest
 
+from rStream import api, service
 from rStream.api import app
+from rStream.libs import multicast, readahead, reddit, snapshot
+from rStream.libs.cache import ExpiringDict, LRUCache
+from rStream.libs.records import SubmissionRecord
+
+IMPORT_BUDGET = 2  # Seconds a fresh interpreter may take to import the API
 
 
 @pytest.fixture
@@ -10,6 +21,379 @@ def client():
     return app.test_client()
 
 
+@pytest.fixture(autouse=True)
+def feeds(monkeypatch):
+    """Keeps feeds opened by one test from being shared with the next"""
+    monkeypatch.setattr(service, 'feeds', multicast.StreamHub())
+
+
 def test_root_response_is_200(client):
     response = client.get('/')
     assert '200' in response.status
+
+
+def test_deferred_images(monkeypatch, client):
+    class Pending():
+        def resolve(self):
+            return ['http://i.imgur.com/1.jpg', 'http://i.imgur.com/2.jpg']
+
+    monkeypatch.setattr(reddit, 'DEFERRED_IMAGES', {'foo': Pending()})
+    response = client.get('/images/foo')
+    assert '200' in response.status
+    assert json.loads(response.data.decode())['images'] == [
+        'http://i.imgur.com/1.jpg', 'http://i.imgur.com/2.jpg']
+
+
+def test_unknown_deferred_images(client):
+    response = client.get('/images/doesntexist')
+    assert '404' in response.status
+
+
+def test_sessions_share_feed(monkeypatch, client):
+    built = []
+
+    def mock_stream(subreddits, key, func, combined=False, **kwargs):
+        built.append(subreddits)
+        return iter([{'link': 'foo'}, {'link': 'bar'}])
+
+    monkeypatch.setattr(reddit, 'SubredditsStream', mock_stream)
+    monkeypatch.setattr(reddit, 'submission_filter',
+                        lambda stream, **kwargs: stream)
+
+    other = app.test_client()
+    client.get('/cute+aww')
+    other.get('/AWW+cute')
+
+    first = json.loads(client.get('/next/2').data.decode())
+    second = json.loads(other.get('/next/2').data.decode())
+    assert first == second == [{'link': 'foo'}, {'link': 'bar'}]
+    assert built == [('aww', 'cute')]
+
+
+@pytest.fixture()
+def records(monkeypatch):
+    records = [{'link': 'http://test.com/{}'.format(x), 'images': [str(x)]}
+               for x in range(3)]
+    monkeypatch.setattr(reddit, 'SubredditsStream',
+                        lambda subreddits, key, func, **kwargs: iter(records))
+    monkeypatch.setattr(reddit, 'submission_filter',
+                        lambda stream, **kwargs: stream)
+    return records
+
+
+def test_ndjson_stream(client, records):
+    client.get('/foo')
+    response = client.get('/next/5?format=ndjson')
+
+    assert response.mimetype == 'application/x-ndjson'
+    lines = response.data.decode().splitlines()
+    assert [json.loads(x) for x in lines] == records
+
+
+def test_records_encoded_once(monkeypatch, client, records):
+    monkeypatch.setattr(service, 'encoded_records', LRUCache())
+    other = app.test_client()
+    client.get('/bar')
+    other.get('/bar')
+
+    first = client.get('/next/3?format=ndjson').data
+    second = other.get('/next/3?format=ndjson').data
+    assert first == second
+    assert service.encoded_records.stats()['hits'] == 3
+
+
+def test_unknown_format(client, records):
+    client.get('/foo')
+    response = client.get('/next/1?format=xml')
+    assert '400' in response.status
+
+
+def test_msgpack_stream(client, records):
+    msgpack = pytest.importorskip('msgpack')
+    client.get('/baz')
+    response = client.get('/next/5?format=msgpack')
+
+    unpacker = msgpack.Unpacker()
+    unpacker.feed(response.data)
+    assert list(unpacker) == records
+
+
+def test_session_resumed_by_another_worker(monkeypatch, client):
+    Submission = namedtuple('Submission', ['fullname', 'subreddit'])
+    listings = []
+
+    def mock_stream(subreddits, key, func, after=None, **kwargs):
+        listings.append(dict(after or {}))
+        return iter([Submission('t3_2', 'cute'), Submission('t3_3', 'aww'),
+                     Submission('t3_4', 'aww')])
+
+    def mock_filter(stream, **kwargs):
+        for submission in stream:
+            yield SubmissionRecord(url='', score=0, title='', nsfw=False,
+                                   link=submission.fullname,
+                                   subreddit=submission.subreddit, date=0.0,
+                                   fullname=submission.fullname)
+
+    monkeypatch.setattr(reddit, 'SubredditsStream', mock_stream)
+    monkeypatch.setattr(reddit, 'submission_filter', mock_filter)
+
+    client.get('/aww+cute')
+    first = json.loads(client.get('/next/2').data.decode())
+    assert [x['link'] for x in first] == ['t3_2', 't3_3']
+
+    # Another worker only shares the session store
+    monkeypatch.setattr(service, 'content_store', ExpiringDict())
+    monkeypatch.setattr(service, 'feeds', multicast.StreamHub())
+    second = json.loads(client.get('/next/2').data.decode())
+
+    assert listings[-1] == {'cute': 't3_2', 'aww': 't3_3'}
+    # Already served submissions are skipped even if listings shifted
+    assert [x['link'] for x in second] == ['t3_4']
+
+
+def test_combined_flag(monkeypatch, client):
+    options = []
+
+    def mock_stream(subreddits, key, func, combined=False, **kwargs):
+        options.append(combined)
+        return iter([])
+
+    monkeypatch.setattr(reddit, 'SubredditsStream', mock_stream)
+    monkeypatch.setattr(reddit, 'submission_filter',
+                        lambda stream, **kwargs: stream)
+
+    client.get('/aww+cute?combined=1')
+    client.get('/next/1')
+    client.get('/aww+cute')
+    client.get('/next/1')
+    assert options == [True, False]
+
+
+def test_follow_flag(monkeypatch, client):
+    Submission = namedtuple('Submission', ['score', 'created_utc'])
+    options = []
+
+    def mock_stream(subreddits, key, func, follow=False, **kwargs):
+        options.append((func, key(Submission(1, 2)), follow))
+        return iter([])
+
+    monkeypatch.setattr(reddit, 'SubredditsStream', mock_stream)
+    monkeypatch.setattr(reddit, 'submission_filter',
+                        lambda stream, **kwargs: stream)
+
+    client.get('/aww?follow=1')
+    client.get('/next/1')
+    client.get('/aww')
+    client.get('/next/1')
+    assert options == [('get_new', 2, True), ('get_hot', 1, False)]
+
+
+def test_followed_session_returns_what_it_found(monkeypatch, client):
+    records = [{'link': 'a', 'images': []}, reddit.IDLE,
+               {'link': 'b', 'images': []}]
+    monkeypatch.setattr(reddit, 'SubredditsStream',
+                        lambda subreddits, key, func, **kwargs: iter(records))
+    monkeypatch.setattr(reddit, 'submission_filter',
+                        lambda stream, **kwargs: stream)
+
+    client.get('/aww?follow=1')
+    first = json.loads(client.get('/next/5').data.decode())
+    second = client.get('/next/5?format=ndjson').data.decode()
+    assert first == [{'link': 'a', 'images': []}]
+    assert [json.loads(x) for x in second.splitlines()] == [
+        {'link': 'b', 'images': []}]
+
+
+def test_unknown_session(client):
+    response = client.get('/next/1')
+    assert '404' in response.status
+
+
+def test_metrics(client, records):
+    client.get('/foo')
+    client.get('/next/2?format=ndjson')
+
+    response = client.get('/metrics')
+    assert response.mimetype == 'text/plain'
+    text = response.data.decode()
+    assert '# TYPE rstream_encode_seconds histogram' in text
+    assert 'rstream_encode_seconds_count{format="ndjson"}' in text
+    assert 'rstream_next_pull_seconds_count' in text
+
+
+def test_metrics_disabled(monkeypatch, client):
+    monkeypatch.setattr(api.metrics, 'ENABLED', False)
+    assert '404' in client.get('/metrics').status
+
+
+def test_media_session(monkeypatch, tmp_path, client):
+    image = 'http://i.imgur.com/foo.jpg'
+    record = SubmissionRecord(url=image, score=1, title='', nsfw=False,
+                              link='http://reddit.com/foo', subreddit='aww',
+                              date=0.0, images=[image], fullname='t3_foo')
+    monkeypatch.setattr(reddit, 'SubredditsStream',
+                        lambda subreddits, key, func, **kwargs: iter([record]))
+    monkeypatch.setattr(reddit, 'submission_filter',
+                        lambda stream, **kwargs: stream)
+    monkeypatch.setattr(service, 'MEDIA_DIRECTORY', str(tmp_path))
+    monkeypatch.setattr(service, '_media_cache', None)
+    monkeypatch.setattr(api.http_client.CLIENT, 'request',
+                        lambda url: api.http_client.Response(
+                            url, 200, {}, b'0123456789'))
+
+    client.get('/aww?media=1')
+    served, = json.loads(client.get('/next/1').data.decode())
+    media_url, = served['images']
+    assert media_url.startswith('/media/')
+
+    response = client.get(media_url, headers={'Range': 'bytes=2-5'})
+    assert response.status_code == 206
+    assert response.data == b'2345'
+    response.close()
+
+
+def test_media_prefetched_when_read_ahead(monkeypatch, client):
+    images = ['http://i.imgur.com/{}.jpg'.format(x) for x in range(3)]
+    records = [SubmissionRecord(url=x, score=1, title='', nsfw=False,
+                                link=x, subreddit='aww', date=0.0,
+                                images=[x], fullname='t3_{}'.format(n))
+               for n, x in enumerate(images)]
+    monkeypatch.setattr(reddit, 'SubredditsStream',
+                        lambda subreddits, key, func, **kwargs: iter(records))
+    monkeypatch.setattr(reddit, 'submission_filter',
+                        lambda stream, **kwargs: stream)
+    monkeypatch.setattr(service, 'READ_AHEAD_ENABLED', True)
+    prefetched = []
+    monkeypatch.setattr(service, 'prefetch_media',
+                        lambda record: prefetched.extend(record['images']))
+
+    client.get('/aww?media=1')
+    client.get('/next/1')
+    with client.session_transaction() as cookies:
+        session = service.content_store[cookies['id']]
+    session.stream._filling.result(5)
+    # The record read ahead for the next request is already downloading
+    assert prefetched == images[:2]
+
+
+def test_unknown_media(monkeypatch, tmp_path, client):
+    monkeypatch.setattr(service, 'MEDIA_DIRECTORY', str(tmp_path))
+    monkeypatch.setattr(service, '_media_cache', None)
+    response = client.get('/media/forged.aHR0cDovL2V4YW1wbGUuY29t')
+    assert response.status_code == 404
+
+
+@pytest.fixture()
+def media_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(service, 'MEDIA_DIRECTORY', str(tmp_path))
+    monkeypatch.setattr(service, '_media_cache', None)
+    return service.media_cache()
+
+
+def test_media_upstream_timeout(monkeypatch, media_cache, client):
+    def request(url):
+        raise socket.timeout('timed out')
+
+    monkeypatch.setattr(api.http_client.CLIENT, 'request', request)
+    ident = media_cache.ident('http://i.imgur.com/foo.jpg')
+    assert client.get('/media/' + ident).status_code == 502
+
+
+def test_media_evicted_while_served(monkeypatch, media_cache, client):
+    downloads = []
+
+    def request(url):
+        downloads.append(url)
+        return api.http_client.Response(url, 200, {}, b'0123456789')
+
+    monkeypatch.setattr(api.http_client.CLIENT, 'request', request)
+    ident = media_cache.ident('http://i.imgur.com/foo.jpg')
+    os.remove(media_cache.path(ident))
+
+    response = client.get('/media/' + ident)
+    assert response.status_code == 200
+    assert response.data == b'0123456789'
+    assert len(downloads) == 2
+    response.close()
+
+
+def test_variants_disabled(monkeypatch, client):
+    monkeypatch.setattr(service, 'VARIANTS_ENABLED', False)
+    assert service.variant_pipeline() is None
+    assert client.get('/variants/foo-320.jpg').status_code == 404
+
+
+def test_read_ahead(client, records):
+    client.get('/foo')
+    first = json.loads(client.get('/next/1').data.decode())
+    with client.session_transaction() as cookies:
+        session = service.content_store[cookies['id']]
+
+    session.stream._filling.result(5)
+    assert len(session.stream) == 1
+    second = json.loads(client.get('/next/1').data.decode())
+    assert first + second == records[:2]
+
+
+def test_read_ahead_disabled(monkeypatch, client, records):
+    monkeypatch.setattr(service, 'READ_AHEAD_ENABLED', False)
+    client.get('/foo')
+    with client.session_transaction() as cookies:
+        session = service.content_store[cookies['id']]
+    assert not isinstance(session.stream, readahead.ReadAhead)
+
+
+def test_snapshot_feed(monkeypatch, tmp_path, client):
+    class Refresh():
+        """Refresh that only runs once waited on, after the snapshot"""
+        def __init__(self, func, *args):
+            self.func, self.args = func, args
+
+        def done(self):
+            return False
+
+        def result(self):
+            return self.func(*self.args)
+
+    def record(link):
+        return SubmissionRecord(url='', score=0, title='', nsfw=False,
+                                link=link, subreddit='aww', date=0.0,
+                                fullname='t3_' + link)
+
+    upstream = [[record('a'), record('b')], [record('c'), record('a')]]
+    monkeypatch.setattr(reddit, 'SubredditsStream',
+                        lambda subreddits, key, func, **kwargs:
+                        iter(upstream.pop(0)))
+    monkeypatch.setattr(reddit, 'submission_filter',
+                        lambda stream, **kwargs: stream)
+    monkeypatch.setattr(service, 'SNAPSHOTS_ENABLED', True)
+    monkeypatch.setattr(service, 'SNAPSHOT_DIRECTORY', str(tmp_path))
+    monkeypatch.setattr(service, '_snapshot_store', None)
+    monkeypatch.setattr(snapshot, 'refresh_pool',
+                        lambda: namedtuple('Pool', 'submit')(Refresh))
+
+    client.get('/aww')
+    first = json.loads(client.get('/next/5').data.decode())
+    assert [x['link'] for x in first] == ['a', 'b']
+
+    # A restarted worker serves the snapshot, then only unseen fresh records
+    monkeypatch.setattr(service, 'feeds', multicast.StreamHub())
+    client.get('/aww')
+    second = json.loads(client.get('/next/5').data.decode())
+    assert [x['link'] for x in second] == ['a', 'b', 'c']
+
+
+def test_cold_import():
+    """Importing the API builds no Reddit client and skips heavy modules"""
+    script = ('import sys, time\n'
+              'start = time.perf_counter()\n'
+              'import rStream.api\n'
+              'print(time.perf_counter() - start)\n'
+              'print(" ".join(x for x in ("praw", "sqlite3", "PIL") '
+              'if x in sys.modules))\n')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    output = subprocess.run([sys.executable, '-c', script], env=env,
+                            stdout=subprocess.PIPE, check=True,
+                            universal_newlines=True).stdout.splitlines()
+    assert float(output[0]) < IMPORT_BUDGET
+    assert output[1:] in ([], [''])
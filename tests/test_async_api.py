@@ -0,0 +1,259 @@
+import asyncio
+import json
+import socket
+import threading
+
+import pytest
+
+from rStream import async_api, service
+from rStream.libs import async_reddit, http_client, reddit
+from rStream.libs.cache import ExpiringDict
+from rStream.libs.records import SubmissionRecord
+
+
+def run(requests):
+    """Runs coroutine `requests` on one loop, like the server's"""
+    return asyncio.run(requests)
+
+
+async def call(path, cookie=None, headers=()):
+    """Sends one GET request through the ASGI app"""
+    path, __, query = path.partition('?')
+    headers = [(x.encode(), y.encode()) for x, y in headers]
+    if cookie:
+        headers.append((b'cookie', cookie.encode()))
+    scope = {'type': 'http', 'method': 'GET', 'path': path,
+             'query_string': query.encode(), 'headers': headers}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await async_api.app(scope, receive, send)
+    start, *bodies = messages
+    return (start['status'], dict(start['headers']),
+            b''.join(x['body'] for x in bodies))
+
+
+def session_cookie(headers):
+    return headers[b'set-cookie'].decode().split(';')[0]
+
+
+async def aiterate(items):
+    for item in items:
+        yield item
+
+
+@pytest.fixture()
+def records(monkeypatch):
+    records = [{'link': 'http://test.com/{}'.format(x), 'images': [str(x)]}
+               for x in range(3)]
+    monkeypatch.setattr(async_reddit, 'AsyncSubredditsStream',
+                        lambda subreddits, key, func, **kwargs:
+                        aiterate(records))
+    monkeypatch.setattr(async_reddit, 'submission_filter',
+                        lambda stream, **kwargs: stream)
+    return records
+
+
+@pytest.fixture()
+def media_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(service, 'MEDIA_DIRECTORY', str(tmp_path))
+    monkeypatch.setattr(service, '_media_cache', None)
+    return service.media_cache()
+
+
+@pytest.fixture()
+def image(monkeypatch, media_cache):
+    """Returns the /media path of an image downloaded as b'0123456789'"""
+    monkeypatch.setattr(http_client.CLIENT, 'request',
+                        lambda url: http_client.Response(url, 200, {},
+                                                         b'0123456789'))
+    return '/media/' + media_cache.ident('http://i.imgur.com/foo.jpg')
+
+
+def test_startup_preloads(monkeypatch):
+    loaded = []
+    monkeypatch.setattr(reddit, 'preload',
+                        lambda: loaded.append(threading.current_thread()))
+
+    async def lifespan():
+        messages = iter([{'type': 'lifespan.startup'},
+                         {'type': 'lifespan.shutdown'}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        await async_api.app({'type': 'lifespan'}, receive, send)
+        return sent
+
+    sent = run(lifespan())
+    assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+    loader, = loaded
+    assert loader is not threading.main_thread()
+
+
+def test_root_response_is_200():
+    status, __, body = run(call('/'))
+    assert status == 200
+    assert json.loads(body) == {}
+
+
+def test_next_json(records):
+    async def requests():
+        __, headers, __ = await call('/foo+bar')
+        cookie = session_cookie(headers)
+        return [await call('/next/2', cookie), await call('/next/2', cookie)]
+
+    (status, __, first), (__, __, second) = run(requests())
+    assert status == 200
+    assert json.loads(first) == records[:2]
+    assert json.loads(second) == records[2:]
+
+
+def test_ndjson_stream(records):
+    async def requests():
+        __, headers, __ = await call('/foo')
+        return await call('/next/5?format=ndjson', session_cookie(headers))
+
+    status, headers, body = run(requests())
+
+    assert headers[b'content-type'] == b'application/x-ndjson'
+    assert [json.loads(x) for x in body.splitlines()] == records
+
+
+def test_unknown_session():
+    status, __, __ = run(call('/next/1', 'rstream_session=unknown'))
+    assert status == 404
+
+
+def test_stream_from_cursor(monkeypatch):
+    class Submission():
+        def __init__(self, ident, score):
+            self.id = ident
+            self.score = score
+            self.fullname = 't3_' + ident
+            self.url = 'http://i.imgur.com/{}.jpg'.format(ident)
+
+    class Subreddit():
+        display_name = 'aww'
+
+        def get_hot(self, limit, params=None):
+            return iter([Submission('b', 2), Submission('a', 1)])
+
+    monkeypatch.setattr(reddit.REDDIT, 'get_subreddit',
+                        lambda name: Subreddit())
+    monkeypatch.setattr(reddit, 'info_from_submission',
+                        lambda submission, manager, **kwargs: {
+                            'link': submission.fullname})
+
+    async def requests():
+        __, headers, __ = await call('/aww')
+        return await call('/next/5', session_cookie(headers))
+
+    __, __, body = run(requests())
+    assert json.loads(body) == [{'link': 't3_b'}, {'link': 't3_a'}]
+
+
+def test_options_shared_with_api(monkeypatch, records):
+    options = []
+
+    def mock_stream(subreddits, key, func, combined=False, **kwargs):
+        options.append((subreddits, func, combined))
+        return aiterate(records)
+
+    monkeypatch.setattr(async_reddit, 'AsyncSubredditsStream', mock_stream)
+
+    async def requests():
+        __, headers, __ = await call('/Pics+aww?combined=1')
+        return await call('/next/1', session_cookie(headers))
+
+    __, __, body = run(requests())
+    assert json.loads(body) == records[:1]
+    assert options == [(('aww', 'pics'), 'get_hot', True)]
+
+
+def test_session_resumed_from_store(monkeypatch):
+    submissions = [SubmissionRecord(url='', score=1, title='', nsfw=False,
+                                    link='http://reddit.com/' + x,
+                                    subreddit='aww', date=0.0, images=[],
+                                    fullname='t3_' + x)
+                   for x in 'ab']
+    resumed = []
+
+    def mock_stream(subreddits, key, func, after=None, **kwargs):
+        resumed.append(dict(after))
+        return aiterate(submissions)
+
+    monkeypatch.setattr(async_reddit, 'AsyncSubredditsStream', mock_stream)
+    monkeypatch.setattr(async_reddit, 'submission_filter',
+                        lambda stream, **kwargs: stream)
+
+    async def requests():
+        __, headers, __ = await call('/aww')
+        cookie = session_cookie(headers)
+        await call('/next/1', cookie)
+        # As if the session moved to another worker
+        monkeypatch.setattr(service, 'async_content_store', ExpiringDict())
+        return await call('/next/5', cookie)
+
+    __, __, body = run(requests())
+    assert [x['link'] for x in json.loads(body)] == ['http://reddit.com/b']
+    assert resumed == [{}, {'aww': 't3_a'}]
+
+
+def test_follow_refused(records):
+    status, headers, body = run(call('/aww?follow=1'))
+    assert status == 400
+    assert b'set-cookie' not in headers
+
+
+def test_media_upstream_timeout(monkeypatch, media_cache):
+    def request(url):
+        raise socket.timeout('timed out')
+
+    monkeypatch.setattr(http_client.CLIENT, 'request', request)
+    ident = media_cache.ident('http://i.imgur.com/foo.jpg')
+
+    status, __, __ = run(call('/media/' + ident))
+    assert status == 502
+
+
+def test_media_streamed(image):
+    status, headers, body = run(call(image))
+    assert status == 200
+    assert body == b'0123456789'
+    assert headers[b'content-length'] == b'10'
+    assert headers[b'accept-ranges'] == b'bytes'
+
+
+def test_media_range(image):
+    status, headers, body = run(call(image, headers=[('range',
+                                                      'bytes=2-5')]))
+    assert status == 206
+    assert body == b'2345'
+    assert headers[b'content-range'] == b'bytes 2-5/10'
+
+    status, __, body = run(call(image, headers=[('range', 'bytes=-3')]))
+    assert status == 206
+    assert body == b'789'
+
+    status, headers, __ = run(call(image, headers=[('range', 'bytes=10-')]))
+    assert status == 416
+    assert headers[b'content-range'] == b'bytes */10'
+
+
+def test_media_not_modified(image):
+    __, headers, __ = run(call(image))
+    etag = headers[b'etag'].decode()
+
+    status, __, body = run(call(image, headers=[('if-none-match', etag)]))
+    assert status == 304
+    assert body == b''
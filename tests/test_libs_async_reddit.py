@@ -0,0 +1,134 @@
+import asyncio
+from collections import namedtuple
+import time
+
+import pytest
+
+from rStream.libs import async_reddit, reddit
+from rStream.tests.test_libs_reddit import (MockSourceManager, MockSubreddit,
+                                            bar, baz, foo, mock_subs,
+                                            order_by_score)
+
+
+async def collect(aiterable):
+    return [x async for x in aiterable]
+
+
+async def aiter_of(items):
+    for item in items:
+        yield item
+
+
+class TestAsyncSubredditsStream():
+    @pytest.fixture(autouse=True)
+    def identity(self, monkeypatch):
+        monkeypatch.setattr(reddit.REDDIT, 'get_subreddit', lambda x: x)
+
+    @pytest.mark.parametrize('read_ahead', [0, 1, 2, 5])
+    def test_order_by_score(self, read_ahead):
+        stream = async_reddit.AsyncSubredditsStream(mock_subs,
+                                                    key=lambda x: x.score,
+                                                    func='get_hot',
+                                                    read_ahead=read_ahead)
+        results = asyncio.run(collect(stream))
+        assert [x.id for x in results] == order_by_score
+
+    def test_empty_subreddit(self):
+        stream = async_reddit.AsyncSubredditsStream([MockSubreddit('empty')],
+                                                    key=lambda x: x.score,
+                                                    func='get_hot')
+        assert asyncio.run(collect(stream)) == []
+
+    def test_resume_after(self):
+        queried = {}
+
+        class ResumableSubreddit(MockSubreddit):
+            def get_hot(self, limit, params=None):
+                queried[self.name] = params
+                return iter(self.submissions)
+
+        subs = [ResumableSubreddit(x.name, x.submissions) for x in mock_subs]
+        stream = async_reddit.AsyncSubredditsStream(
+            subs, key=lambda x: x.score, func='get_hot',
+            after={subs[1]: 't3_bar3'})
+        asyncio.run(collect(stream))
+
+        assert queried == {'foo': None,
+                           'bar': {'after': 't3_bar3'},
+                           'baz': None}
+
+    def test_combined(self, monkeypatch):
+        listings = {'foo+bar': MockSubreddit('foo+bar', sorted(
+            foo.submissions + bar.submissions, key=lambda x: -x.score)),
+                    'baz': baz}
+        monkeypatch.setattr(reddit, 'COMBINED_SUBREDDIT_LIMIT', 2)
+        monkeypatch.setattr(reddit.REDDIT, 'get_subreddit', listings.get)
+        stream = async_reddit.AsyncSubredditsStream(['foo', 'bar', 'baz'],
+                                                    key=lambda x: x.score,
+                                                    func='get_hot',
+                                                    combined=True)
+
+        assert [x.name for x in stream.subs] == ['foo+bar', 'baz']
+        results = asyncio.run(collect(stream))
+        assert [x.id for x in results] == order_by_score
+
+
+class TestAsyncSubmissionFilter():
+    HasUrl = namedtuple('HasUrl', ['url', 'delay'])
+
+    @pytest.fixture(autouse=True)
+    def slow_resolution(self, monkeypatch):
+        def resolve(submission, manager, **kwargs):
+            time.sleep(submission.delay)
+            return submission.url
+
+        monkeypatch.setattr(reddit.source_managers,
+                            'SOURCE_MANAGERS',
+                            [MockSourceManager])
+        monkeypatch.setattr(reddit, 'info_from_submission', resolve)
+
+    def test_filters_unsupported(self):
+        submissions = [self.HasUrl('http://test.com/1', 0),
+                       self.HasUrl('http://foo.bar/', 0),
+                       self.HasUrl('http://test.com/2', 0)]
+        filtered = async_reddit.submission_filter(aiter_of(submissions))
+        assert asyncio.run(collect(filtered)) == ['http://test.com/1',
+                                                  'http://test.com/2']
+
+    def test_window_keeps_order(self):
+        submissions = [self.HasUrl('http://test.com/{}'.format(x), delay)
+                       for x, delay in zip((1, 2, 3), (0.2, 0.0, 0.1))]
+        filtered = async_reddit.submission_filter(aiter_of(submissions),
+                                                  window=3)
+        assert asyncio.run(collect(filtered)) == [x.url for x in submissions]
+
+    def test_window_completion_order(self):
+        submissions = [self.HasUrl('http://test.com/1', 0.3),
+                       self.HasUrl('http://test.com/2', 0.0)]
+        filtered = async_reddit.submission_filter(aiter_of(submissions),
+                                                  window=2, ordered=False)
+        assert asyncio.run(collect(filtered)) == ['http://test.com/2',
+                                                  'http://test.com/1']
+
+    def test_dedup(self):
+        submissions = [self.HasUrl('http://test.com/1', 0),
+                       self.HasUrl('https://test.com/1/', 0)]
+        filtered = async_reddit.submission_filter(aiter_of(submissions),
+                                                  dedup=True)
+        assert asyncio.run(collect(filtered)) == ['http://test.com/1']
+
+    def test_per_host_limit(self, monkeypatch):
+        monkeypatch.setattr(reddit, 'PER_HOST_LIMIT', 2)
+        submissions = [self.HasUrl('http://test.com/1', 0.1)
+                       for __ in range(6)]
+
+        async def timed():
+            start = time.perf_counter()
+            filtered = async_reddit.submission_filter(aiter_of(submissions),
+                                                      window=6)
+            results = await collect(filtered)
+            return results, time.perf_counter() - start
+
+        results, elapsed = asyncio.run(timed())
+        assert len(results) == 6
+        assert elapsed >= 0.3
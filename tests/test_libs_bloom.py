@@ -0,0 +1,30 @@
+import pytest
+
+from rStream.libs.bloom import BloomFilter
+
+
+def test_add_and_contains():
+    bloom = BloomFilter(100)
+    assert 'foo' not in bloom
+    assert bloom.add('foo') is True
+    assert 'foo' in bloom
+    assert bloom.add('foo') is False
+    assert len(bloom) == 1
+
+
+def test_memory_is_fixed():
+    bloom = BloomFilter(1000, error_rate=0.01)
+    size = len(bloom._bits)
+    for index in range(5000):
+        bloom.add(str(index))
+    assert len(bloom._bits) == size
+
+
+@pytest.mark.parametrize('error_rate', [0.01, 0.001])
+def test_false_positive_rate(error_rate):
+    bloom = BloomFilter(5000, error_rate=error_rate)
+    for index in range(5000):
+        bloom.add('seen{}'.format(index))
+
+    false_positives = sum('unseen{}'.format(x) in bloom for x in range(20000))
+    assert false_positives / 20000 < error_rate * 2
@@ -88,3 +88,89 @@ class TestExpiringDict():
         assert 'foo' in seeded_dict
         time.sleep(1.0)
         assert 'foo' not in seeded_dict
+
+    def test_lookup_extends_expiry(self, seeded_dict):
+        time.sleep(0.3)
+        assert seeded_dict['foo'] == 'bar'
+        time.sleep(0.3)
+        assert 'foo' in seeded_dict
+        time.sleep(0.5)
+        assert 'foo' not in seeded_dict
+
+    def test_replaced_value_keeps_own_expiry(self, monkeypatch, seeded_dict):
+        monkeypatch.setattr(cache, 'TIMEOUT', 60.0)
+        seeded_dict['foo'] = 'qux'
+        time.sleep(0.7)
+        assert seeded_dict['foo'] == 'qux'
+
+    def test_replaced_values_are_not_retained(self, expiringdict):
+        values = [object() for __ in range(100)]
+        for value in values:
+            expiringdict['foo'] = value
+
+        assert len(expiringdict._schedule) == 1
+        references = [x for x in expiringdict._schedule
+                      if any(y in x for y in values)]
+        assert not references
+
+    def test_single_reaper_thread(self, expiringdict):
+        before = threading.active_count()
+        for index in range(100):
+            expiringdict[index] = index
+            expiringdict[index]
+        assert threading.active_count() - before == 1
+
+    def test_reaper_stops_when_empty(self, seeded_dict):
+        reaper = seeded_dict._reaper
+        assert reaper.is_alive()
+        reaper.join(2.0)
+        assert not reaper.is_alive()
+        assert seeded_dict._reaper is None
+
+
+class TestLRUCache():
+    def test_get_and_set(self):
+        lru = cache.LRUCache()
+        assert lru.get('foo') is None
+        lru.set('foo', ['bar'])
+        assert lru.get('foo') == ['bar']
+        assert lru.stats()['hits'] == 1
+        assert lru.stats()['misses'] == 1
+
+    def test_evicts_least_recently_used(self):
+        lru = cache.LRUCache(maxsize=2)
+        lru.set('foo', 1)
+        lru.set('bar', 2)
+        lru.get('foo')
+        lru.set('baz', 3)
+        assert lru.get('bar') is None
+        assert lru.get('foo') == 1
+        assert lru.get('baz') == 3
+        assert len(lru) == 2
+
+    def test_ttl(self):
+        lru = cache.LRUCache(ttl=0.1)
+        lru.set('foo', 'bar')
+        assert lru.get('foo') == 'bar'
+        time.sleep(0.2)
+        sentinel = object()
+        assert lru.get('foo', sentinel) is sentinel
+
+    def test_store_survives_restart(self, tmp_path):
+        path = str(tmp_path / 'resolved.sqlite')
+        lru = cache.LRUCache(store=cache.SqliteStore(path))
+        lru.set('foo', ['bar', 'baz'])
+        lru.store.close()
+
+        restarted = cache.LRUCache(store=cache.SqliteStore(path))
+        assert restarted.get('foo') == ['bar', 'baz']
+        assert restarted.stats()['store_hits'] == 1
+        # Now held in memory as well
+        assert restarted.get('foo') == ['bar', 'baz']
+        assert restarted.stats()['store_hits'] == 1
+
+    def test_store_honours_ttl(self, tmp_path):
+        store = cache.SqliteStore(str(tmp_path / 'resolved.sqlite'))
+        cache.LRUCache(ttl=0.1, store=store).set('foo', 'bar')
+        time.sleep(0.2)
+        assert cache.LRUCache(store=store).get('foo') is None
@@ -0,0 +1,104 @@
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+import pytest
+
+from rStream.libs import http_client
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Serves a few fixed routes over keep-alive connections
+
+    Every new connection is counted on the server, so tests can tell
+    whether connections are being reused.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/json':
+            self._reply(200, json.dumps({'foo': 'bar'}).encode())
+        elif self.path == '/gzip':
+            accepted = self.headers.get('Accept-Encoding', '')
+            self._reply(200, gzip.compress(b'compressed'),
+                        {'Content-Encoding': 'gzip'} if accepted else None)
+        elif self.path == '/redirect':
+            self._reply(302, headers={'Location': '/json'})
+        else:
+            self._reply(404)
+
+
+@pytest.fixture()
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), MockHandler)
+    httpd.connections = 0
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture()
+def client():
+    client = http_client.HTTPClient(timeout=2.0)
+    yield client
+    client.close()
+
+
+def url(server, path):
+    return 'http://127.0.0.1:{}{}'.format(server.server_port, path)
+
+
+def test_get_json(server, client):
+    assert client.get_json(url(server, '/json')) == {'foo': 'bar'}
+
+
+def test_connection_is_reused(server, client):
+    for __ in range(5):
+        client.get_json(url(server, '/json'))
+    assert server.connections == 1
+
+
+def test_gzip_is_decoded(server, client):
+    response = client.request(url(server, '/gzip'))
+    assert response.body == b'compressed'
+
+
+def test_redirect_is_followed(server, client):
+    response = client.request(url(server, '/redirect'))
+    assert response.url == url(server, '/json')
+    assert response.json() == {'foo': 'bar'}
+
+
+def test_error_status_raises(server, client):
+    with pytest.raises(http_client.HTTPError) as error:
+        client.request(url(server, '/missing'))
+    assert error.value.status == 404
+
+
+def test_stale_connection_is_replaced(monkeypatch, server, client):
+    # The server drops idle keep-alive connections after this many seconds
+    monkeypatch.setattr(MockHandler, 'timeout', 0.1)
+    client.get_json(url(server, '/json'))
+    time.sleep(0.3)
+
+    assert client.get_json(url(server, '/json')) == {'foo': 'bar'}
+    assert server.connections == 2
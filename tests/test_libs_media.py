@@ -0,0 +1,128 @@
+import os
+import threading
+
+import pytest
+
+from rStream.libs import http_client, media
+
+
+class MockClient():
+    def __init__(self, size=10, delay=None):
+        self.size = size
+        self.delay = delay
+        self.requested = []
+
+    def request(self, url):
+        self.requested.append(url)
+        if self.delay is not None:
+            self.delay.wait(5)
+        if 'missing' in url:
+            raise http_client.HTTPError(url, 404, 'Not Found')
+        return http_client.Response(url, 200, {}, b'x' * self.size)
+
+
+@pytest.fixture()
+def client(monkeypatch):
+    client = MockClient()
+    monkeypatch.setattr(http_client, 'CLIENT', client)
+    return client
+
+
+@pytest.fixture()
+def cache(tmp_path):
+    return media.MediaCache(str(tmp_path), 'secret', max_bytes=25)
+
+
+def test_ident_round_trip(cache):
+    url = 'http://i.imgur.com/foo.jpg?x=1'
+    assert cache.url(cache.ident(url)) == url
+
+
+@pytest.mark.parametrize('ident', ['', 'nope', 'abc.def', '.....'])
+def test_ident_not_genuine(cache, ident):
+    assert cache.url(ident) is None
+
+
+def test_ident_signed_with_secret(cache, tmp_path):
+    other = media.MediaCache(str(tmp_path / 'other'), 'other secret')
+    assert cache.url(other.ident('http://i.imgur.com/foo.jpg')) is None
+
+
+def test_downloaded_once(client, cache):
+    ident = cache.ident('http://i.imgur.com/foo.jpg')
+    first = cache.path(ident)
+    second = cache.path(ident)
+
+    assert first == second
+    assert first.endswith('.jpg')
+    with open(first, 'rb') as source:
+        assert source.read() == b'x' * 10
+    assert client.requested == ['http://i.imgur.com/foo.jpg']
+
+
+def test_concurrent_lookups_share_download(monkeypatch, cache):
+    release = threading.Event()
+    client = MockClient(delay=release)
+    monkeypatch.setattr(http_client, 'CLIENT', client)
+    ident = cache.ident('http://i.imgur.com/foo.jpg')
+
+    paths = []
+    threads = [threading.Thread(target=lambda: paths.append(cache.path(ident)))
+               for __ in range(4)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(set(paths)) == 1 and len(paths) == 4
+    assert len(client.requested) == 1
+
+
+def test_least_recently_used_evicted(client, cache):
+    first, second, third = (cache.ident('http://i.imgur.com/{}.jpg'.format(x))
+                            for x in 'abc')
+    first_path = cache.path(first)
+    second_path = cache.path(second)
+    cache.path(first)
+    cache.path(third)
+
+    assert cache.size == 20
+    assert os.path.exists(first_path)
+    assert not os.path.exists(second_path)
+
+
+def test_upstream_error(client, cache):
+    with pytest.raises(http_client.HTTPError):
+        cache.path(cache.ident('http://i.imgur.com/missing.jpg'))
+    assert len(cache) == 0
+
+
+def test_discarded_image_downloaded_again(client, cache):
+    ident = cache.ident('http://i.imgur.com/foo.jpg')
+    os.remove(cache.path(ident))
+    cache.discard(ident)
+
+    assert os.path.exists(cache.path(ident))
+    assert cache.size == 10
+    assert len(client.requested) == 2
+
+
+def test_files_kept_across_restarts(client, cache, tmp_path):
+    path = cache.path(cache.ident('http://i.imgur.com/foo.jpg'))
+    restarted = media.MediaCache(str(tmp_path), 'secret', max_bytes=25)
+
+    ident = restarted.ident('http://i.imgur.com/foo.jpg')
+    assert restarted.path(ident) == path
+    assert restarted.size == 10
+    assert len(client.requested) == 1
+
+
+def test_prefetch(client, cache):
+    cache.prefetch(['http://i.imgur.com/foo.jpg',
+                    'http://i.imgur.com/missing.jpg'])
+    cache._pool.shutdown(wait=True)
+
+    assert len(cache) == 1
+    assert sorted(client.requested) == ['http://i.imgur.com/foo.jpg',
+                                        'http://i.imgur.com/missing.jpg']
@@ -0,0 +1,74 @@
+import pytest
+
+from rStream.libs import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(metrics, 'ENABLED', True)
+    return metrics.Registry()
+
+
+def test_counter(registry):
+    counter = registry.counter('test_total', 'Test counter', ('kind',))
+    counter.inc('a')
+    counter.inc('a', amount=2)
+    counter.inc('b')
+
+    text = registry.render()
+    assert '# TYPE test_total counter' in text
+    assert 'test_total{kind="a"} 3' in text
+    assert 'test_total{kind="b"} 1' in text
+
+
+def test_histogram(registry):
+    histogram = registry.histogram('test_seconds', 'Test histogram',
+                                   buckets=(0.1, 1.0))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5.0)
+
+    lines = registry.render().splitlines()
+    assert 'test_seconds_bucket{le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{le="+Inf"} 3' in lines
+    assert 'test_seconds_sum 5.55' in lines
+    assert 'test_seconds_count 3' in lines
+
+
+def test_timer(registry):
+    histogram = registry.histogram('timed_seconds', 'Timed')
+    with metrics.timer(histogram):
+        pass
+    assert 'timed_seconds_count 1' in registry.render()
+
+
+def test_gauge(registry):
+    registry.gauge('test_size', 'Test gauge', lambda: 7)
+    assert 'test_size 7' in registry.render()
+
+
+def test_declared_once(registry):
+    first = registry.counter('test_total', 'Test counter')
+    assert registry.counter('test_total', 'Test counter') is first
+
+
+def test_label_values_escaped(registry):
+    counter = registry.counter('test_total', 'Test counter', ('path',))
+    counter.inc('a"b\\c')
+    assert r'test_total{path="a\"b\\c"} 1' in registry.render()
+
+
+def test_disabled_records_nothing(monkeypatch, registry):
+    counter = registry.counter('test_total', 'Test counter')
+    histogram = registry.histogram('test_seconds', 'Test histogram')
+    monkeypatch.setattr(metrics, 'ENABLED', False)
+
+    counter.inc()
+    with metrics.timer(histogram):
+        pass
+    assert metrics.timer(histogram) is metrics._NULL_TIMER
+
+    samples = [x for x in registry.render().splitlines()
+               if not x.startswith('#')]
+    assert samples == []
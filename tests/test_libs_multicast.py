@@ -0,0 +1,144 @@
+import gc
+import threading
+
+import pytest
+
+from rStream.libs import multicast
+
+
+class CountingSource():
+    """Iterates over range(size), counting how many items were pulled"""
+    def __init__(self, size):
+        self.pulled = 0
+        self.size = size
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.pulled >= self.size:
+            raise StopIteration
+        self.pulled += 1
+        return self.pulled - 1
+
+
+@pytest.fixture()
+def source():
+    return CountingSource(5)
+
+
+@pytest.fixture()
+def shared(source):
+    return multicast.SharedStream(lambda: source)
+
+
+def test_source_built_lazily():
+    built = []
+    shared = multicast.SharedStream(lambda: built.append(1) or iter([1]))
+    cursor = shared.cursor()
+    assert not built
+    assert next(cursor) == 1
+    assert built == [1]
+
+
+def test_cursors_read_independently(source, shared):
+    first, second = shared.cursor(), shared.cursor()
+    assert list(first) == [0, 1, 2, 3, 4]
+    assert list(second) == [0, 1, 2, 3, 4]
+    assert source.pulled == 5
+
+
+def test_buffer_trimmed_once_all_cursors_pass(shared):
+    first, second = shared.cursor(), shared.cursor()
+    next(first), next(first), next(first)
+    assert len(shared) == 3
+
+    next(second)
+    assert len(shared) == 2
+    next(second), next(second)
+    assert len(shared) == 0
+
+
+def test_dead_cursors_do_not_hold_buffer(shared):
+    first, second = shared.cursor(), shared.cursor()
+    next(first)
+    del second
+    gc.collect()
+    next(first)
+    assert len(shared) == 0
+
+
+def test_new_cursor_starts_at_head(source, shared):
+    first = shared.cursor()
+    next(first), next(first), next(first)
+    assert list(shared.cursor()) == [0, 1, 2, 3, 4]
+    assert source.pulled == 5
+
+
+def test_new_cursor_joins_after_head(monkeypatch, shared):
+    monkeypatch.setattr(multicast, 'HEAD_SIZE', 2)
+    first = shared.cursor()
+    next(first), next(first), next(first), next(first)
+    # Items 2 and 3 were dropped once read, so it joins at the next one
+    assert list(shared.cursor()) == [0, 1, 4]
+
+
+def test_expended(shared):
+    cursor = shared.cursor()
+    list(cursor)
+    with pytest.raises(StopIteration):
+        next(cursor)
+    assert list(shared.cursor()) == [0, 1, 2, 3, 4]
+
+
+def test_buffered_reads_do_not_wait_on_upstream():
+    pulling, release = threading.Event(), threading.Event()
+
+    def source():
+        yield 0
+        pulling.set()
+        release.wait(5)
+        yield 1
+
+    shared = multicast.SharedStream(source)
+    first, second = shared.cursor(), shared.cursor()
+    assert next(first) == 0
+
+    blocked = threading.Thread(target=next, args=(first,))
+    blocked.start()
+    assert pulling.wait(5)
+    assert next(second) == 0
+    release.set()
+    blocked.join(5)
+    assert next(second) == 1
+
+
+class TestStreamHub():
+    def test_same_key_shares_upstream(self, source):
+        hub = multicast.StreamHub()
+        built = []
+
+        def factory():
+            built.append(1)
+            return source
+
+        first = hub.open('foo', factory)
+        second = hub.open('foo', factory)
+        assert list(first) == list(second) == [0, 1, 2, 3, 4]
+        assert len(built) == 1
+        assert source.pulled == 5
+
+    def test_different_keys_do_not_share(self):
+        hub = multicast.StreamHub()
+        foo = hub.open('foo', lambda: iter('foo'))
+        bar = hub.open('bar', lambda: iter('bar'))
+        assert ''.join(foo) == 'foo'
+        assert ''.join(bar) == 'bar'
+
+    def test_stream_released_with_cursors(self):
+        hub = multicast.StreamHub()
+        cursor = hub.open('foo', lambda: iter('foo'))
+        assert len(hub) == 1
+        del cursor
+        gc.collect()
+        assert len(hub) == 0
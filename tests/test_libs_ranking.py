@@ -0,0 +1,64 @@
+from collections import namedtuple
+
+import pytest
+
+from rStream.libs import ranking
+
+
+Submission = namedtuple('Submission', ('id', 'score', 'created_utc'))
+
+# A big subreddit, whose worst submission outscores the small one's best
+big = [Submission('big{}'.format(x), score, 1500000000.0)
+       for x, score in enumerate((9000, 5000, 1000))]
+small = [Submission('small{}'.format(x), score, 1500000000.0)
+         for x, score in enumerate((90, 50, 10))]
+window = big + small
+groups = ['big'] * 3 + ['small'] * 3
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def backend(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(ranking, 'numpy', None)
+    return request.param
+
+
+def ids(submissions):
+    return [x.id for x in submissions]
+
+
+def test_raw_scores(backend):
+    ranker = ranking.WindowRanker(hot=False, normalize=False)
+    assert ids(ranker.rank(window, groups)) == [
+        'big0', 'big1', 'big2', 'small0', 'small1', 'small2']
+
+
+def test_normalized_scores_mix_subreddits(backend):
+    ranker = ranking.WindowRanker(hot=False)
+    assert ids(ranker.rank(window, groups)) == [
+        'big0', 'small0', 'big1', 'small1', 'big2', 'small2']
+
+
+def test_weights(backend):
+    ranker = ranking.WindowRanker(hot=False, weights={'Small': 2})
+    assert ids(ranker.rank(window, groups))[:2] == ['small0', 'small1']
+
+
+def test_hot_favours_newer(backend):
+    old = Submission('old', 100, 1500000000.0)
+    # A tenth of the score, but more than one decay period newer
+    new = Submission('new', 10, 1500000000.0 + 2 * ranking.HOT_DECAY)
+    ranker = ranking.WindowRanker(normalize=False)
+    assert ids(ranker.rank([old, new], ['a', 'a'])) == ['new', 'old']
+
+
+def test_ties_keep_order(backend):
+    tied = [Submission(str(x), 1, 1500000000.0) for x in range(4)]
+    ranker = ranking.WindowRanker()
+    assert ids(ranker.rank(tied, ['a', 'b', 'a', 'b'])) == ['0', '1', '2', '3']
+
+
+def test_empty_window(backend):
+    assert ranking.WindowRanker().rank([], []) == []
@@ -0,0 +1,87 @@
+from concurrent.futures import ThreadPoolExecutor
+import gc
+
+import pytest
+
+from rStream.libs import readahead
+
+
+@pytest.fixture()
+def pool():
+    pool = ThreadPoolExecutor(1)
+    yield pool
+    pool.shutdown()
+
+
+def test_reads_ahead_after_request(pool):
+    budget = readahead.Budget()
+    stream = readahead.ReadAhead(iter(range(10)), budget, pool)
+    assert [next(stream) for __ in range(3)] == [0, 1, 2]
+
+    stream.requested(3)
+    stream._filling.result(5)
+    assert len(stream) == 3
+    assert budget.used == 3
+    assert list(stream) == list(range(3, 10))
+    assert budget.used == 0
+
+
+def test_records_seen_as_pulled(pool):
+    pulled = []
+    stream = readahead.ReadAhead(iter(range(10)), readahead.Budget(), pool,
+                                 on_pull=pulled.append)
+    assert next(stream) == 0
+    stream.requested(1)
+    stream._filling.result(5)
+    # Read ahead, before the next request asks for it
+    assert pulled == [0, 1]
+
+
+def test_budget_bounds_buffer(pool):
+    budget = readahead.Budget(limit=2)
+    stream = readahead.ReadAhead(iter(range(10)), budget, pool)
+    stream.requested(5)
+    stream._filling.result(5)
+
+    assert len(stream) == 2
+    assert not budget.acquire()
+
+
+def test_discarded_sessions_release_budget(pool):
+    budget = readahead.Budget()
+    stream = readahead.ReadAhead(iter(range(10)), budget, pool)
+    stream.requested(4)
+    stream._filling.result(5)
+    assert budget.used == 4
+
+    del stream
+    gc.collect()
+    assert budget.used == 0
+
+
+def test_errors_reach_next_request(pool):
+    def failing():
+        yield 1
+        raise RuntimeError('upstream')
+
+    stream = readahead.ReadAhead(failing(), readahead.Budget(), pool)
+    stream.requested(2)
+    stream._filling.result(5)
+
+    assert next(stream) == 1
+    with pytest.raises(RuntimeError):
+        next(stream)
+
+
+@pytest.mark.parametrize('interval, pull_time, depth', [
+    (None, None, 10),  # Nothing observed yet, one request's worth
+    (10.0, 0.1, 10),  # Pulling a request's worth is quicker than a request
+    (1.0, 0.25, 30),  # Takes nearly three requests' worth of time
+    (0.1, 1.0, 40),  # Capped at MAX_BATCHES
+    (readahead.IDLE_INTERVAL + 1, 1.0, 0),  # Idle sessions are not read
+])
+def test_depth(monkeypatch, interval, pull_time, depth):
+    monkeypatch.setattr(readahead, 'MAX_BATCHES', 4)
+    stream = readahead.ReadAhead(iter(()), readahead.Budget())
+    stream.interval, stream.pull_time = interval, pull_time
+    assert stream.depth(10) == depth
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from rStream.libs.records import SubmissionRecord
+
+
+@pytest.fixture()
+def record():
+    return SubmissionRecord(
+        url='http://imgur.com/a/foo',
+        score=23,
+        title='Test Submission',
+        nsfw=False,
+        link='http://test.com/test',
+        subreddit='aww',
+        date=12345.0,
+        images=['http://i.imgur.com/1.jpg', 'http://i.imgur.com/2.jpg']
+    )
+
+
+def test_reads_like_a_dict(record):
+    assert record['url'] == 'http://imgur.com/a/foo'
+    assert record.get('score') == 23
+    assert 'images_id' not in record
+    with pytest.raises(KeyError):
+        record['missing']
+
+
+def test_json_shape_matches_dicts(record):
+    expected = {
+        'url': 'http://imgur.com/a/foo',
+        'score': 23,
+        'title': 'Test Submission',
+        'nsfw': False,
+        'link': 'http://test.com/test',
+        'subreddit': 'aww',
+        'date': 12345.0,
+        'images': ['http://i.imgur.com/1.jpg', 'http://i.imgur.com/2.jpg'],
+    }
+    assert json.loads(json.dumps(dict(record))) == expected
+    assert list(record) == list(expected)
+
+
+def test_deferred_records_carry_images_id(record):
+    deferred = SubmissionRecord(*(record[x] for x in record),
+                                images_id='abc123')
+    assert deferred['images_id'] == 'abc123'
+    assert len(deferred) == len(record) + 1
+
+
+def test_compact(record):
+    assert not hasattr(record, '__dict__')
+    assert isinstance(record.images, tuple)
+    fields = dict(record, subreddit=''.join(['a', 'ww']))
+    other = SubmissionRecord(**fields)
+    assert other.subreddit is record.subreddit
+
+
+def test_variants_are_optional(record):
+    variants = [({'url': '/variants/1-320.jpg', 'width': 320,
+                  'height': 240},), ()]
+    fields = dict(record)
+    with_variants = SubmissionRecord(variants=variants, **fields)
+
+    assert 'variants' not in record
+    assert with_variants['variants'] == tuple(variants)
+    assert len(with_variants) == len(record) + 1
+    assert list(with_variants)[-1] == 'variants'
@@ -1,4 +1,7 @@
 from collections import namedtuple
+from concurrent.futures import Future
+import threading
+import time
 
 from praw import errors
 import pytest
@@ -51,6 +54,11 @@ class MockSourceManager():
     def get_images(cls, url):
         return cls.results.get(url)
 
+    @classmethod
+    def preview(cls, url):
+        images = cls.results.get(url)
+        return images[0] if len(images) == 1 else None
+
 
 MockSubmission = namedtuple('MockSubmission', ('id', 'score', 'created_utc'))
 foo = MockSubreddit('foo', [
@@ -105,7 +113,115 @@ def test_info_from_submission():
     assert extracted['nsfw'] == test_submission.over_18
     assert extracted['link'] == test_submission.permalink
     assert extracted['date'] == test_submission.created
-    assert extracted['images'] == ['a']
+    assert extracted['images'] == ('a',)
+    assert 'images_id' not in extracted
+
+
+class MockPipeline():
+    def __init__(self, ready=True):
+        self.ready = ready
+        self.rendering = Future()
+
+    def submit(self, urls):
+        variants = [({'url': '/variants/' + x, 'width': 1, 'height': 1},)
+                    for x in urls]
+        if self.ready:
+            self.rendering.set_result(variants)
+        else:
+            self.rendering.variants = variants
+        return self.rendering
+
+
+@pytest.fixture()
+def variant_submission():
+    Submission = namedtuple('Submission', ['url', 'score', 'title',
+                                           'over_18', 'permalink',
+                                           'subreddit', 'created'])
+    return Submission('http://test.com/2', 1, '', False, '',
+                      MockSubreddit('test'), 0.0)
+
+
+def test_resolve_timed_by_manager(monkeypatch, variant_submission):
+    monkeypatch.setattr(reddit.metrics, 'ENABLED', True)
+    reddit._info(variant_submission, MockSourceManager, False)
+
+    labels = [x[1] for x in reddit.RESOLVE.samples()
+              if x[0] == 'rstream_resolve_seconds_count']
+    assert '{manager="MockSourceManager",deferred="false"}' in labels
+
+
+def test_info_from_submission_variants(variant_submission):
+    extracted = reddit.info_from_submission(variant_submission,
+                                            MockSourceManager(),
+                                            variants=MockPipeline())
+
+    assert extracted['images'] == ('a', 'b')
+    assert [x[0]['url'] for x in extracted['variants']] == ['/variants/a',
+                                                            '/variants/b']
+
+
+def test_info_from_submission_variants_rendered_later(variant_submission):
+    pipeline = MockPipeline(ready=False)
+    extracted = reddit.info_from_submission(variant_submission,
+                                            MockSourceManager(),
+                                            variants=pipeline)
+    assert 'variants' not in extracted
+
+    pipeline.rendering.set_result(pipeline.rendering.variants)
+    assert [x[0]['url'] for x in extracted['variants']] == ['/variants/a',
+                                                            '/variants/b']
+
+
+@pytest.mark.parametrize('url,preview', [
+    ('http://test.com/1', ['a']),
+    # Several images, so nothing can be previewed without resolving
+    ('http://test.com/3', []),
+])
+def test_info_from_submission_deferred(monkeypatch, url, preview):
+    MockSubmission = namedtuple('MockSubmission', ['id', 'url', 'score',
+                                                   'title', 'over_18',
+                                                   'permalink', 'subreddit',
+                                                   'created'])
+    test_submission = MockSubmission(
+        id='abc123',
+        url=url,
+        score=23,
+        title='Test Submission in Test Subreddit',
+        over_18=False,
+        permalink='http://test.com/test',
+        subreddit=MockSubreddit('Test Subreddit'),
+        created=12345.0
+    )
+    monkeypatch.setattr(reddit, 'DEFERRED_IMAGES', {})
+
+    extracted = reddit.info_from_submission(test_submission,
+                                            MockSourceManager(),
+                                            deferred=True)
+
+    assert extracted['images'] == tuple(preview)
+    assert extracted['images_id'] == 'abc123'
+    assert reddit.deferred_images('abc123') == MockSourceManager.results[url]
+    assert reddit.deferred_images('doesntexist') is None
+
+
+def test_restore_deferred(monkeypatch):
+    class Registry():
+        def route(self, url):
+            if url in MockSourceManager.results:
+                return MockSourceManager
+            return None
+
+    monkeypatch.setattr(reddit, 'DEFERRED_IMAGES', {})
+    monkeypatch.setattr(reddit.source_managers, 'registry', Registry)
+    reddit.restore_deferred([
+        {'url': 'http://test.com/2', 'images_id': 'two'},
+        {'url': 'http://unsupported.com', 'images_id': 'other'},
+        {'url': 'http://test.com/3'},
+    ])
+
+    assert reddit.deferred_images('two') == ['a', 'b']
+    assert reddit.deferred_images('other') is None
+    assert list(reddit.DEFERRED_IMAGES) == ['two']
 
 
 def test_submission_filter(monkeypatch):
@@ -135,7 +251,8 @@ def test_submission_filter(monkeypatch):
                         [MockSourceManager])
     monkeypatch.setattr(reddit,
                         'info_from_submission',
-                        lambda x, y: MockSourceManager.get_images(x.url))
+                        lambda x, y, **kwargs: MockSourceManager.get_images(
+                            x.url))
 
     # Get a filtered content stream
     filtered = reddit.submission_filter(mock_iterable())
@@ -151,6 +268,180 @@ def test_submission_filter(monkeypatch):
         next(filtered)
 
 
+@pytest.mark.parametrize('url, deferred, offline', [
+    ('http://i.imgur.com/foo.jpg', False, True),
+    ('http://imgur.com/foo', False, True),
+    ('http://imgur.com/a/foo', False, False),
+    ('http://imgur.com/a/foo', True, True),
+])
+def test_offline_resolutions(url, deferred, offline):
+    HasUrl = namedtuple('HasUrl', ['url'])
+    manager = reddit.source_managers.registry().route(url)
+    assert reddit._offline(HasUrl(url), manager, deferred) is offline
+
+
+def test_submission_filter_dedup(monkeypatch):
+    HasUrl = namedtuple('HasUrl', ['url'])
+    resolved = []
+
+    def resolve(submission, manager, **kwargs):
+        resolved.append(submission.url)
+        return submission.url
+
+    monkeypatch.setattr(reddit.source_managers,
+                        'SOURCE_MANAGERS',
+                        [reddit.source_managers.ImgurManager])
+    monkeypatch.setattr(reddit, 'info_from_submission', resolve)
+
+    submissions = [HasUrl('http://imgur.com/a/foo'),
+                   HasUrl('http://i.imgur.com/bar.gifv'),
+                   HasUrl('https://i.imgur.com/a/foo/'),  # Crosspost
+                   HasUrl('http://imgur.com/bar')]  # Repost
+    filtered = reddit.submission_filter(iter(submissions), dedup=True)
+
+    assert list(filtered) == ['http://imgur.com/a/foo',
+                              'http://i.imgur.com/bar.gifv']
+    assert resolved == ['http://imgur.com/a/foo',
+                        'http://i.imgur.com/bar.gifv']
+
+
+class TestPipelinedSubmissionFilter():
+    HasUrl = namedtuple('HasUrl', ['url', 'delay'])
+
+    @pytest.fixture(autouse=True)
+    def slow_resolution(self, monkeypatch):
+        """Resolves a submission to its url after sleeping for its delay"""
+        self.active = {}
+        self.peak = {}
+        lock = threading.Lock()
+
+        def resolve(submission, manager, **kwargs):
+            host = submission.url.split('/')[2]
+            with lock:
+                self.active[host] = self.active.get(host, 0) + 1
+                self.peak[host] = max(self.peak.get(host, 0),
+                                      self.active[host])
+            time.sleep(submission.delay)
+            with lock:
+                self.active[host] -= 1
+            return submission.url
+
+        class AcceptAll(MockSourceManager):
+            @classmethod
+            def match(cls, url):
+                return True
+
+        monkeypatch.setattr(reddit.source_managers,
+                            'SOURCE_MANAGERS',
+                            [AcceptAll])
+        monkeypatch.setattr(reddit, 'info_from_submission', resolve)
+
+    def test_keeps_order(self):
+        submissions = [self.HasUrl('http://{}.com/{}'.format(x, x), delay)
+                       for x, delay in enumerate([0.2, 0.0, 0.1, 0.0])]
+        filtered = reddit.submission_filter(iter(submissions), window=4)
+        assert list(filtered) == [x.url for x in submissions]
+
+    def test_completion_order(self):
+        submissions = [self.HasUrl('http://slow.com/1', 0.3),
+                       self.HasUrl('http://fast.com/2', 0.0)]
+        filtered = reddit.submission_filter(iter(submissions),
+                                            window=2,
+                                            ordered=False)
+        assert list(filtered) == ['http://fast.com/2', 'http://slow.com/1']
+
+    def test_per_host_limit(self, monkeypatch):
+        monkeypatch.setattr(reddit, 'PER_HOST_LIMIT', 2)
+        monkeypatch.setattr(reddit, '_host_dispatcher',
+                            reddit.HostDispatcher())
+        submissions = [self.HasUrl('http://limited.com/{}'.format(x), 0.05)
+                       for x in range(8)]
+        filtered = reddit.submission_filter(iter(submissions), window=8)
+
+        assert len(list(filtered)) == 8
+        assert self.peak['limited.com'] == 2
+
+    def test_slow_host_does_not_starve_others(self, monkeypatch):
+        monkeypatch.setattr(reddit, 'PER_HOST_LIMIT', 1)
+        monkeypatch.setattr(reddit, 'RESOLVE_WORKERS', 2)
+        monkeypatch.setattr(reddit, '_pools', {})
+        monkeypatch.setattr(reddit, '_host_dispatcher',
+                            reddit.HostDispatcher())
+        submissions = [self.HasUrl('http://slow.com/{}'.format(x), 0.3)
+                       for x in range(3)]
+        submissions.append(self.HasUrl('http://fast.com/1', 0.0))
+
+        start = time.monotonic()
+        filtered = reddit.submission_filter(iter(submissions), window=4,
+                                            ordered=False)
+        assert next(filtered) == 'http://fast.com/1'
+        assert time.monotonic() - start < 0.25
+        assert len(list(filtered)) == 3
+        reddit._pools['resolve'].shutdown()
+
+
+class TestFetchScheduler():
+    @pytest.fixture()
+    def blocked(self):
+        """Scheduler whose only worker is busy until the event is set"""
+        scheduler = reddit.FetchScheduler(workers=1)
+        release = threading.Event()
+        started = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        scheduler.submit(lambda: 0, block)
+        started.wait(5)
+        yield scheduler, release
+        release.set()
+
+    def test_most_urgent_first(self, blocked):
+        scheduler, release = blocked
+        order = []
+        futures = [scheduler.submit(lambda p=priority: p, order.append, name)
+                   for name, priority in (('later', (2, 0.0)),
+                                          ('soonest', (0, 0.5)),
+                                          ('sooner', (0, 0.9)),
+                                          ('tied', (2, 0.0)))]
+        release.set()
+        for future in futures:
+            future.result(5)
+        assert order == ['soonest', 'sooner', 'later', 'tied']
+
+    def test_priority_evaluated_when_dispatched(self, blocked):
+        scheduler, release = blocked
+        urgency = {'first': 0, 'second': 1}
+        order = []
+        futures = [scheduler.submit(lambda x=name: urgency[x], order.append,
+                                    name)
+                   for name in ('first', 'second')]
+        urgency['second'] = -1
+        release.set()
+        for future in futures:
+            future.result(5)
+        assert order == ['second', 'first']
+
+    def test_exception_is_raised_from_result(self):
+        scheduler = reddit.FetchScheduler(workers=1)
+        future = scheduler.submit(lambda: 0, lambda: 1 / 0)
+        with pytest.raises(ZeroDivisionError):
+            future.result(5)
+
+    def test_merge_ranks(self):
+        heap = [reddit._MergeEntry(key, index, None)
+                for index, key in enumerate((9, 5, 1))]
+        ranks = reddit._MergeRanks(heap)
+        assert [ranks.rank(x) for x in heap] == [0.0, 0.5, 1.0]
+
+        # Kept until the heap is reported changed
+        heap[0].key = 0
+        assert ranks.rank(heap[0]) == 0.0
+        ranks.changed()
+        assert [ranks.rank(x) for x in heap] == [1.0, 0.0, 0.5]
+
+
 class TestSubredditsStream():
     def _identity(self, name):
         return name
@@ -183,6 +474,290 @@ class TestSubredditsStream():
         results = [x.id for x in stream_by_date]
         assert results == order_by_created_utc
 
+    @pytest.mark.parametrize('read_ahead', [1, 2, 5])
+    def test_stream_order_with_read_ahead(self, monkeypatch, read_ahead):
+        monkeypatch.setattr(reddit.REDDIT, 'get_subreddit', self._identity)
+        stream = reddit.SubredditsStream(mock_subs,
+                                         key=lambda x: x.score,
+                                         func='get_hot',
+                                         read_ahead=read_ahead)
+
+        results = [x.id for x in stream]
+        assert results == order_by_score
+
+    @pytest.mark.parametrize('read_ahead', [0, 150])
+    def test_only_pages_are_scheduled(self, monkeypatch, read_ahead):
+        Submission = namedtuple('Submission', ['score'])
+        subreddit = MockSubreddit('paged', [Submission(x)
+                                            for x in range(250, 0, -1)])
+        monkeypatch.setattr(reddit.REDDIT, 'get_subreddit', self._identity)
+        scheduler = reddit.fetch_scheduler()
+        fetches = []
+
+        def submit(priority, func, count):
+            fetches.append(count)
+            return scheduler.submit(priority, func, count)
+
+        monkeypatch.setattr(reddit, 'fetch_scheduler',
+                            lambda: namedtuple('Scheduler', 'submit')(submit))
+        stream = reddit.SubredditsStream([subreddit], key=lambda x: x.score,
+                                         func='get_hot',
+                                         read_ahead=read_ahead)
+
+        assert len(list(stream)) == 250
+        size = reddit._fetch_size(read_ahead)
+        assert fetches == [size] * -(-250 // size)
+
+    def test_wrappers_keep_subreddit_order(self, stream_by_score):
+        assert [x.subreddit for x in stream_by_score.subs] == list(mock_subs)
+
+    def test_empty_subreddit_is_expended(self, monkeypatch):
+        monkeypatch.setattr(reddit.REDDIT, 'get_subreddit', self._identity)
+        wrapped = reddit.SubredditsStream.SubredditWrapper(
+            MockSubreddit('empty'), 'get_hot', read_ahead=2)
+
+        assert wrapped.next_submission is None
+        with pytest.raises(StopIteration):
+            next(wrapped)
+
+    def test_resume_after(self, monkeypatch):
+        queried = {}
+
+        class ResumableSubreddit(MockSubreddit):
+            def get_hot(self, limit, params=None):
+                queried[self.name] = params
+                return iter(self.submissions)
+
+        subs = [ResumableSubreddit(x.name, x.submissions) for x in mock_subs]
+        monkeypatch.setattr(reddit.REDDIT, 'get_subreddit', self._identity)
+        reddit.SubredditsStream(subs, key=lambda x: x.score, func='get_hot',
+                                after={subs[1]: 't3_bar3'})
+
+        assert queried == {'foo': None,
+                           'bar': {'after': 't3_bar3'},
+                           'baz': None}
+
+    def test_exhausted_subs_leave_heap(self, stream_by_score):
+        list(stream_by_score)
+        assert not stream_by_score._heap
+        with pytest.raises(StopIteration):
+            next(stream_by_score)
+
+    def test_ties_go_to_first_listed(self, monkeypatch):
+        tied = [MockSubreddit(name, [
+            MockSubmission(id=name + '2', score=2, created_utc=0.0),
+            MockSubmission(id=name + '1', score=1, created_utc=0.0)
+        ]) for name in ('first', 'second', 'third')]
+        monkeypatch.setattr(reddit.REDDIT, 'get_subreddit', self._identity)
+        stream = reddit.SubredditsStream(tied,
+                                         key=lambda x: x.score,
+                                         func='get_hot')
+
+        results = [x.id for x in stream]
+        assert results == ['first2', 'second2', 'third2',
+                           'first1', 'second1', 'third1']
+
+    @pytest.mark.parametrize('window, expected', [
+        # A window at a time, each ranked on its own
+        (1, ['baz3', 'bar3', 'foo3', 'baz2', 'bar2', 'foo2',
+             'baz1', 'bar1', 'foo1']),
+        (2, ['baz3', 'bar3', 'foo3', 'baz2', 'bar2', 'foo2',
+             'baz1', 'bar1', 'foo1']),
+        # Every listing fits in one window, ranked as a whole
+        (5, order_by_score),
+    ])
+    def test_ranked_stream(self, monkeypatch, window, expected):
+        class ByScore():
+            def __init__(self):
+                self.window = window
+
+            def rank(self, submissions, groups):
+                assert len(submissions) == len(groups)
+                return sorted(submissions, key=lambda x: -x.score)
+
+        monkeypatch.setattr(reddit.REDDIT, 'get_subreddit', self._identity)
+        stream = reddit.SubredditsStream(mock_subs,
+                                         key=lambda x: x.created_utc,
+                                         func='get_hot', ranker=ByScore())
+
+        assert [x.id for x in stream] == expected
+        assert not stream._heap
+
+
+class TestCombinedListings():
+    def test_chunked_by_name_length(self, monkeypatch):
+        monkeypatch.setattr(reddit, 'COMBINED_NAME_LIMIT', 7)
+        listings = reddit.combined_listings(['aaa', 'bbb', 'cc', 'dddddddd'])
+        assert listings == [('aaa+bbb', None), ('cc', None),
+                            ('dddddddd', None)]
+
+    def test_chunked_by_count(self, monkeypatch):
+        monkeypatch.setattr(reddit, 'COMBINED_SUBREDDIT_LIMIT', 2)
+        listings = reddit.combined_listings(['a', 'b', 'c'])
+        assert [x for x, __ in listings] == ['a+b', 'c']
+
+    def test_resumes_after_latest_member(self, monkeypatch):
+        monkeypatch.setattr(reddit, 'COMBINED_SUBREDDIT_LIMIT', 2)
+        after = {'b': 't3_b', 'c': 't3_c', 'a': 't3_a'}
+        listings = reddit.combined_listings(['a', 'b', 'c', 'd'], after)
+        assert listings == [('a+b', 't3_a'), ('c+d', 't3_c')]
+
+    def test_stream_merges_combined_listings(self, monkeypatch):
+        listings = {'foo+bar': MockSubreddit('foo+bar', sorted(
+            foo.submissions + bar.submissions, key=lambda x: -x.score)),
+                    'baz': baz}
+        requested = []
+
+        def get_subreddit(name):
+            requested.append(name)
+            return listings[name]
+
+        monkeypatch.setattr(reddit, 'COMBINED_SUBREDDIT_LIMIT', 2)
+        monkeypatch.setattr(reddit.REDDIT, 'get_subreddit', get_subreddit)
+        stream = reddit.SubredditsStream(['foo', 'bar', 'baz'],
+                                         key=lambda x: x.score,
+                                         func='get_hot', combined=True)
+
+        assert sorted(requested) == ['baz', 'foo+bar']
+        assert [x.id for x in stream] == order_by_score
+
+
+class TestFollow():
+    Posted = namedtuple('Posted', ('id', 'fullname', 'created_utc'))
+
+    class FollowedSubreddit(MockSubreddit):
+        """Lists `submissions` newest first, recording each query's params"""
+        def __init__(self, name, submissions):
+            super().__init__(name, submissions)
+            self.queries = []
+
+        def get_new(self, limit, params=None):
+            self.queries.append(params)
+            listed = sorted(self.submissions, key=lambda x: -x.created_utc)
+            if params and 'after' in params:
+                names = [x.fullname for x in listed]
+                listed = listed[names.index(params['after']) + 1:]
+            return iter(listed[:limit])
+
+    @pytest.fixture()
+    def subreddit(self, monkeypatch):
+        monkeypatch.setattr(reddit, 'FOLLOW_MIN_INTERVAL', 0)
+        monkeypatch.setattr(reddit, 'FOLLOW_MAX_INTERVAL', 0)
+        monkeypatch.setattr(reddit.REDDIT, 'get_subreddit', lambda x: x)
+        return self.FollowedSubreddit('new', [
+            self.Posted('2', 't3_2', 2.0), self.Posted('1', 't3_1', 1.0)])
+
+    def test_merges_new_submissions(self, subreddit):
+        stream = reddit.SubredditsStream([subreddit],
+                                         key=lambda x: x.created_utc,
+                                         func='get_new', follow=True)
+        assert [next(stream).id for __ in range(2)] == ['2', '1']
+
+        subreddit.submissions.extend([self.Posted('4', 't3_4', 4.0),
+                                      self.Posted('3', 't3_3', 3.0)])
+        assert [next(stream).id for __ in range(2)] == ['4', '3']
+        assert subreddit.queries[-1] == {'before': 't3_2'}
+        assert stream.followers[0].newest == (4.0, 't3_4')
+
+    def test_caught_up_stream_gives_idle(self, monkeypatch, subreddit):
+        monkeypatch.setattr(reddit, 'FOLLOW_WAIT', 0.05)
+        stream = reddit.SubredditsStream([subreddit],
+                                         key=lambda x: x.created_utc,
+                                         func='get_new', follow=True)
+        assert [next(stream).id for __ in range(2)] == ['2', '1']
+
+        start = time.monotonic()
+        assert next(stream) is reddit.IDLE
+        assert time.monotonic() - start < 1
+        subreddit.submissions.append(self.Posted('3', 't3_3', 3.0))
+        assert next(stream).id == '3'
+
+    def test_resumed_stream_follows_from_served(self, monkeypatch,
+                                                subreddit):
+        monkeypatch.setattr(reddit.REDDIT, 'get_subreddit',
+                            lambda name: subreddit)
+        subreddit.submissions.append(self.Posted('3', 't3_3', 3.0))
+        # Resumed after t3_2, the listing's head is older than t3_3
+        stream = reddit.SubredditsStream(['new'],
+                                         key=lambda x: x.created_utc,
+                                         func='get_new', follow=True,
+                                         after={'new': 't3_2'},
+                                         newest={'new': (3.0, 't3_3')})
+        assert stream.followers[0].newest == (3.0, 't3_3')
+
+        stream.followers[0].poll()
+        assert subreddit.queries[-1] == {'before': 't3_3'}
+
+    def test_polls_do_not_hold_up_merge(self, subreddit):
+        listing = subreddit.get_new
+
+        def slow_poll(limit, params=None):
+            if params is not None:
+                time.sleep(0.5)
+            return listing(limit, params)
+
+        subreddit.get_new = slow_poll
+        stream = reddit.SubredditsStream([subreddit],
+                                         key=lambda x: x.created_utc,
+                                         func='get_new', follow=True)
+        start = time.monotonic()
+        assert [next(stream).id for __ in range(2)] == ['2', '1']
+        assert time.monotonic() - start < 0.5
+        assert stream.followers[0].pending is not None
+
+        # Caught up, the stream waits on the poll in flight
+        subreddit.submissions.append(self.Posted('3', 't3_3', 3.0))
+        assert next(stream).id == '3'
+        assert stream.followers[0].pending is None
+
+    @pytest.mark.parametrize('window', [0, 4])
+    def test_filter_passes_idle(self, monkeypatch, window):
+        monkeypatch.setattr(reddit, '_match',
+                            lambda submission, seen: MockSourceManager())
+        monkeypatch.setattr(reddit, '_info',
+                            lambda submission, *args: submission.url)
+        Submission = namedtuple('Submission', ['url'])
+        filtered = reddit.submission_filter(
+            iter([Submission('http://test.com/a'), reddit.IDLE,
+                  Submission('http://test.com/b')]), window=window)
+        # Submissions before IDLE are not held back for the window
+        assert next(filtered) == 'http://test.com/a'
+        assert next(filtered) is reddit.IDLE
+        assert list(filtered) == ['http://test.com/b']
+
+    def test_unfollowed_stream_ends(self, subreddit):
+        stream = reddit.SubredditsStream([subreddit],
+                                         key=lambda x: x.created_utc,
+                                         func='get_new')
+        assert [x.id for x in stream] == ['2', '1']
+        assert not stream.followers
+
+    def test_poll_errors_find_nothing(self, subreddit):
+        def fail(limit, params=None):
+            raise errors.HTTPException(None)
+
+        follower = reddit.SubredditsStream.Follower(subreddit, (2.0, 't3_2'))
+        subreddit.get_new = fail
+        assert follower.poll() == []
+        assert follower.newest == (2.0, 't3_2')
+
+    def test_quiet_listings_back_off(self, monkeypatch):
+        monkeypatch.setattr(reddit, 'FOLLOW_BATCH', 5)
+        monkeypatch.setattr(reddit, 'FOLLOW_MIN_INTERVAL', 10)
+        monkeypatch.setattr(reddit, 'FOLLOW_MAX_INTERVAL', 100)
+        interval = reddit.PollInterval()
+        assert interval.seconds == 10
+
+        interval.update(0, 10)
+        assert interval.seconds == 20
+        interval.update(0, 20)
+        assert interval.seconds == 40
+        interval.update(50, 10)
+        assert interval.seconds == 10
+        for __ in range(10):
+            interval.update(0, 100)
+        assert interval.seconds == 100
+
 
 class TestLazilyEvaluatedWrapper():
     def test_stopiteration_on_exception(self):
@@ -221,3 +796,13 @@ class TestLazilyEvaluatedWrapper():
                                              AttributeError,
                                              sentinel='foo')
         assert safe.missing == 'foo'
+
+
+def test_lazy_reddit():
+    Client = namedtuple('Client', 'get_subreddit')
+    lazy = reddit.LazyReddit('test')
+    assert lazy.user_agent == 'test' and lazy._client is None
+
+    lazy._client = Client(get_subreddit=str.lower)
+    assert lazy.get_subreddit('Pics') == 'pics'
+    assert lazy.client() is lazy._client
@@ -0,0 +1,107 @@
+import json
+import time
+
+import pytest
+
+from rStream.libs import sessions
+from rStream.libs.records import SubmissionRecord
+
+
+def record(fullname, subreddit):
+    return SubmissionRecord(url='http://test.com/', score=1, title='',
+                            nsfw=False, link='', subreddit=subreddit,
+                            date=0.0, fullname=fullname)
+
+
+@pytest.fixture()
+def cursor():
+    return sessions.StreamCursor(['aww', 'cute'], 'get_hot', 'score')
+
+
+class TestStreamCursor():
+    def test_advance(self, cursor):
+        cursor.advance([record('t3_1', 'aww'), record('t3_2', 'Cute'),
+                        record('t3_3', 'aww')])
+        assert cursor.after == {'cute': 't3_2', 'aww': 't3_3'}
+        # Most recently served subreddit last
+        assert list(cursor.after) == ['cute', 'aww']
+        assert list(cursor.emitted) == ['t3_1', 't3_2', 't3_3']
+
+    def test_records_without_fullname_ignored(self, cursor):
+        cursor.advance([{'subreddit': 'aww'}])
+        assert not cursor.after
+        assert not cursor.emitted
+
+    def test_emitted_is_bounded(self, monkeypatch):
+        monkeypatch.setattr(sessions, 'EMITTED_LIMIT', 2)
+        cursor = sessions.StreamCursor(['aww'], 'get_hot', 'score')
+        cursor.advance([record('t3_{}'.format(x), 'aww') for x in range(5)])
+        assert list(cursor.emitted) == ['t3_3', 't3_4']
+
+    def test_json_round_trip(self, cursor):
+        cursor.advance([record('t3_1', 'cute'), record('t3_2', 'aww')])
+        restored = sessions.StreamCursor.from_json(cursor.to_json())
+
+        assert restored.subreddits == ('aww', 'cute')
+        assert restored.func == 'get_hot'
+        assert restored.key == 'score'
+        assert restored.deferred is False
+        assert restored.combined is False
+        assert restored.follow is False
+        assert list(restored.after.items()) == list(cursor.after.items())
+        assert list(restored.emitted) == list(cursor.emitted)
+
+    def test_follow_keeps_newest_served(self):
+        cursor = sessions.StreamCursor(['aww'], 'get_new', 'created_utc',
+                                       follow=True)
+        records = [record('t3_{}'.format(x), 'aww') for x in (2, 3, 1)]
+        for served in records:
+            served.created_utc = float(served.fullname[-1])
+        cursor.advance(records)
+        assert cursor.after == {'aww': 't3_1'}
+        assert cursor.newest == {'aww': (3.0, 't3_3')}
+
+        restored = sessions.StreamCursor.from_json(cursor.to_json())
+        assert restored.newest == cursor.newest
+
+    def test_json_without_combined(self, cursor):
+        state = json.loads(cursor.to_json())
+        del state['combined']
+        restored = sessions.StreamCursor.from_json(json.dumps(state))
+        assert restored.combined is False
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'file'])
+def make_store(request, tmp_path):
+    def make(timeout=sessions.TIMEOUT):
+        if request.param == 'memory':
+            return sessions.MemorySessionStore(timeout=timeout)
+        if request.param == 'sqlite':
+            path = str(tmp_path / 'sessions.sqlite')
+            return sessions.SqliteSessionStore(path, timeout=timeout)
+        return sessions.FileSessionStore(str(tmp_path / 'sessions'),
+                                         timeout=timeout)
+    return make
+
+
+class TestSessionStores():
+    def test_put_and_get(self, make_store, cursor):
+        store = make_store()
+        cursor.advance([record('t3_1', 'aww')])
+        store.put('foo', cursor)
+        assert store.get('foo').after == {'aww': 't3_1'}
+
+    def test_get_missing(self, make_store):
+        assert make_store().get('doesntexist') is None
+
+    def test_delete(self, make_store, cursor):
+        store = make_store()
+        store.put('foo', cursor)
+        store.delete('foo')
+        assert store.get('foo') is None
+
+    def test_expiry(self, make_store, cursor):
+        store = make_store(timeout=0.2)
+        store.put('foo', cursor)
+        time.sleep(0.5)
+        assert store.get('foo') is None
@@ -0,0 +1,107 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+
+import pytest
+
+from rStream.libs import snapshot
+from rStream.libs.records import SubmissionRecord
+
+
+def record(link, **kwargs):
+    return SubmissionRecord(url='http://i.imgur.com/{}.jpg'.format(link),
+                            score=1, title=link, nsfw=False, link=link,
+                            subreddit='aww', date=0.0, fullname='t3_' + link,
+                            **kwargs)
+
+
+@pytest.fixture()
+def store(tmp_path):
+    return snapshot.SnapshotStore(str(tmp_path), size=2)
+
+
+KEY = (('aww', 'cute'), 'get_hot', 'score', False)
+
+
+class TestSnapshotStore():
+    def test_round_trip(self, store):
+        saved = [record('a', images=['x', 'y']),
+                 record('b', images_id='b', variants=[({'url': 'v'},)])]
+        store.save(KEY, saved)
+        loaded = store.load(KEY)
+
+        # Nested tuples come back as lists, which serve the same
+        assert ([json.dumps(dict(x)) for x in loaded]
+                == [json.dumps(dict(x)) for x in saved])
+        assert [x.fullname for x in loaded] == ['t3_a', 't3_b']
+
+    def test_missing(self, store):
+        assert store.load(KEY) is None
+        assert store.load(['other']) is None
+
+    def test_expired(self, store, monkeypatch):
+        store.save(KEY, [record('a')])
+        monkeypatch.setattr(store, 'max_age', 0)
+        assert store.load(KEY) is None
+
+    def test_unknown_columns_ignored(self, store):
+        store.save(KEY, [record('a')])
+        path = store._path(KEY)
+        with open(path) as source:
+            state = json.load(source)
+        state['columns'].append('added')
+        state['records'][0].append('value')
+        with open(path, 'w') as target:
+            json.dump(state, target)
+
+        assert store.load(KEY)[0]['link'] == 'a'
+
+    def test_recording_saves_head(self, store):
+        records = [record(x) for x in 'abc']
+        recorded = store.recording(KEY, iter(records))
+
+        assert next(recorded)['link'] == 'a'
+        assert store.load(KEY) is None
+        assert next(recorded)['link'] == 'b'
+        assert [x['link'] for x in store.load(KEY)] == ['a', 'b']
+        assert list(recorded) == records[2:]
+
+    def test_recording_short_feed(self, store):
+        list(store.recording(KEY, iter([record('a')])))
+        assert [x['link'] for x in store.load(KEY)] == ['a']
+
+
+class TestRevalidatingStream():
+    @pytest.fixture()
+    def pool(self):
+        pool = ThreadPoolExecutor(1)
+        yield pool
+        pool.shutdown()
+
+    def test_serves_stale_until_fresh(self, pool):
+        ready = threading.Event()
+
+        def factory():
+            ready.wait(5)
+            return iter([record(x) for x in 'xab'])
+
+        stream = snapshot.RevalidatingStream([record('a'), record('b')],
+                                             factory, size=2, pool=pool)
+        assert next(stream)['link'] == 'a'
+        ready.set()
+        pool.shutdown()  # Waits for the refresh
+        # Already served from the snapshot, 'a' is skipped
+        assert [x['link'] for x in stream] == ['x', 'b']
+
+    def test_waits_for_fresh_without_stale(self, pool):
+        stream = snapshot.RevalidatingStream(
+            [], lambda: iter([record('a')]), pool=pool)
+        assert [x['link'] for x in stream] == ['a']
+
+    def test_refresh_errors_raised(self, pool):
+        def factory():
+            raise RuntimeError('down')
+
+        stream = snapshot.RevalidatingStream([], factory, pool=pool)
+        with pytest.raises(RuntimeError):
+            next(stream)
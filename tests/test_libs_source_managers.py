@@ -1,10 +1,16 @@
-from contextlib import contextmanager
 import json
-from urllib import parse, request
+from urllib import parse
 
 import pytest
 
-from rStream.libs import source_managers
+from rStream.libs import http_client, source_managers
+
+
+@pytest.fixture(autouse=True)
+def empty_resolution_cache():
+    source_managers.RESOLUTION_CACHE.clear()
+    yield
+    source_managers.RESOLUTION_CACHE.clear()
 
 
 @pytest.mark.parametrize('test_url,expected_extension', [
@@ -23,13 +29,37 @@ def test_ext_from_url(test_url, expected_extension):
     assert source_managers.ext_from_url(test_url) == expected_extension
 
 
+@pytest.mark.parametrize('urls', [
+    ['http://i.imgur.com/foo.gifv', 'https://imgur.com/foo',
+     'http://www.imgur.com/foo.gif?1', 'http://m.imgur.com/foo/'],
+    ['http://imgur.com/a/foo', 'https://i.imgur.com/a/foo/#0'],
+    ['http://gfycat.com/Foo', 'http://giant.gfycat.com/Foo.gif',
+     'https://www.gfycat.com/Foo.webm'],
+    ['http://test.com/foo.gifv', 'https://www.test.com/foo.gif?bar=baz'],
+])
+def test_canonical_url_of_duplicates(urls):
+    canonical = {source_managers.canonical_url(x) for x in urls}
+    assert len(canonical) == 1
+
+
+@pytest.mark.parametrize('first,second', [
+    ('http://imgur.com/foo', 'http://imgur.com/a/foo'),
+    ('http://test.com/foo.jpg', 'http://test.com/foo.png'),
+    ('http://test.com/foo.jpg', 'http://other.com/foo.jpg'),
+])
+def test_canonical_url_of_different_content(first, second):
+    assert (source_managers.canonical_url(first) !=
+            source_managers.canonical_url(second))
+
+
 class TestDirectLinkManager():
     @pytest.fixture()
     def manager(self):
         return source_managers.DirectLinkManager()
 
-    def test_config_on_instantiation(self, mocker):
+    def test_config_on_instantiation(self, monkeypatch, mocker):
         '''Ensure that the configure method is called on first instantiation'''
+        monkeypatch.setattr(source_managers.DirectLinkManager, '_config', None)
         mocker.spy(source_managers.DirectLinkManager, 'configure')
         source_managers.DirectLinkManager()
         source_managers.DirectLinkManager()
@@ -197,11 +227,10 @@ class TestImgurManager():
 
                 return bytes(result, 'utf8')
 
-        @contextmanager
-        def mock_urlopen(*args, **kwargs):
-            yield MockResponse()
+        def mock_get_json(*args, **kwargs):
+            return json.loads(MockResponse().read().decode())
 
-        monkeypatch.setattr(request, 'urlopen', mock_urlopen)
+        monkeypatch.setattr(http_client.CLIENT, 'get_json', mock_get_json)
 
         results = manager.get_images(url)
 
@@ -212,7 +241,7 @@ class TestImgurManager():
             result = list(manager.get_images(url))
             assert result == images
 
-    def test_get_images(self, mocker, monkeypatch, manager):
+    def test_get_images(self, monkeypatch, mocker, manager):
         '''Ensures that get_images routes properly to support methods'''
         mocker.spy(source_managers.ImgurManager, '_get_single_image')
         image_url = 'http://i.imgur.com/Foo.bar'
@@ -227,6 +256,28 @@ class TestImgurManager():
         next(manager.get_images(album_url))
         assert source_managers.ImgurManager._get_album.call_count == 1
 
+    def test_album_resolved_once(self, monkeypatch, manager):
+        calls = []
+
+        class MockResponse():
+            def read(*args, **kwargs):
+                result = {'data': {'images': [{'hash': '1', 'ext': '.ext'}]}}
+                return bytes(json.dumps(result), 'utf8')
+
+        def mock_get_json(url, *args, **kwargs):
+            calls.append(url)
+            return json.loads(MockResponse().read().decode())
+
+        monkeypatch.setattr(http_client.CLIENT, 'get_json', mock_get_json)
+
+        # The same album, crossposted with a different url
+        first = list(manager.get_images('http://imgur.com/a/foo'))
+        second = list(manager.get_images('http://i.imgur.com/a/foo/'))
+
+        assert first == second == ['http://i.imgur.com/1.ext']
+        assert len(calls) == 1
+        assert source_managers.RESOLUTION_CACHE.stats()['hits'] == 1
+
 
 class TestDeviantArtManager():
     @pytest.fixture()
@@ -266,11 +317,10 @@ class TestDeviantArtManager():
 
                 return bytes(result, 'utf8')
 
-        @contextmanager
-        def mock_urlopen(*args, **kwargs):
-            yield MockResponse()
+        def mock_get_json(*args, **kwargs):
+            return json.loads(MockResponse().read().decode())
 
-        monkeypatch.setattr(request, 'urlopen', mock_urlopen)
+        monkeypatch.setattr(http_client.CLIENT, 'get_json', mock_get_json)
 
         results = manager.get_images(url)
 
@@ -281,3 +331,73 @@ class TestDeviantArtManager():
             assert next(results) == image
             with pytest.raises(StopIteration):
                 next(results)
+
+
+class TestManagerRegistry():
+    @pytest.fixture()
+    def registry(self):
+        return source_managers.ManagerRegistry(source_managers.SOURCE_MANAGERS)
+
+    @pytest.mark.parametrize('url,manager', [
+        ('http://test.com/foo.jpg', source_managers.DirectLinkManager),
+        # Matched by DirectLinkManager and GfycatManager, first listed wins
+        ('http://giant.gfycat.com/Foo.gif', source_managers.DirectLinkManager),
+        ('http://giant.gfycat.com/Foo.webm', source_managers.GfycatManager),
+        ('http://gfycat.com/Foo', source_managers.GfycatManager),
+        ('http://i.imgur.com/foo.jpg', source_managers.DirectLinkManager),
+        ('http://imgur.com/a/foo', source_managers.ImgurManager),
+        ('http://imgur.com:80/foo', source_managers.ImgurManager),
+        ('http://foo.deviantart.com/art/bar-123456',
+            source_managers.DeviantArtManager),
+        ('http://imgur.com/', None),
+        ('http://test.com/foo', None),
+    ])
+    def test_route(self, registry, url, manager):
+        assert registry.route(url) is manager
+
+    def test_route_agrees_with_match(self, registry):
+        urls = ['http://test.com/foo.png', 'http://gfycat.com/Foo',
+                'http://imgur.com/foo', 'http://deviantart.com/art/bar-1',
+                'http://test.com/', 'http://giant.gfycat.com/Foo']
+        for url in urls:
+            matching = [x for x in registry.managers if x.match(url)]
+            expected = matching[0] if matching else None
+            assert registry.route(url) is expected
+
+    def test_unindexed_managers_use_match(self):
+        class CatchAll():
+            @classmethod
+            def match(cls, url):
+                return True
+
+        registry = source_managers.ManagerRegistry(
+            [source_managers.ImgurManager, CatchAll])
+        assert registry.route('http://imgur.com/foo') is \
+            source_managers.ImgurManager
+        assert registry.route('http://test.com/') is CatchAll
+
+    def test_registry_follows_source_managers(self, monkeypatch):
+        monkeypatch.setattr(source_managers, 'SOURCE_MANAGERS',
+                            [source_managers.ImgurManager])
+        assert source_managers.registry().managers == \
+            (source_managers.ImgurManager,)
+
+
+@pytest.mark.parametrize('url,preview', [
+    ('http://test.com/foo.jpg', 'http://test.com/foo.jpg'),
+    ('http://gfycat.com/Foo', 'http://giant.gfycat.com/Foo.gif'),
+    ('http://imgur.com/foo', 'http://i.imgur.com/foo'),
+    # Albums and deviations need the network, unless already resolved
+    ('http://imgur.com/a/foo', None),
+    ('http://foo.deviantart.com/art/bar-123456', None),
+])
+def test_preview(url, preview):
+    manager = source_managers.registry().route(url)
+    assert manager.preview(url) == preview
+
+
+def test_preview_from_resolved_album():
+    source_managers.RESOLUTION_CACHE.set('imgur:album:foo', [
+        'http://i.imgur.com/1.ext', 'http://i.imgur.com/2.ext'])
+    preview = source_managers.ImgurManager.preview('http://imgur.com/a/foo')
+    assert preview == 'http://i.imgur.com/1.ext'
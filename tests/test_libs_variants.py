@@ -0,0 +1,159 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+import io
+import os
+
+import pytest
+
+from rStream.libs import http_client, variants
+
+Image = pytest.importorskip('PIL.Image')
+
+RENDER_WAIT = 30  # Seconds a test waits for a background render
+
+
+def encoded(size=(800, 600), fmt='PNG', frames=1):
+    target = io.BytesIO()
+    images = [Image.new('RGB', size, (x * 40, 0, 0)) for x in range(frames)]
+    images[0].save(target, fmt, save_all=frames > 1,
+                   append_images=images[1:])
+    return target.getvalue()
+
+
+class MockClient():
+    def __init__(self, bodies):
+        self.bodies = bodies
+        self.requested = []
+
+    def request(self, url):
+        self.requested.append(url)
+        if url not in self.bodies:
+            raise http_client.HTTPError(url, 404, 'Not Found')
+        return http_client.Response(url, 200, {}, self.bodies[url])
+
+
+def test_render_still(tmp_path):
+    source = tmp_path / 'source.png'
+    source.write_bytes(encoded((800, 600)))
+
+    rendered = variants.render(str(source), str(tmp_path), 'key',
+                               (320, 640, 1280))
+    assert rendered == [['key-320.jpg', 320, 240], ['key-640.jpg', 640, 480]]
+    with Image.open(str(tmp_path / 'key-320.jpg')) as image:
+        assert image.format == 'JPEG'
+        assert image.size == (320, 240)
+
+
+def test_render_animated(tmp_path):
+    source = tmp_path / 'source.gif'
+    source.write_bytes(encoded((400, 200), 'GIF', frames=3))
+
+    rendered = variants.render(str(source), str(tmp_path), 'key', (320,))
+    assert rendered == [['key-320.gif', 320, 160]]
+    with Image.open(str(tmp_path / 'key-320.gif')) as image:
+        assert image.n_frames == 3
+
+
+@pytest.fixture(scope='module')
+def pipeline(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp('variants'))
+    pipeline = variants.VariantPipeline(directory, '/variants/',
+                                        widths=(320,), workers=1)
+    yield pipeline
+    pipeline.close()
+
+
+def test_pipeline(monkeypatch, pipeline):
+    client = MockClient({'http://i.imgur.com/a.png': encoded(),
+                         'http://i.imgur.com/small.png': encoded((100, 80)),
+                         'http://i.imgur.com/b.mp4': b'not an image'})
+    monkeypatch.setattr(http_client, 'CLIENT', client)
+    urls = ['http://i.imgur.com/a.png', 'http://i.imgur.com/small.png',
+            'http://i.imgur.com/b.mp4', 'http://i.imgur.com/missing.png']
+
+    first, small, video, missing = pipeline.variants(urls)
+    variant, = first
+    assert variant['url'].startswith('/variants/')
+    assert (variant['width'], variant['height']) == (320, 240)
+    name = variant['url'][len('/variants/'):]
+    assert os.path.exists(os.path.join(pipeline.directory, name))
+    assert small == video == missing == ()
+
+    # Rendered images, even those without variants, are not fetched again
+    assert pipeline.variants(urls[:3]) == [first, small, video]
+    assert len(client.requested) == 4
+
+
+def test_pipeline_reads_disk_after_restart(monkeypatch, pipeline):
+    client = MockClient({'http://i.imgur.com/c.png': encoded()})
+    monkeypatch.setattr(http_client, 'CLIENT', client)
+    expected = pipeline.variants(['http://i.imgur.com/c.png'])
+
+    restarted = variants.VariantPipeline(pipeline.directory, '/variants/',
+                                         widths=(320,))
+    assert restarted.variants(['http://i.imgur.com/c.png']) == expected
+    assert len(client.requested) == 1
+
+
+class StalledPool():
+    """Process pool double whose renders finish when the test says so"""
+    def __init__(self, error=None):
+        self.error = error
+        self.futures = []
+        self.sources = []
+
+    def submit(self, func, source, *args):
+        self.sources.append(source)
+        future = Future()
+        if self.error is not None:
+            future.set_exception(self.error)
+        self.futures.append(future)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+@pytest.fixture()
+def stalled(monkeypatch, tmp_path):
+    client = MockClient({'http://i.imgur.com/a.png': encoded()})
+    monkeypatch.setattr(http_client, 'CLIENT', client)
+    return variants.VariantPipeline(str(tmp_path), '/variants/',
+                                    widths=(320,))
+
+
+def test_timeout_not_recorded(monkeypatch, stalled):
+    pool = StalledPool()
+    monkeypatch.setattr(stalled, '_process_pool', lambda: pool)
+    monkeypatch.setattr(variants, 'RENDER_TIMEOUT', 0.01)
+
+    assert stalled.variants(['http://i.imgur.com/a.png']) == [()]
+    assert stalled._load(stalled._key('http://i.imgur.com/a.png')) is None
+    # The worker may still be reading the original
+    source, = pool.sources
+    assert os.path.exists(source)
+    pool.futures[0].set_result([])
+    assert not os.path.exists(source)
+
+
+def test_broken_pool_not_recorded(monkeypatch, stalled):
+    pool = StalledPool(BrokenProcessPool('worker died'))
+    stalled._pool = pool
+    monkeypatch.setattr(stalled, '_process_pool', lambda: stalled._pool)
+
+    assert stalled.variants(['http://i.imgur.com/a.png']) == [()]
+    assert stalled._load(stalled._key('http://i.imgur.com/a.png')) is None
+    assert stalled._pool is None
+    assert not os.path.exists(pool.sources[0])
+
+
+def test_submit(monkeypatch, pipeline):
+    client = MockClient({'http://i.imgur.com/d.png': encoded()})
+    monkeypatch.setattr(http_client, 'CLIENT', client)
+    rendering = pipeline.submit(['http://i.imgur.com/d.png'])
+    (variant,), = rendering.result(RENDER_WAIT)
+
+    # Known variants are returned at once
+    known = pipeline.submit(['http://i.imgur.com/d.png'])
+    assert known.done()
+    assert known.result() == [(variant,)]